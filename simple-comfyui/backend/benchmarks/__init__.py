@@ -0,0 +1 @@
+"""Benchmarks for the graph engine and API. Run from backend/ with ``python -m benchmarks.<name>``."""
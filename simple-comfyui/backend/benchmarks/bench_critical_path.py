@@ -0,0 +1,159 @@
+"""Makespan of mixed text/image/video graphs with and without critical-path ordering.
+
+Provider calls go through the real ServiceManager and its concurrency limits, with
+the providers replaced by stubs that sleep for a simulated latency (text ~2s,
+image ~8s, video ~60s, scaled down by ``--scale``). With only a few provider
+slots, the order in which ready nodes get them decides how long a run takes.
+
+- fifo: nodes start in the order they became ready
+- defaults: ordered by the built-in latency estimates
+- learned: estimates start out equal and are learned from a warm-up pass
+
+Usage: python -m benchmarks.bench_critical_path [--graphs 20] [--slots 2]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List
+
+from src.graph_processor import GraphProcessor
+from src.latency import LatencyHistory
+from src.models import ConnectionType, Edge, GraphDefinition, Node, NodeData, NodeType
+from src.services import ServiceManager
+
+# Simulated seconds per call, before scaling
+SIMULATED_LATENCIES = {"text": 2.0, "image": 8.0, "video": 60.0}
+
+
+class StubFal:
+    def __init__(self, scale: float):
+        self.scale = scale
+    
+    async def _work(self, kind: str, label: str) -> str:
+        # +-20% jitter, as real providers are never exactly on time
+        await asyncio.sleep(SIMULATED_LATENCIES[kind] * self.scale * random.uniform(0.8, 1.2))
+        return f"http://example.com/{kind}/{label}"
+    
+    async def text_to_image(self, prompt, aspect_ratio="1:1"):
+        return await self._work("image", prompt)
+    
+    async def text_image_to_image(self, prompt, image_url):
+        return await self._work("image", prompt + image_url)
+    
+    async def text_to_video(self, prompt, aspect_ratio="16:9", resolution="720p", duration="5"):
+        return await self._work("video", prompt)
+    
+    async def image_to_video(self, image_url, prompt=None, resolution="720p", duration="5"):
+        return await self._work("video", image_url)
+
+
+class StubOpenAI(StubFal):
+    async def text_to_text(self, inputs, task="combine"):
+        return (await self._work("text", "+".join(inputs))).rsplit("/", 1)[-1]
+    
+    async def text_image_to_text(self, image_url, prompt):
+        return (await self._work("text", prompt + image_url)).rsplit("/", 1)[-1]
+    
+    async def image_to_text(self, image_url):
+        return (await self._work("text", image_url)).rsplit("/", 1)[-1]
+
+
+class FifoLatency(LatencyHistory):
+    """Every operation looks the same, so ready nodes keep their arrival order."""
+    
+    def record(self, operation, seconds):
+        pass
+    
+    def estimate(self, operation):
+        return 0.0
+
+
+def mixed_graph(rng: random.Random, branches: int) -> GraphDefinition:
+    """Independent branches of different shapes, listed in random order."""
+    nodes: List[Node] = []
+    edges: List[Edge] = []
+    
+    def add(node_type: NodeType, text: str = None, inputs=()) -> str:
+        node_id = f"n{len(nodes)}"
+        nodes.append(Node(id=node_id, type=node_type, data=NodeData(text=text)))
+        for source in inputs:
+            edges.append(Edge(id=f"e{len(edges)}", source=source, target=node_id))
+        return node_id
+    
+    for branch in range(branches):
+        shape = rng.choice(["image", "image", "describe", "video", "combine"])
+        prompt = add(NodeType.TEXT, f"prompt {branch} {rng.random()}")
+        if shape == "image":
+            add(NodeType.IMAGE, inputs=[prompt])
+        elif shape == "describe":
+            add(NodeType.TEXT, inputs=[add(NodeType.IMAGE, inputs=[prompt])])
+        elif shape == "video":
+            add(NodeType.VIDEO, inputs=[add(NodeType.IMAGE, inputs=[prompt])])
+        else:
+            style = add(NodeType.TEXT, f"style {branch} {rng.random()}")
+            add(NodeType.IMAGE, inputs=[add(NodeType.TEXT, inputs=[prompt, style])])
+    
+    order = list(range(len(nodes)))
+    rng.shuffle(order)
+    return GraphDefinition(nodes=[nodes[i] for i in order], edges=edges)
+
+
+async def makespans(processor: GraphProcessor, graphs: List[GraphDefinition]) -> List[float]:
+    timings = []
+    for graph in graphs:
+        start = time.perf_counter()
+        result = await processor.execute_graph(graph.model_copy(deep=True))
+        if not result.success:
+            raise RuntimeError(result.errors)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def make_processor(args, latency: LatencyHistory) -> GraphProcessor:
+    manager = ServiceManager(concurrency_limits={"fal": args.slots, "openai": args.slots})
+    manager.fal_service = StubFal(args.scale)
+    manager.openai_service = StubOpenAI(args.scale)
+    return GraphProcessor(manager, "http://localhost:8080", result_cache=None, latency=latency)
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    graphs = [mixed_graph(rng, args.branches) for _ in range(args.graphs)]
+    learned = make_processor(args, LatencyHistory(defaults={operation: 1.0 for operation in ConnectionType}))
+    # Warm-up pass on the same kind of graphs; only its latency history is kept
+    await makespans(learned, [mixed_graph(rng, args.branches) for _ in range(3)])
+    
+    results = {}
+    for name, processor in (
+        ("fifo", make_processor(args, FifoLatency())),
+        ("defaults", make_processor(args, LatencyHistory())),
+        ("learned", learned),
+    ):
+        random.seed(args.seed)
+        results[name] = await makespans(processor, graphs)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--graphs", type=int, default=20)
+    parser.add_argument("--branches", type=int, default=6, help="independent branches per graph")
+    parser.add_argument("--slots", type=int, default=2, help="concurrency limit per provider")
+    parser.add_argument("--scale", type=float, default=0.005, help="simulated seconds to real seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    baseline = statistics.mean(results["fifo"])
+    print(f"{'ordering':>10} {'mean':>9} {'p95':>9} {'vs fifo':>8}")
+    for name, timings in results.items():
+        mean = statistics.mean(timings)
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{name:>10} {mean * 1000:>7.0f}ms {p95 * 1000:>7.0f}ms {mean / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
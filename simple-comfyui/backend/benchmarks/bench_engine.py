@@ -0,0 +1,187 @@
+"""Makespan, scheduler overhead, memory and event rate of the graph engine.
+
+Runs generated graphs (provider chains, wide fan-out, stacked diamonds and random
+DAGs) through ``execute_graph`` and ``execute_graph_streaming`` against providers
+that answer after simulated latencies (see ``simulated.py``). For each run it
+reports:
+
+- makespan: wall-clock time from submitting the graph to its last event
+- overhead: CPU time the process spent per node; provider waits cost none, so
+  this is the engine itself (planning, scheduling, limits, tracing, metrics)
+- peak memory: most memory allocated during the run, measured in a separate
+  run under tracemalloc so that the timings are not slowed by it
+- events/s: streaming events produced per second of makespan
+
+Results can be saved with ``--output`` and compared with ``--baseline``, e.g.
+to check a change against the previous version of the engine.
+
+Usage: python -m benchmarks.bench_engine [--shapes chain random] [--sizes 100 1000]
+           [--output after.json] [--baseline before.json]
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from src.graph_processor import GraphProcessor
+from src.latency import LatencyHistory
+from src.models import GraphDefinition
+
+from .graphs import diamond_graph, fan_out_graph, provider_chain, random_dag
+from .simulated import simulated_service_manager
+
+SHAPES = {
+    "chain": provider_chain,
+    "fan_out": fan_out_graph,
+    "diamond": diamond_graph,
+    "random": random_dag,
+}
+MODES = ("execute_graph", "execute_graph_streaming")
+
+
+async def run_once(processor: GraphProcessor, graph: GraphDefinition, mode: str) -> int:
+    """Execute ``graph`` and return the number of events it produced (0 for execute_graph)."""
+    if mode == "execute_graph":
+        result = await processor.execute_graph(graph)
+        if not result.success:
+            raise RuntimeError(f"Run failed: {result.errors[:3]}")
+        return 0
+    events = 0
+    async for event in processor.execute_graph_streaming(graph):
+        events += 1
+        if event["type"] == "complete" and not event["success"]:
+            raise RuntimeError(f"Run failed: {event['errors'][:3]}")
+    return events
+
+
+def make_processor(args) -> GraphProcessor:
+    # Fresh every run: no plan or result cache carried over, so each run is cold
+    manager = simulated_service_manager(args.scale, args.seed, args.limits)
+    return GraphProcessor(manager, result_cache=None, latency=LatencyHistory())
+
+
+def measure(args, shape: str, size: int, graph: GraphDefinition, mode: str) -> Dict[str, Any]:
+    processor = make_processor(args)
+    copy = graph.model_copy(deep=True)
+    gc.collect()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    events = asyncio.run(run_once(processor, copy, mode))
+    makespan = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    
+    peak_memory = None
+    if not args.skip_memory:
+        processor = make_processor(args)
+        copy = graph.model_copy(deep=True)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            asyncio.run(run_once(processor, copy, mode))
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    
+    return {
+        "shape": shape,
+        "nodes": len(graph.nodes),
+        "edges": len(graph.edges),
+        "mode": mode,
+        "makespan_seconds": makespan,
+        "cpu_seconds": cpu,
+        "overhead_us_per_node": cpu / len(graph.nodes) * 1e6,
+        "peak_memory_mb": peak_memory / 2 ** 20 if peak_memory is not None else None,
+        "events": events,
+        "events_per_second": events / makespan if events else None,
+        "requested_size": size,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str):
+    """Print each result next to the same shape, size and mode from an earlier report."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    earlier = {(row["shape"], row["requested_size"], row["mode"]): row for row in baseline["results"]}
+    print(f"\ncompared with {baseline_path} (revision {baseline.get('revision') or 'unknown'}):")
+    print(f"{'shape':>8} {'nodes':>7} {'mode':>24} {'makespan':>9} {'overhead':>9} {'memory':>8}")
+    for row in results:
+        before = earlier.get((row["shape"], row["requested_size"], row["mode"]))
+        if before is None:
+            continue
+        
+        def ratio(key: str) -> str:
+            if row[key] is None or not before.get(key):
+                return "-"
+            return f"{row[key] / before[key]:.2f}x"
+        
+        print(
+            f"{row['shape']:>8} {row['nodes']:>7} {row['mode']:>24} {ratio('makespan_seconds'):>9} "
+            f"{ratio('overhead_us_per_node'):>9} {ratio('peak_memory_mb'):>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=list(SHAPES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="nodes per graph")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--scale", type=float, default=0.0002, help="simulated seconds to real seconds")
+    parser.add_argument("--limits", type=json.loads, default=None, help='concurrency limits, e.g. \'{"fal": 50}\'')
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier by --output")
+    args = parser.parse_args()
+    
+    print(f"{'shape':>8} {'nodes':>7} {'mode':>24} {'makespan':>10} {'overhead':>11} {'memory':>9} {'events/s':>9}")
+    results = []
+    for shape in args.shapes:
+        for size in args.sizes:
+            graph = SHAPES[shape](size)
+            for mode in args.modes:
+                row = measure(args, shape, size, graph, mode)
+                results.append(row)
+                memory = f"{row['peak_memory_mb']:.1f}MB" if row["peak_memory_mb"] is not None else "-"
+                rate = f"{row['events_per_second']:.0f}" if row["events_per_second"] else "-"
+                print(
+                    f"{shape:>8} {row['nodes']:>7} {mode:>24} {row['makespan_seconds']:>9.2f}s "
+                    f"{row['overhead_us_per_node']:>9.0f}us {memory:>9} {rate:>9}"
+                )
+    
+    if args.output:
+        report = {
+            "revision": git_revision(),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": vars(args),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nwrote {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
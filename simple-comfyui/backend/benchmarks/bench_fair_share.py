@@ -0,0 +1,84 @@
+"""Interactive provider-call latency while one user runs a large batch.
+
+A stand-in provider with a fixed concurrency limit serves a steady trickle of
+interactive calls from several users, alone and then alongside a burst of batch
+calls from one user. "per run" gives every batch row its own place in line, as
+before users were taken into account; "fair share" groups the rows under their
+user; "fair share+prio" also marks them as batch work, as /run-batch does.
+
+Usage: python -m benchmarks.bench_fair_share [--batch-calls 500] [--limit 10]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from src.services.concurrency import ConcurrencyManager
+from src.services.run_context import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, current_priority, current_run_id, current_user_id
+)
+
+
+async def provider_call(manager: ConcurrencyManager, latency: float, run_id: str, user: str, priority: str) -> float:
+    current_run_id.set(run_id)
+    current_user_id.set(user)
+    current_priority.set(priority)
+    start = time.perf_counter()
+    async with manager.slot("fal", "stub"):
+        await asyncio.sleep(latency)
+    return time.perf_counter() - start
+
+
+async def scenario(args, batch: bool, per_user: bool, priority: str) -> list:
+    manager = ConcurrencyManager({"fal": args.limit})
+    rng = random.Random(1)
+    tasks = []
+    if batch:
+        tasks += [
+            asyncio.create_task(provider_call(
+                manager, args.latency, f"row{i}", "power-user" if per_user else f"row{i}", priority
+            ))
+            for i in range(args.batch_calls)
+        ]
+    interactive = []
+    for i in range(args.interactive_calls):
+        user = f"user{i % 5}"
+        interactive.append(asyncio.create_task(
+            provider_call(manager, args.latency, f"run{i}", user, PRIORITY_INTERACTIVE)
+        ))
+        await asyncio.sleep(rng.expovariate(1 / args.interval))
+    latencies = await asyncio.gather(*interactive)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-calls", type=int, default=500)
+    parser.add_argument("--interactive-calls", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=10, help="provider concurrency limit")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per provider call")
+    parser.add_argument("--interval", type=float, default=0.02, help="mean seconds between interactive calls")
+    args = parser.parse_args()
+    
+    print(f"{'scenario':>16} {'p50':>8} {'p95':>8} {'max':>8}")
+    for name, batch, per_user, priority in (
+        ("no batch", False, True, PRIORITY_BATCH),
+        ("per run", True, False, PRIORITY_INTERACTIVE),
+        ("fair share", True, True, PRIORITY_INTERACTIVE),
+        ("fair share+prio", True, True, PRIORITY_BATCH),
+    ):
+        latencies = asyncio.run(scenario(args, batch, per_user, priority))
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        print(
+            f"{name:>16} {statistics.median(latencies) * 1000:>6.0f}ms {p95 * 1000:>6.0f}ms "
+            f"{max(latencies) * 1000:>6.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
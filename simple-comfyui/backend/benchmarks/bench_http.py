@@ -0,0 +1,440 @@
+"""HTTP load test of the API with simulated providers behind it.
+
+The app is started with a scratch database, upload directory and working
+directory, its fal.ai and OpenAI services replaced by ``simulated.py``, and the
+node result cache off (so every run reaches the providers). It is served by
+uvicorn either in this process (``--target inprocess``, sharing the event loop
+with the load generator) or in a child process on a local port (``--target port``,
+closer to production and keeping the generator out of the server's CPU time).
+
+A scenario sends requests at a fixed rate, with Poisson arrivals, picking each
+request's operation by weight. Latency is measured from when a request was due
+to be sent, not from when it went out, so a saturated server or load generator
+shows up as latency instead of silently lowering the rate. Scenarios with stream
+levels then open that many /run-graph-stream connections at once, level by
+level. A level counts towards the stream capacity if every stream finished and
+95% of them got their first event within ``--stream-threshold`` seconds.
+
+The bundled scenarios are the standard measurements for a release; compare their
+``--output`` files between releases.
+
+Usage: python -m benchmarks.bench_http [--scenario mixed] [--target port] [--rps 50]
+           [--duration 30] [--output mixed.json]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .bench_engine import git_revision
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A 1x1 PNG; the API only checks the declared content type
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    # What the editor does: runs, streamed runs, uploads and saving work
+    "mixed": {
+        "rps": 20,
+        "duration": 30,
+        "weights": {
+            "run_graph": 30, "run_graph_stream": 30, "upload_file": 10,
+            "list_workflows": 15, "save_workflow": 5, "update_workflow": 5, "delete_workflow": 5,
+        },
+    },
+    # Graph execution only, to find where the provider limits start to queue runs
+    "runs": {"rps": 40, "duration": 30, "weights": {"run_graph": 50, "run_graph_stream": 50}},
+    # Database-bound routes without provider calls
+    "workflows": {
+        "rps": 100,
+        "duration": 20,
+        "weights": {"list_workflows": 50, "save_workflow": 20, "update_workflow": 20, "delete_workflow": 10},
+    },
+    "uploads": {"rps": 50, "duration": 20, "weights": {"upload_file": 100}},
+    # How many clients can watch a run at once
+    "streams": {"rps": 0, "duration": 0, "weights": {}, "stream_levels": [25, 50, 100, 200, 400]},
+}
+
+
+def run_graph_payload(label: str) -> Dict[str, Any]:
+    """A prompt feeding an image and a description of it; unique so calls are not shared."""
+    return {
+        "nodes": [
+            {"id": "prompt", "type": "text", "data": {"text": f"A lighthouse at dusk, take {label}"}},
+            {"id": "image", "type": "image", "data": {}},
+            {"id": "caption", "type": "text", "data": {}},
+        ],
+        "edges": [
+            {"id": "e1", "source": "prompt", "target": "image"},
+            {"id": "e2", "source": "image", "target": "caption"},
+        ],
+    }
+
+
+def stream_payload(label: str) -> Dict[str, Any]:
+    """A prompt turned into an image and then a video, as a long-running stream."""
+    return {
+        "nodes": [
+            {"id": "prompt", "type": "text", "data": {"text": f"A storm over the sea, take {label}"}},
+            {"id": "image", "type": "image", "data": {}},
+            {"id": "video", "type": "video", "data": {}},
+        ],
+        "edges": [
+            {"id": "e1", "source": "prompt", "target": "image"},
+            {"id": "e2", "source": "image", "target": "video"},
+        ],
+    }
+
+
+def prepare_environment(workdir: str):
+    """Point the app at scratch state; must run before ``src.main`` is imported."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    os.environ["NODE_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("RUN_WORKERS", "0")
+    os.chdir(workdir)
+
+
+def simulated_app(scale: float, seed: int):
+    """The API with its providers simulated."""
+    from src import main
+    
+    from .simulated import SimulatedProvider
+    
+    provider = SimulatedProvider(scale, seed)
+    main.service_manager.fal_service = main.service_manager.openai_service = provider
+    # main configures INFO logging; a log line per request would dominate the profile
+    logging.getLogger().setLevel(logging.WARNING)
+    return main.app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LoadClient:
+    """The operations a scenario can pick, each recording its latency and outcome."""
+    
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.labels = itertools.count()
+        self.headers: Dict[str, str] = {}
+        self.workflow_ids: List[int] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+    
+    async def sign_in(self):
+        username = f"load-{uuid.uuid4().hex[:12]}"
+        credentials = {"username": username, "password": "load-test-password"}
+        response = await self.client.post("/register", json={**credentials, "email": f"{username}@example.com"})
+        response.raise_for_status()
+        response = await self.client.post("/login", json=credentials)
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    async def run(self, operation: str, due: float):
+        """Run one operation that was due at ``due`` (a perf_counter time)."""
+        try:
+            await getattr(self, operation)()
+            self.latencies[operation].append(time.perf_counter() - due)
+        except Exception:
+            self.errors[operation] += 1
+    
+    async def run_graph(self):
+        response = await self.client.post("/run-graph", json=run_graph_payload(str(next(self.labels))))
+        response.raise_for_status()
+        if not response.json()["success"]:
+            raise RuntimeError(response.json()["errors"])
+    
+    async def run_graph_stream(self, payload: Optional[Dict[str, Any]] = None) -> float:
+        """Read a whole stream; returns seconds until its first event."""
+        payload = payload or run_graph_payload(str(next(self.labels)))
+        start = time.perf_counter()
+        first_event = None
+        success = False
+        async with self.client.stream("POST", "/run-graph-stream", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+                event = json.loads(line[len("data: "):])
+                if event["type"] in ("complete", "error"):
+                    success = event.get("success", False)
+        if not success:
+            raise RuntimeError("Stream did not complete successfully")
+        return first_event
+    
+    async def upload_file(self):
+        name = f"load-{next(self.labels)}.png"
+        response = await self.client.post("/upload-file", files={"file": (name, PNG_BYTES, "image/png")})
+        response.raise_for_status()
+    
+    async def list_workflows(self):
+        response = await self.client.get("/my-workflows", headers=self.headers)
+        response.raise_for_status()
+    
+    async def save_workflow(self):
+        response = await self.client.post("/save-workflow", headers=self.headers, json={
+            "name": f"Workflow {next(self.labels)}",
+            "workflow_data": json.dumps(run_graph_payload("saved")),
+        })
+        response.raise_for_status()
+        self.workflow_ids.append(response.json()["id"])
+    
+    async def update_workflow(self):
+        if not self.workflow_ids:
+            return await self.save_workflow()
+        workflow_id = self.rng.choice(self.workflow_ids)
+        response = await self.client.put(
+            f"/update-workflow/{workflow_id}", headers=self.headers, json={"description": "edited under load"}
+        )
+        # Deleted by a concurrent request in the meantime
+        if response.status_code != 404:
+            response.raise_for_status()
+    
+    async def delete_workflow(self):
+        if not self.workflow_ids:
+            return await self.save_workflow()
+        workflow_id = self.workflow_ids.pop(self.rng.randrange(len(self.workflow_ids)))
+        response = await self.client.delete(f"/delete-workflow/{workflow_id}", headers=self.headers)
+        response.raise_for_status()
+
+
+async def drive(load: LoadClient, rps: float, duration: float, weights: Dict[str, float]) -> float:
+    """Send requests at ``rps`` for ``duration`` seconds; returns the achieved request rate."""
+    operations = list(weights)
+    cumulative = list(itertools.accumulate(weights[operation] for operation in operations))
+    tasks = []
+    start = time.perf_counter()
+    due = start
+    while due - start < duration:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        operation = load.rng.choices(operations, cum_weights=cumulative)[0]
+        tasks.append(asyncio.ensure_future(load.run(operation, due)))
+        due += load.rng.expovariate(rps)
+    await asyncio.gather(*tasks)
+    return len(tasks) / (time.perf_counter() - start)
+
+
+async def stream_level(load: LoadClient, streams: int) -> Dict[str, Any]:
+    """Open ``streams`` streams at once and time their first events."""
+    async def one(i: int):
+        start = time.perf_counter()
+        first_event = await load.run_graph_stream(stream_payload(f"s{streams}-{i}"))
+        return first_event, time.perf_counter() - start
+    
+    outcomes = await asyncio.gather(*(one(i) for i in range(streams)), return_exceptions=True)
+    finished = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+    first_events = sorted(first_event for first_event, _ in finished)
+    return {
+        "streams": streams,
+        "failed": streams - len(finished),
+        "first_event_p50": percentile(first_events, 50),
+        "first_event_p95": percentile(first_events, 95),
+        "duration_p95": percentile(sorted(total for _, total in finished), 95),
+    }
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def summarize(load: LoadClient) -> Dict[str, Dict[str, Any]]:
+    summary = {}
+    for operation in sorted(set(load.latencies) | set(load.errors)):
+        latencies = sorted(load.latencies[operation])
+        total = len(latencies) + load.errors[operation]
+        summary[operation] = {
+            "requests": total,
+            "error_rate": load.errors[operation] / total,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.mean(latencies) if latencies else None,
+        }
+    return summary
+
+
+async def run_scenario(args, scenario: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        load = LoadClient(client, random.Random(args.seed))
+        await load.sign_in()
+        report: Dict[str, Any] = {}
+        rps = args.rps if args.rps is not None else scenario["rps"]
+        if rps and scenario["weights"]:
+            duration = args.duration if args.duration is not None else scenario["duration"]
+            report["achieved_rps"] = await drive(load, rps, duration, scenario["weights"])
+            report["operations"] = summarize(load)
+        if scenario.get("stream_levels"):
+            levels = args.stream_levels or scenario["stream_levels"]
+            report["stream_levels"] = []
+            for streams in levels:
+                level = await stream_level(load, streams)
+                report["stream_levels"].append(level)
+                print_level(level)
+            report["stream_capacity"] = max(
+                (level["streams"] for level in report["stream_levels"]
+                 if not level["failed"] and level["first_event_p95"] is not None
+                 and level["first_event_p95"] <= args.stream_threshold),
+                default=0
+            )
+        return report
+
+
+async def serve_in_process(args, run):
+    import uvicorn
+    
+    port = free_port()
+    app = simulated_app(args.scale, args.seed)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.ensure_future(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+    try:
+        return await run(f"http://127.0.0.1:{port}")
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def serve_on_port(args, workdir: str, run):
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_http", "--serve", str(port),
+         "--scale", str(args.scale), "--seed", str(args.seed), "--workdir", workdir],
+        cwd=BACKEND_DIR, env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            for _ in range(600):
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {server.returncode}")
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("Server did not start within a minute")
+        return await run(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def serve(port: int, args):
+    """Child process of ``--target port``."""
+    import uvicorn
+    
+    prepare_environment(args.workdir)
+    uvicorn.run(simulated_app(args.scale, args.seed), host="127.0.0.1", port=port, log_level="warning")
+
+
+def print_level(level: Dict[str, Any]):
+    def seconds(value):
+        return f"{value * 1000:.0f}ms" if value is not None else "-"
+    
+    print(
+        f"  {level['streams']:>5} streams: first event p50 {seconds(level['first_event_p50'])}, "
+        f"p95 {seconds(level['first_event_p95'])}; finished p95 {seconds(level['duration_p95'])}; "
+        f"{level['failed']} failed"
+    )
+
+
+def print_report(name: str, report: Dict[str, Any]):
+    if "operations" in report:
+        print(f"\n{name}: {report['achieved_rps']:.1f} requests/s sent")
+        print(f"{'operation':>18} {'requests':>9} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for operation, stats in report["operations"].items():
+            cells = [f"{stats[p] * 1000:.1f}ms" if stats[p] is not None else "-" for p in ("p50", "p95", "p99")]
+            print(
+                f"{operation:>18} {stats['requests']:>9} {stats['error_rate']:>6.1%} "
+                f"{cells[0]:>9} {cells[1]:>9} {cells[2]:>9}"
+            )
+    if "stream_capacity" in report:
+        print(f"\n{name}: {report['stream_capacity']} concurrent streams within the first-event threshold")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["mixed"])
+    parser.add_argument("--target", choices=["inprocess", "port"], default="inprocess")
+    parser.add_argument("--rps", type=float, help="override the scenario's request rate")
+    parser.add_argument("--duration", type=float, help="override the scenario's duration in seconds")
+    parser.add_argument("--stream-levels", type=int, nargs="+", help="override the scenario's stream levels")
+    parser.add_argument("--stream-threshold", type=float, default=1.0, help="seconds to a stream's first event")
+    parser.add_argument("--scale", type=float, default=0.02, help="simulated seconds to real seconds")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        return serve(args.serve, args)
+    
+    async def run_all(base_url: str) -> Dict[str, Any]:
+        reports = {}
+        for name in args.scenario:
+            print(f"scenario {name} ({args.target})")
+            reports[name] = await run_scenario(args, SCENARIOS[name], base_url)
+            print_report(name, reports[name])
+        return reports
+    
+    # One server for all the scenarios, in a scratch directory removed afterwards
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        prepare_environment(workdir)
+        try:
+            if args.target == "inprocess":
+                reports = asyncio.run(serve_in_process(args, run_all))
+            else:
+                reports = asyncio.run(serve_on_port(args, workdir, run_all))
+        finally:
+            os.chdir(cwd)
+    
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key not in ("serve", "workdir")}
+        with open(args.output, "w") as f:
+            json.dump({"revision": git_revision(), "settings": settings, "scenarios": reports}, f, indent=2)
+        print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
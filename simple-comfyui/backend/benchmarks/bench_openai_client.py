@@ -0,0 +1,156 @@
+"""Sustained concurrent chat completions: executor threads against the async client.
+
+A stub OpenAI API in a child process answers every completion after
+``--latency`` seconds. For each concurrency level, that many callers make
+completions back to back for ``--duration`` seconds through:
+
+- executor: the synchronous client in the event loop's default executor, as
+  OpenAIService used to call it; concurrency is capped by the executor's threads
+- async: OpenAIService as it is now, on the async client and a shared pool
+
+Usage: python -m benchmarks.bench_openai_client [--concurrency 8 32 128] [--latency 0.5]
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+import openai
+
+from src.services import OpenAIService
+from src.services.openai_service import make_http_client
+
+from .bench_http import BACKEND_DIR, free_port
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": OpenAIService.CHAT_MODEL,
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Combined."}, "finish_reason": "stop"}],
+}).encode()
+
+
+def stub_api(latency: float):
+    """A bare ASGI app answering every request with a completion after ``latency``."""
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        while (await receive()).get("more_body"):
+            pass
+        await asyncio.sleep(latency)
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": COMPLETION})
+    
+    return app
+
+
+def executor_completion(client: openai.OpenAI) -> Callable[[], Awaitable[str]]:
+    async def complete():
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(None, functools.partial(
+            client.chat.completions.create,
+            model=OpenAIService.CHAT_MODEL,
+            messages=[{"role": "user", "content": "Combine these"}],
+            max_tokens=1000
+        ))
+        return response.choices[0].message.content
+    
+    return complete
+
+
+async def sustain(complete: Callable[[], Awaitable[str]], concurrency: int, duration: float) -> List[float]:
+    """Latencies of completions made back to back by ``concurrency`` callers."""
+    latencies: List[float] = []
+    end = time.perf_counter() + duration
+    
+    async def caller():
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            await complete()
+            latencies.append(time.perf_counter() - start)
+    
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return latencies
+
+
+async def measure(mode: str, concurrency: int, args, base_url: str):
+    if mode == "executor":
+        client = openai.OpenAI(api_key="bench", base_url=base_url, max_retries=0)
+        complete = executor_completion(client)
+    else:
+        http_client = make_http_client(max_connections=max(concurrency, 100))
+        service = OpenAIService("bench", http_client)
+        service.client = service.client.with_options(base_url=base_url)
+        
+        async def complete():
+            return await service.text_to_text(["Combine", "these"])
+    
+    await sustain(complete, min(concurrency, 4), 0.5)  # connections and imports warmed up
+    start = time.perf_counter()
+    latencies = await sustain(complete, concurrency, args.duration)
+    elapsed = time.perf_counter() - start
+    if mode == "async":
+        await http_client.aclose()
+    return len(latencies) / elapsed, latencies
+
+
+async def wait_until_up(base_url: str, server: subprocess.Popen):
+    async with httpx.AsyncClient() as client:
+        for _ in range(300):
+            if server.poll() is not None:
+                raise RuntimeError(f"Stub server exited with code {server.returncode}")
+            try:
+                await client.post(f"{base_url}/chat/completions", content=b"{}")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("Stub server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per stubbed completion")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per measurement")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        import uvicorn
+        return uvicorn.run(stub_api(args.latency), host="127.0.0.1", port=args.serve, log_level="warning")
+    
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}/v1"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_openai_client", "--serve", str(port), "--latency", str(args.latency)],
+        cwd=BACKEND_DIR, env=dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    )
+    try:
+        asyncio.run(wait_until_up(base_url, server))
+        print(f"cores: {os.cpu_count()}, stub latency: {args.latency * 1000:.0f}ms")
+        print(f"{'callers':>8} {'mode':>9} {'completions/s':>14} {'p50':>8} {'p95':>8}")
+        for concurrency in args.concurrency:
+            for mode in ("executor", "async"):
+                # A fresh loop, and so a fresh default executor, for each measurement
+                rate, latencies = asyncio.run(measure(mode, concurrency, args, base_url))
+                p95 = statistics.quantiles(latencies, n=20)[-1]
+                print(
+                    f"{concurrency:>8} {mode:>9} {rate:>14.1f} "
+                    f"{statistics.median(latencies) * 1000:>6.0f}ms {p95 * 1000:>6.0f}ms"
+                )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
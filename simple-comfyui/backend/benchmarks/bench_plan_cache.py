@@ -0,0 +1,60 @@
+"""Per-run planning overhead with and without the compiled plan cache.
+
+"cached plan" reads and compares the graph's structure on every lookup; "keyed plan"
+is a graph sent with a structure key the cache has seen, which skips that.
+
+Usage: python -m benchmarks.bench_plan_cache [--sizes 10 1000 100000]
+"""
+
+import argparse
+import time
+from unittest.mock import MagicMock
+
+from src.graph_processor import GraphProcessor
+from src.services import ServiceManager
+
+from .graphs import layered_graph
+
+
+def time_call(func, repeats: int) -> float:
+    """Average wall-clock seconds per call."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    args = parser.parse_args()
+    
+    print(
+        f"{'nodes':>8} {'edges':>8} {'cold plan':>12} {'cached plan':>12} {'speedup':>8} "
+        f"{'keyed plan':>12} {'speedup':>8}"
+    )
+    for size in args.sizes:
+        graph = layered_graph(size)
+        repeats = max(1, 20000 // size)
+        
+        def cold():
+            # A fresh processor has an empty plan cache, like the code before plans were cached
+            GraphProcessor(MagicMock(spec=ServiceManager)).get_plan(graph)
+        
+        warm_processor = GraphProcessor(MagicMock(spec=ServiceManager))
+        warm_processor.get_plan(graph)
+        keyed = graph.model_copy(update={"structure_key": f"layered-{size}"})
+        warm_processor.get_plan(keyed)
+        
+        cold_seconds = time_call(cold, repeats)
+        warm_seconds = time_call(lambda: warm_processor.get_plan(graph), repeats)
+        keyed_seconds = time_call(lambda: warm_processor.get_plan(keyed), repeats * 100)
+        print(
+            f"{size:>8} {len(graph.edges):>8} {cold_seconds * 1000:>10.3f}ms "
+            f"{warm_seconds * 1000:>10.3f}ms {cold_seconds / warm_seconds:>7.1f}x "
+            f"{keyed_seconds * 1000:>10.3f}ms {cold_seconds / keyed_seconds:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Cold validation time for large graphs, including ones too deep for recursion.
+
+Times are the best of ``--repeats``. The total is what ``validate_graph`` costs on a cache
+miss, and it is split into reading and hashing the structure used as the plan cache key
+and the single validate/sort/index pass.
+
+Usage: python -m benchmarks.bench_validation [--nodes 100000]
+"""
+
+import argparse
+import gc
+import sys
+import time
+from unittest.mock import MagicMock
+
+from src.execution_plan import graph_structure
+from src.graph_processor import GraphProcessor
+from src.models import Edge
+from src.services import ServiceManager
+
+from .graphs import chain_graph, layered_graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    
+    layered = layered_graph(args.nodes)
+    chain = chain_graph(args.nodes)
+    cyclic = chain_graph(args.nodes)
+    # Close a three-node loop in the middle; everything after it is blocked but not cyclic
+    middle = args.nodes // 2
+    cyclic.edges.append(Edge(id="back", source=f"n{middle + 2}", target=f"n{middle}"))
+    
+    print(f"recursion limit: {sys.getrecursionlimit()}")
+    print(f"{'graph':>10} {'nodes':>8} {'edges':>8} {'hash':>10} {'compile':>10} {'total':>10}  result")
+    for name, graph in (("layered", layered), ("chain", chain), ("cyclic", cyclic)):
+        hash_timings = []
+        compile_timings = []
+        total_timings = []
+        for _ in range(args.repeats):
+            # A fresh processor each time so nothing comes from the plan cache
+            processor = GraphProcessor(MagicMock(spec=ServiceManager))
+            gc.collect()
+            start = time.perf_counter()
+            structure = graph_structure(graph)
+            key = hash(structure)
+            hashed = time.perf_counter()
+            plan = processor._compile_plan(graph, structure, key)
+            hash_timings.append(hashed - start)
+            finished = time.perf_counter()
+            compile_timings.append(finished - hashed)
+            total_timings.append(finished - start)
+        outcome = "valid" if plan.valid else plan.validation.errors[0].message
+        print(
+            f"{name:>10} {len(graph.nodes):>8} {len(graph.edges):>8} "
+            f"{min(hash_timings) * 1000:>8.1f}ms {min(compile_timings) * 1000:>8.1f}ms "
+            f"{min(total_timings) * 1000:>8.1f}ms  {outcome}"
+        )
+
+
+if __name__ == "__main__":
+    main()
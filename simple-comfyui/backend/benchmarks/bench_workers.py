@@ -0,0 +1,135 @@
+"""Queued-run throughput against the number of worker processes.
+
+Every process runs a worker pool against one shared SQLite file, as separate
+``python -m src.worker`` processes on one host would. Providers are stubbed: each
+call waits ``--latency`` seconds and then burns ``--cpu-ms`` of CPU, standing in
+for the network wait and for the work the process does around it (parsing,
+validation, bookkeeping). Only the CPU part gains from more processes, and only
+up to the number of cores.
+
+Usage: python -m benchmarks.bench_workers [--processes 1 2 4] [--runs 200]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database import Base
+from src.graph_processor import GraphProcessor
+from src.models import Edge, GraphDefinition, Node, NodeData, NodeType
+from src.run_models import RunSubmitRequest
+from src.run_queue import DatabaseRunQueue, RunStore, RunWorkerPool
+from src.services import ServiceManager
+
+
+def make_store(db_path: str) -> RunStore:
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(bind=engine)
+    return RunStore(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+
+def make_request(i: int) -> RunSubmitRequest:
+    return RunSubmitRequest(graph=GraphDefinition(
+        nodes=[
+            Node(id="text1", type=NodeType.TEXT, data=NodeData(text=f"prompt {i}")),
+            Node(id="image1", type=NodeType.IMAGE, data=NodeData()),
+            Node(id="video1", type=NodeType.VIDEO, data=NodeData())
+        ],
+        edges=[
+            Edge(id="e1", source="text1", target="image1"),
+            Edge(id="e2", source="image1", target="video1")
+        ]
+    ))
+
+
+def stub_service_manager(latency: float, cpu_ms: float) -> ServiceManager:
+    async def call(*args):
+        await asyncio.sleep(latency)
+        end = time.perf_counter() + cpu_ms / 1000
+        while time.perf_counter() < end:
+            pass
+        return f"http://example.com/{os.getpid()}/{time.perf_counter()}.jpg"
+    
+    manager = MagicMock(spec=ServiceManager)
+    manager.process_text_to_image = AsyncMock(side_effect=call)
+    manager.process_image_to_video = AsyncMock(side_effect=call)
+    return manager
+
+
+async def serve(db_path: str, workers: int, latency: float, cpu_ms: float, stop):
+    store = make_store(db_path)
+    # No result cache, so every run pays for its provider calls
+    processor = GraphProcessor(stub_service_manager(latency, cpu_ms), result_cache=None)
+    pool = RunWorkerPool(processor, store, workers, DatabaseRunQueue(store, poll_interval=0.05))
+    await pool.start()
+    try:
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+    finally:
+        await pool.stop()
+
+
+def worker_process(db_path: str, workers: int, latency: float, cpu_ms: float, stop):
+    asyncio.run(serve(db_path, workers, latency, cpu_ms, stop))
+
+
+def measure(processes: int, args) -> float:
+    """Runs per minute for ``processes`` worker processes draining ``args.runs`` runs."""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "runs.db")
+        store = make_store(db_path)
+        context = multiprocessing.get_context("spawn")
+        stop = context.Event()
+        workers = [
+            context.Process(target=worker_process, args=(db_path, args.workers, args.latency, args.cpu_ms, stop))
+            for _ in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        # Let the processes finish importing before the clock starts
+        time.sleep(2.0)
+        
+        start = time.perf_counter()
+        run_ids = [store.create_run(make_request(i)) for i in range(args.runs)]
+        pending = set(run_ids)
+        while pending:
+            time.sleep(0.05)
+            pending = {run_id for run_id in pending if store.get_status(run_id).status in ("queued", "running")}
+        elapsed = time.perf_counter() - start
+        
+        stop.set()
+        for process in workers:
+            process.join()
+        failed = sum(store.get_status(run_id).status != "succeeded" for run_id in run_ids)
+        if failed:
+            print(f"  warning: {failed} of {args.runs} runs failed")
+    return args.runs / elapsed * 60
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--workers", type=int, default=4, help="worker pool size in each process")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per stubbed provider call")
+    parser.add_argument("--cpu-ms", type=float, default=20.0, help="CPU time per stubbed provider call")
+    args = parser.parse_args()
+    
+    print(f"cores: {os.cpu_count()}, runs: {args.runs}, pool size: {args.workers}")
+    print(f"{'processes':>10} {'runs/min':>10} {'speedup':>8}")
+    baseline = None
+    for processes in args.processes:
+        rate = measure(processes, args)
+        baseline = baseline or rate
+        print(f"{processes:>10} {rate:>10.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
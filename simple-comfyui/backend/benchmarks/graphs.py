@@ -0,0 +1,140 @@
+"""Graph generators shared by the benchmarks."""
+
+import random
+from typing import List, Optional
+
+from src.models import Edge, GraphDefinition, Node, NodeData, NodeType
+
+
+def layered_graph(num_nodes: int, fan_in: int = 2, width: Optional[int] = None) -> GraphDefinition:
+    """Build a valid text-only DAG where each node reads from up to ``fan_in`` nodes in the previous layer.
+    
+    Text nodes accept any number of inputs, so the graph stays valid at any size and
+    gives roughly ``fan_in`` edges per node. Layers default to sqrt(num_nodes) wide.
+    """
+    width = width or max(fan_in, int(num_nodes ** 0.5))
+    nodes: List[Node] = []
+    edges: List[Edge] = []
+    for i in range(num_nodes):
+        layer, position = divmod(i, width)
+        if layer == 0:
+            nodes.append(Node(id=f"n{i}", type=NodeType.TEXT, data=NodeData(text=f"prompt {i}")))
+            continue
+        nodes.append(Node(id=f"n{i}", type=NodeType.TEXT, data=NodeData()))
+        for k in range(fan_in):
+            source = (layer - 1) * width + (position + k) % width
+            edges.append(Edge(id=f"e{i}_{k}", source=f"n{source}", target=f"n{i}"))
+    return GraphDefinition(nodes=nodes, edges=edges)
+
+
+def chain_graph(num_nodes: int) -> GraphDefinition:
+    """Build a single text chain, the deepest graph possible for its size."""
+    nodes = [Node(id="n0", type=NodeType.TEXT, data=NodeData(text="prompt"))]
+    edges: List[Edge] = []
+    for i in range(1, num_nodes):
+        nodes.append(Node(id=f"n{i}", type=NodeType.TEXT, data=NodeData()))
+        edges.append(Edge(id=f"e{i}", source=f"n{i - 1}", target=f"n{i}"))
+    return GraphDefinition(nodes=nodes, edges=edges)
+
+
+def provider_chain(num_nodes: int) -> GraphDefinition:
+    """Build a chain in which every node after the prompt is a provider call.
+    
+    Images are generated from the text before them and described by the text after
+    them, so the chain is as long as the graph and nothing in it can overlap.
+    """
+    nodes = [Node(id="n0", type=NodeType.TEXT, data=NodeData(text="prompt"))]
+    edges: List[Edge] = []
+    for i in range(1, num_nodes):
+        node_type = NodeType.IMAGE if i % 2 else NodeType.TEXT
+        nodes.append(Node(id=f"n{i}", type=node_type, data=NodeData()))
+        edges.append(Edge(id=f"e{i}", source=f"n{i - 1}", target=f"n{i}"))
+    return GraphDefinition(nodes=nodes, edges=edges)
+
+
+def fan_out_graph(num_nodes: int) -> GraphDefinition:
+    """Build one uploaded image edited by many independent prompts, all runnable at once."""
+    nodes = [Node(id="source", type=NodeType.IMAGE, data=NodeData(file_url="/uploads/source.jpg"))]
+    edges: List[Edge] = []
+    for i in range((num_nodes - 1) // 2):
+        nodes.append(Node(id=f"p{i}", type=NodeType.TEXT, data=NodeData(text=f"variation {i}")))
+        nodes.append(Node(id=f"v{i}", type=NodeType.IMAGE, data=NodeData()))
+        edges.append(Edge(id=f"ep{i}", source=f"p{i}", target=f"v{i}"))
+        edges.append(Edge(id=f"es{i}", source="source", target=f"v{i}"))
+    return GraphDefinition(nodes=nodes, edges=edges)
+
+
+def diamond_graph(num_nodes: int) -> GraphDefinition:
+    """Build a chain of diamonds: an image described two ways, merged into the next prompt.
+    
+    Each diamond is five nodes (image, two descriptions, the question behind one of
+    them and the merged text), and each merged text generates the next image.
+    """
+    nodes = [Node(id="prompt", type=NodeType.TEXT, data=NodeData(text="prompt"))]
+    edges: List[Edge] = []
+    
+    def connect(source: str, target: str):
+        edges.append(Edge(id=f"e{len(edges)}", source=source, target=target))
+    
+    previous = "prompt"
+    for i in range((num_nodes - 1) // 5):
+        nodes += [
+            Node(id=f"image{i}", type=NodeType.IMAGE, data=NodeData()),
+            Node(id=f"describe{i}", type=NodeType.TEXT, data=NodeData()),
+            Node(id=f"question{i}", type=NodeType.TEXT, data=NodeData(text=f"question {i}")),
+            Node(id=f"answer{i}", type=NodeType.TEXT, data=NodeData()),
+            Node(id=f"merge{i}", type=NodeType.TEXT, data=NodeData()),
+        ]
+        connect(previous, f"image{i}")
+        connect(f"image{i}", f"describe{i}")
+        connect(f"image{i}", f"answer{i}")
+        connect(f"question{i}", f"answer{i}")
+        connect(f"describe{i}", f"merge{i}")
+        connect(f"answer{i}", f"merge{i}")
+        previous = f"merge{i}"
+    return GraphDefinition(nodes=nodes, edges=edges)
+
+
+def random_dag(num_nodes: int, seed: int = 0, roots: float = 0.1) -> GraphDefinition:
+    """Build a valid DAG of mixed node types with inputs drawn from any earlier node.
+    
+    About ``roots`` of the nodes are prompts; the rest run a provider operation
+    picked at random among those their inputs allow. Videos are only ever sinks.
+    """
+    rng = random.Random(seed)
+    nodes: List[Node] = []
+    edges: List[Edge] = []
+    texts: List[str] = []
+    images: List[str] = []
+    
+    def add(node_type: NodeType, sources: List[str], text: Optional[str] = None):
+        node_id = f"n{len(nodes)}"
+        nodes.append(Node(id=node_id, type=node_type, data=NodeData(text=text)))
+        for source in sources:
+            edges.append(Edge(id=f"e{len(edges)}", source=source, target=node_id))
+        if node_type is NodeType.TEXT:
+            texts.append(node_id)
+        elif node_type is NodeType.IMAGE:
+            images.append(node_id)
+    
+    for i in range(num_nodes):
+        if not texts or rng.random() < roots:
+            add(NodeType.TEXT, [], f"prompt {i}")
+            continue
+        choices = ["text_to_image", "text_to_text"] + (
+            ["image_to_text", "text_image_to_text", "text_image_to_image", "image_to_video"] if images else []
+        )
+        choice = rng.choice(choices)
+        if choice == "text_to_image":
+            add(NodeType.IMAGE, [rng.choice(texts)])
+        elif choice == "text_to_text":
+            add(NodeType.TEXT, rng.sample(texts, min(len(texts), rng.randint(2, 3))))
+        elif choice == "image_to_text":
+            add(NodeType.TEXT, [rng.choice(images)])
+        elif choice == "text_image_to_text":
+            add(NodeType.TEXT, [rng.choice(texts), rng.choice(images)])
+        elif choice == "text_image_to_image":
+            add(NodeType.IMAGE, [rng.choice(texts), rng.choice(images)])
+        else:
+            add(NodeType.VIDEO, [rng.choice(images)])
+    return GraphDefinition(nodes=nodes, edges=edges)
@@ -0,0 +1,72 @@
+"""Providers that answer after a simulated latency, for benchmarking without API keys.
+
+Latencies are drawn from a log-normal distribution for each operation, with
+medians and spreads roughly like those seen from OpenAI and fal.ai, then scaled
+down so that benchmarks finish in seconds rather than hours.
+"""
+
+import asyncio
+import random
+from typing import Dict, Optional, Tuple
+
+from src.models import ConnectionType
+from src.services import ServiceManager
+
+# Median seconds and log-space standard deviation of each operation
+LATENCY_PROFILES: Dict[ConnectionType, Tuple[float, float]] = {
+    ConnectionType.TEXT_TO_TEXT: (2.5, 0.4),
+    ConnectionType.TEXT_IMAGE_TO_TEXT: (4.0, 0.4),
+    ConnectionType.IMAGE_TO_TEXT: (4.0, 0.4),
+    ConnectionType.TEXT_TO_IMAGE: (7.0, 0.3),
+    ConnectionType.TEXT_IMAGE_TO_IMAGE: (9.0, 0.3),
+    ConnectionType.TEXT_TO_VIDEO: (60.0, 0.25),
+    ConnectionType.TEXT_IMAGE_TO_VIDEO: (60.0, 0.25),
+    ConnectionType.IMAGE_TO_VIDEO: (60.0, 0.25),
+}
+
+
+class SimulatedProvider:
+    """Stands in for both FalService and OpenAIService."""
+    
+    def __init__(self, scale: float, seed: int = 0):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.calls = 0
+    
+    async def _respond(self, operation: ConnectionType, result: str) -> str:
+        self.calls += 1
+        median, sigma = LATENCY_PROFILES[operation]
+        await asyncio.sleep(self.rng.lognormvariate(0, sigma) * median * self.scale)
+        return result
+    
+    async def text_to_text(self, inputs, task="combine"):
+        return await self._respond(ConnectionType.TEXT_TO_TEXT, f"combined {self.calls}: {inputs[0][:40]}")
+    
+    async def text_image_to_text(self, image_url, prompt):
+        return await self._respond(ConnectionType.TEXT_IMAGE_TO_TEXT, f"answer {self.calls} to {prompt[:40]}")
+    
+    async def image_to_text(self, image_url):
+        return await self._respond(ConnectionType.IMAGE_TO_TEXT, f"description {self.calls} of {image_url[-40:]}")
+    
+    async def text_to_image(self, prompt, aspect_ratio="1:1"):
+        return await self._respond(ConnectionType.TEXT_TO_IMAGE, f"https://example.com/image/{self.calls}.jpg")
+    
+    async def text_image_to_image(self, prompt, image_url):
+        return await self._respond(ConnectionType.TEXT_IMAGE_TO_IMAGE, f"https://example.com/edit/{self.calls}.jpg")
+    
+    async def text_to_video(self, prompt, aspect_ratio="16:9", resolution="720p", duration="5"):
+        return await self._respond(ConnectionType.TEXT_TO_VIDEO, f"https://example.com/video/{self.calls}.mp4")
+    
+    async def image_to_video(self, image_url, prompt=None, resolution="720p", duration="5"):
+        operation = ConnectionType.TEXT_IMAGE_TO_VIDEO if prompt else ConnectionType.IMAGE_TO_VIDEO
+        return await self._respond(operation, f"https://example.com/video/{self.calls}.mp4")
+
+
+def simulated_service_manager(
+    scale: float, seed: int = 0, concurrency_limits: Optional[Dict[str, int]] = None
+) -> ServiceManager:
+    """A real ServiceManager (limits, retries, deduplication) in front of simulated providers."""
+    manager = ServiceManager(concurrency_limits=concurrency_limits)
+    manager.fal_service = manager.openai_service = SimulatedProvider(scale, seed)
+    return manager
+
@@ -0,0 +1,74 @@
+"""Durable local copies of generated media."""
+
+import logging
+import mimetypes
+import re
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from .services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArtifactStore:
+    """Copies provider-hosted results into a directory served by the app.
+    
+    fal.ai result URLs expire after a while, so a checkpoint that only kept the URL
+    could not be resumed from later. Copies live at ``<root>/<run_id>/<node_id>.<ext>``
+    and are addressed as ``<url_prefix>/<run_id>/<node_id>.<ext>``, the same way
+    uploaded files are.
+    """
+    
+    def __init__(self, root: Path, url_prefix: str, timeout: float = 300.0):
+        self.root = Path(root)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.timeout = timeout
+    
+    @staticmethod
+    def is_remote(result: Any) -> bool:
+        """Whether a node result is a URL hosted somewhere else."""
+        return isinstance(result, str) and result.startswith(("http://", "https://"))
+    
+    async def persist(self, run_id: str, node_id: str, url: str) -> str:
+        """Download ``url`` and return the local URL of the copy."""
+        with tracer.span("download", "artifact", run_id, lane=node_id) as span:
+            async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    extension = self._extension(url, response.headers.get("content-type"))
+                    name = f"{_safe(node_id)}{extension}"
+                    directory = self.root / _safe(run_id)
+                    directory.mkdir(parents=True, exist_ok=True)
+                    # Written under a temporary name so a half-downloaded file is never served
+                    partial = directory / f"{name}.part"
+                    size = 0
+                    with open(partial, "wb") as f:
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+                    partial.replace(directory / name)
+            if span is not None:
+                span.attributes["bytes"] = size
+        
+        logger.info(f"Stored artifact for node {node_id} of run {run_id}")
+        return f"{self.url_prefix}/{_safe(run_id)}/{name}"
+    
+    @staticmethod
+    def _extension(url: str, content_type: Optional[str] = None) -> str:
+        suffix = Path(urlparse(url).path).suffix
+        if re.fullmatch(r"\.[A-Za-z0-9]{1,5}", suffix):
+            return suffix.lower()
+        if content_type:
+            return mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+        return ""
+
+
+def _safe(name: str) -> str:
+    """Make an id usable as a single path component."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name).lstrip(".") or "_"
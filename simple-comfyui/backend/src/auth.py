@@ -22,6 +22,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # Token authentication
 security = HTTPBearer()
+# Same, for endpoints that also serve anonymous requests
+optional_security = HTTPBearer(auto_error=False)
 
 class TokenData(BaseModel):
     username: Optional[str] = None
@@ -96,4 +98,20 @@ def get_current_active_user(current_user: User = Depends(get_current_user)):
     """Get current active user."""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+) -> Optional[User]:
+    """Get the current active user, or None for an anonymous request.
+    
+    A token that is invalid, expired, or names no active user counts as no token,
+    so clients holding a stale one keep working as they did before sign-in existed.
+    """
+    if credentials is None:
+        return None
+    try:
+        return get_current_active_user(get_current_user(credentials, db))
+    except HTTPException:
+        return None
@@ -0,0 +1,264 @@
+"""Compiled execution plans, cached by the structure of a graph."""
+
+import gc
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .models import ConnectionType, Edge, GraphDefinition, NodeType, ValidationResult
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_operation(node_type: NodeType, text_count: int, has_image: bool) -> Optional[ConnectionType]:
+    """Pick the provider operation for a node from its inputs, or None for a passthrough."""
+    if node_type == NodeType.TEXT:
+        if text_count > 1:
+            # Multiple text inputs -> combine/summarize
+            return ConnectionType.TEXT_TO_TEXT
+        elif text_count == 1 and has_image:
+            # Text + Image -> Text (QA)
+            return ConnectionType.TEXT_IMAGE_TO_TEXT
+        elif has_image and not text_count:
+            # Image only -> Text (description)
+            return ConnectionType.IMAGE_TO_TEXT
+        elif text_count == 1:
+            # Single text input - pass through
+            return None
+        else:
+            raise ValueError("Text node has no valid inputs")
+    
+    elif node_type == NodeType.IMAGE:
+        if text_count == 1 and not has_image:
+            # Text -> Image
+            return ConnectionType.TEXT_TO_IMAGE
+        elif text_count == 1 and has_image:
+            # Text + Image -> Image (editing)
+            return ConnectionType.TEXT_IMAGE_TO_IMAGE
+        elif has_image and not text_count:
+            # Image passthrough
+            return None
+        else:
+            raise ValueError("Image node has no valid inputs")
+    
+    elif node_type == NodeType.VIDEO:
+        if text_count == 1 and not has_image:
+            # Text -> Video
+            return ConnectionType.TEXT_TO_VIDEO
+        elif text_count == 1 and has_image:
+            # Text + Image -> Video
+            return ConnectionType.TEXT_IMAGE_TO_VIDEO
+        elif has_image and not text_count:
+            # Image -> Video
+            return ConnectionType.IMAGE_TO_VIDEO
+        else:
+            raise ValueError("Video node has no valid inputs")
+    
+    else:
+        raise ValueError(f"Unknown node type: {node_type}")
+
+
+@lru_cache(maxsize=None)
+def expected_operation(node_type: NodeType, text_count: int, has_image: bool) -> Optional[ConnectionType]:
+    """Like resolve_operation, but None instead of an error for nodes without valid inputs."""
+    try:
+        return resolve_operation(node_type, text_count, has_image)
+    except ValueError:
+        return None
+
+
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    """Keep the cyclic garbage collector out of a burst of container allocations.
+    
+    Compiling a large plan allocates hundreds of thousands of lists, none of them
+    cyclic, and each collection it triggers would re-scan every live graph object.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+# Edges are read whole from their __dict__, which holds exactly these fields in this order
+EDGE_FIELDS = tuple(Edge.model_fields)
+
+_node_id_and_type = attrgetter("id", "type")
+_node_data = attrgetter("data")
+_data_text_and_file = attrgetter("text", "file_url")
+_model_dict = attrgetter("__dict__")
+
+
+class GraphStructure(NamedTuple):
+    """The parts of a graph that decide validation and execution order, as flat tuples.
+    
+    Node text and file contents are left out; only whether they are present matters
+    for validation, so editing a prompt keeps the same plan.
+    """
+    nodes: Tuple[Any, ...]  # id, type of each node
+    node_data: Tuple[bool, ...]  # has text, has file of each node
+    edges: Tuple[Optional[str], ...]  # EDGE_FIELDS of each edge
+    
+    def node_ids(self) -> Tuple[str, ...]:
+        return self.nodes[0::2]
+    
+    def node_types(self) -> Tuple[NodeType, ...]:
+        return self.nodes[1::2]
+    
+    def edge_field(self, name: str) -> Tuple[Optional[str], ...]:
+        """One field of every edge, in edge order."""
+        return self.edges[EDGE_FIELDS.index(name)::len(EDGE_FIELDS)]
+
+
+def graph_structure(graph: GraphDefinition) -> GraphStructure:
+    """Read a graph's structure out of its models.
+    
+    This runs on every plan lookup. For big graphs nearly all of its time goes into
+    touching each model, so every model is visited once, from C (attrgetter, map and
+    chain), and the fields land in flat tuples without a tuple allocated per edge.
+    """
+    nodes = graph.nodes
+    return GraphStructure(
+        tuple(chain.from_iterable(map(_node_id_and_type, nodes))),
+        tuple(map(bool, chain.from_iterable(map(_data_text_and_file, map(_node_data, nodes))))),
+        tuple(chain.from_iterable(map(dict.values, map(_model_dict, graph.edges))))
+    )
+
+
+class ExecutionPlan:
+    """Everything execution needs to know about a graph's structure, computed once.
+    
+    A plan never holds node data, so it can be shared by every run of graphs with the
+    same structure.
+    """
+    
+    def __init__(
+        self,
+        structure: GraphStructure,
+        structure_hash: int,
+        validation: ValidationResult,
+        order: List[str],
+        levels: List[List[str]],
+        incoming_edges: Dict[str, List[Edge]],
+        dependents: Dict[str, List[str]],
+        in_degree: Dict[str, int],
+        operations: Dict[str, Optional[ConnectionType]]
+    ):
+        self.structure = structure
+        self.structure_hash = structure_hash
+        self.validation = validation
+        # Topological order, and the same nodes grouped by longest path from a root
+        self.order = order
+        self.levels = levels
+        self.incoming_edges = incoming_edges
+        self.dependents = dependents
+        self.in_degree = in_degree
+        # Operation each node is expected to run, judged from the types feeding it
+        self.operations = operations
+    
+    @property
+    def valid(self) -> bool:
+        """Whether the graph passed validation."""
+        return self.validation.valid
+    
+    @property
+    def edge_count(self) -> int:
+        return len(self.structure.edges) // len(EDGE_FIELDS)
+    
+    def upstream(self, node_ids: Iterable[str], stop_at: Iterable[str] = ()) -> Set[str]:
+        """The given nodes and every node feeding them, not looking past nodes in ``stop_at``."""
+        stop_at = set(stop_at)
+        found = set()
+        stack = list(node_ids)
+        while stack:
+            node_id = stack.pop()
+            if node_id in found:
+                continue
+            found.add(node_id)
+            if node_id not in stop_at:
+                stack.extend(edge.source for edge in self.incoming_edges.get(node_id, ()))
+        return found
+    
+    def remaining_path(self, costs: Dict[str, float], nodes: Optional[Set[str]] = None) -> Dict[str, float]:
+        """Longest total cost from each node through to the end of the run.
+        
+        ``costs`` gives each node's own expected cost. A node's value is its cost plus
+        the largest value among its dependents, so the nodes on the critical path are
+        the ones with the most work still hanging off them. Only ``nodes`` are
+        considered when given.
+        """
+        longest: Dict[str, float] = {}
+        for node_id in reversed(self.order):
+            if nodes is not None and node_id not in nodes:
+                continue
+            after = [longest[child] for child in self.dependents.get(node_id, ()) if child in longest]
+            longest[node_id] = costs.get(node_id, 0.0) + (max(after) if after else 0.0)
+        return longest
+
+
+class PlanCache:
+    """LRU cache of compiled plans keyed by hash(structure).
+    
+    The hash is computed once per lookup and passed in; a hit is confirmed by comparing
+    structures, so colliding graphs never share a plan. Plans can also be found by a
+    client's structure key (see GraphDefinition.structure_key), which skips reading
+    the graph at all; reading a 100k-node graph's structure costs about as much as a
+    quarter of compiling its plan.
+    """
+    
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._plans: "OrderedDict[int, ExecutionPlan]" = OrderedDict()
+        # Structure key -> hash(structure) of the plan last used with it
+        self._keys: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: int, structure: GraphStructure) -> Optional[ExecutionPlan]:
+        """Look up the plan of a structure whose hash is ``key``."""
+        plan = self._plans.get(key)
+        if plan is None or plan.structure != structure:
+            self.misses += 1
+            return None
+        self._plans.move_to_end(key)
+        self.hits += 1
+        return plan
+    
+    def get_by_key(self, structure_key: str, node_count: int, edge_count: int) -> Optional[ExecutionPlan]:
+        """Look up the plan last used with a client's structure key, without counting a miss.
+        
+        A plan for a different number of nodes or edges is not returned; the key was
+        reused for a changed graph, whose structure has to be read after all.
+        """
+        plan = self._plans.get(self._keys.get(structure_key))
+        if plan is None or len(plan.in_degree) != node_count or plan.edge_count != edge_count:
+            return None
+        self._keys.move_to_end(structure_key)
+        self._plans.move_to_end(plan.structure_hash)
+        self.hits += 1
+        return plan
+    
+    def remember_key(self, structure_key: str, plan: ExecutionPlan):
+        """Make ``plan`` the one found by ``structure_key`` from now on."""
+        self._keys[structure_key] = plan.structure_hash
+        self._keys.move_to_end(structure_key)
+        while len(self._keys) > self.max_entries:
+            self._keys.popitem(last=False)
+    
+    def put(self, plan: ExecutionPlan):
+        """Store a plan, evicting the least recently used one when full."""
+        self._plans[plan.structure_hash] = plan
+        self._plans.move_to_end(plan.structure_hash)
+        while len(self._plans) > self.max_entries:
+            self._plans.popitem(last=False)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._plans)}
@@ -1,25 +1,95 @@
 """Graph processing engine with topological sorting and execution."""
 
 from typing import Dict, List, Set, Tuple, Optional, Any, Callable, AsyncGenerator
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict
 import asyncio
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import time
+import uuid
 
 from .models import (
     GraphDefinition, Node, Edge, NodeType, ValidationResult, ValidationError,
-    ExecutionResult, NodeData, ConnectionType
+    ExecutionResult, NodeData, ConnectionType, NodeOverride
+)
+from .execution_plan import (
+    ExecutionPlan, GraphStructure, PlanCache, expected_operation, gc_paused, graph_structure, resolve_operation
+)
+from .latency import LatencyHistory
+from .result_cache import ResultCache, make_cache_key
+from .services import FalService, OpenAIService, ServiceManager
+from .services.metrics import GRAPH_RUNS, GRAPH_RUNS_IN_PROGRESS, NODE_EXECUTION_SECONDS
+from .services.tracing import current_span, tracer
+from .services.run_context import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, ProgressThrottle, current_critical_path, current_deadline,
+    current_call_timer, current_event_sink, current_priority, current_provider_job, current_run_id,
+    current_user_id
 )
-from .services import ServiceManager
 
 logger = logging.getLogger(__name__)
 
+# Source -> Target node type pairs that can be connected
+VALID_CONNECTIONS = {
+    (NodeType.TEXT, NodeType.TEXT),
+    (NodeType.TEXT, NodeType.IMAGE),
+    (NodeType.TEXT, NodeType.VIDEO),
+    (NodeType.IMAGE, NodeType.TEXT),
+    (NodeType.IMAGE, NodeType.IMAGE),  # For text + image -> image workflows
+    (NodeType.IMAGE, NodeType.VIDEO),
+}
+
+# expected_operation for every node type, count of text inputs (capped at 2) and image presence
+EXPECTED_OPERATIONS = {
+    (node_type, text_count, has_image): expected_operation(node_type, text_count, has_image)
+    for node_type in NodeType for text_count in range(3) for has_image in (False, True)
+}
+
+# Cycle members listed in a validation error before the rest are summarised
+CYCLE_REPORT_LIMIT = 20
+
+# Number of finished runs whose results are kept for incremental re-execution
+RUN_HISTORY_SIZE = 64
+
+# Provider model behind each operation. Part of the result cache key, so switching
+# models never serves results produced by the old one.
+OPERATION_MODELS = {
+    ConnectionType.TEXT_TO_TEXT: OpenAIService.CHAT_MODEL,
+    ConnectionType.TEXT_IMAGE_TO_TEXT: OpenAIService.CHAT_MODEL,
+    ConnectionType.IMAGE_TO_TEXT: OpenAIService.CHAT_MODEL,
+    ConnectionType.TEXT_TO_IMAGE: FalService.TEXT_TO_IMAGE_ENDPOINT,
+    ConnectionType.TEXT_IMAGE_TO_IMAGE: FalService.TEXT_IMAGE_TO_IMAGE_ENDPOINT,
+    ConnectionType.TEXT_TO_VIDEO: FalService.TEXT_TO_VIDEO_ENDPOINT,
+    ConnectionType.TEXT_IMAGE_TO_VIDEO: FalService.IMAGE_TO_VIDEO_ENDPOINT,
+    ConnectionType.IMAGE_TO_VIDEO: FalService.IMAGE_TO_VIDEO_ENDPOINT,
+}
+
 
 class GraphProcessor:
     """Handles graph validation, topological sorting, and execution."""
     
-    def __init__(self, service_manager: ServiceManager, base_url: str = None):
+    def __init__(
+        self,
+        service_manager: ServiceManager,
+        base_url: str = None,
+        result_cache: Optional[ResultCache] = None,
+        run_timeout: Optional[float] = None,
+        latency: Optional[LatencyHistory] = None,
+        progress_interval: float = 0.5
+    ):
         self.service_manager = service_manager
         self.base_url = base_url
+        self.result_cache = result_cache
+        # Observed latency per operation, used to start nodes on the critical path first
+        self.latency = latency or LatencyHistory()
+        # Seconds a whole run may take; every provider call in the run is bounded by it
+        self.run_timeout = run_timeout
+        # Least seconds between two progress events of one node
+        self.progress_interval = progress_interval
+        self.run_history: "OrderedDict[str, Dict[str, Tuple[str, Any]]]" = OrderedDict()
+        self.plan_cache = PlanCache()
     
     def _convert_to_full_url(self, url_or_path: str) -> str:
         """Convert relative URLs to full URLs for AI services."""
@@ -29,343 +99,916 @@ class GraphProcessor:
             return f"{self.base_url}{url_or_path}"
         else:
             return f"{self.base_url}/{url_or_path}"
-        
+    
     def validate_graph(self, graph: GraphDefinition) -> ValidationResult:
         """Validate the entire graph structure."""
-        errors = []
+        return self.get_plan(graph).validation
+    
+    def get_plan(self, graph: GraphDefinition) -> ExecutionPlan:
+        """Return the compiled plan for this graph's structure, compiling it on first use.
         
-        # Validate edges
-        edge_errors = self._validate_edges(graph)
-        errors.extend(edge_errors)
+        A graph sent with a structure key seen before takes that key's plan unchanged
+        (see PlanCache.get_by_key); otherwise its structure is read and compared.
+        """
+        structure_key = graph.structure_key
+        if structure_key is not None:
+            plan = self.plan_cache.get_by_key(structure_key, len(graph.nodes), len(graph.edges))
+            if plan is not None:
+                return plan
+        structure = graph_structure(graph)
+        key = hash(structure)
+        plan = self.plan_cache.get(key, structure)
+        if plan is None:
+            plan = self._compile_plan(graph, structure, key)
+            self.plan_cache.put(plan)
+        if structure_key is not None:
+            self.plan_cache.remember_key(structure_key, plan)
+        return plan
+    
+    def _compile_plan(self, graph: GraphDefinition, structure: GraphStructure, key: int) -> ExecutionPlan:
+        """Validate, sort and index a graph in a single iterative pass.
         
-        # Validate nodes
-        node_errors = self._validate_nodes(graph)
-        errors.extend(node_errors)
+        Adjacency is built once and shared by every check. Cycles show up as the nodes
+        Kahn's algorithm cannot order, so arbitrarily long chains never hit Python's
+        recursion limit, and the execution order falls out as a by-product.
+        """
+        with gc_paused():
+            return self._build_plan(graph, structure, key)
+    
+    def _build_plan(self, graph: GraphDefinition, structure: GraphStructure, key: int) -> ExecutionPlan:
+        """Body of _compile_plan, run with the garbage collector paused.
         
-        # Validate graph structure (cycles, etc.)
-        graph_errors = self._validate_graph_structure(graph)
-        errors.extend(graph_errors)
+        Works from ``structure`` rather than the models. Nodes are numbered once, so the
+        loops over edges and the sort index lists instead of hashing ids.
+        """
+        text, image = NodeType.TEXT, NodeType.IMAGE
+        node_ids, node_types, data_flags = structure.node_ids(), structure.node_types(), structure.node_data
         
-        return ValidationResult(valid=len(errors) == 0, errors=errors)
-    
-    def _validate_edges(self, graph: GraphDefinition) -> List[ValidationError]:
-        """Validate edge connections and compatibility."""
-        errors = []
-        node_map = {node.id: node for node in graph.nodes}
+        # Index map; a repeated id keeps the first node's place and the last one's type and data
+        position = dict(zip(node_ids, range(len(node_ids))))
+        if len(position) == len(node_ids):
+            ids, types = list(node_ids), list(node_types)
+        else:
+            # ``position`` holds the last node with each id, in the order ids first appear
+            ids = list(position)
+            last = list(position.values())
+            types = [node_types[n] for n in last]
+            data_flags = tuple(flag for n in last for flag in data_flags[2 * n:2 * n + 2])
+            position = dict(zip(ids, range(len(ids))))
+        # Text nodes without inputs need text, media nodes a file
+        has_data = [
+            data_flags[2 * i] if node_type is text else data_flags[2 * i + 1] for i, node_type in enumerate(types)
+        ]
+        count = len(ids)
         
-        for edge in graph.edges:
-            # Check if source and target nodes exist
-            if edge.source not in node_map:
-                errors.append(ValidationError(
+        # Build adjacency and validate edges in one pass, in edge order. An edge with a
+        # missing node feeds nothing; with a missing target it is kept by the target's id.
+        incoming: List[List[Edge]] = [[] for _ in range(count)]
+        # Successors by position, for sorting, and by id, for the plan
+        successors: List[List[int]] = [[] for _ in range(count)]
+        successor_ids: List[List[str]] = [[] for _ in range(count)]
+        in_degree = [0] * count
+        text_counts = [0] * count
+        has_image = [False] * count
+        dangling: Dict[str, List[Edge]] = {}
+        edge_errors = []
+        for edge, source_id, target_id in zip(
+            graph.edges, structure.edge_field("source"), structure.edge_field("target")
+        ):
+            source = position.get(source_id)
+            target = position.get(target_id)
+            if source is None or target is None:
+                if target is None:
+                    dangling.setdefault(target_id, []).append(edge)
+                else:
+                    incoming[target].append(edge)
+                missing = f"Source node '{source_id}'" if source is None else f"Target node '{target_id}'"
+                edge_errors.append(ValidationError(type="edge", message=f"{missing} not found", edge_id=edge.id))
+                continue
+            incoming[target].append(edge)
+            successors[source].append(target)
+            successor_ids[source].append(target_id)
+            in_degree[target] += 1
+            source_type, target_type = types[source], types[target]
+            if (source_type, target_type) not in VALID_CONNECTIONS:
+                edge_errors.append(ValidationError(
                     type="edge",
-                    message=f"Source node '{edge.source}' not found",
+                    message=f"Invalid connection from {source_type} to {target_type}",
                     edge_id=edge.id
                 ))
+            if source_type is text:
+                text_counts[target] += 1
+            elif source_type is image:
+                has_image[target] = True
+        
+        # Validate nodes and work out the operation each one is expected to run
+        node_errors = []
+        operations: Dict[str, Optional[ConnectionType]] = {}
+        for i in range(count):
+            node_type = types[i]
+            inputs = len(incoming[i])
+            if not inputs:
+                if not has_data[i]:
+                    message = (
+                        "Text node without inputs must have text data" if node_type is text
+                        else f"{node_type.value.title()} node without inputs must have file data"
+                    )
+                    node_errors.append(ValidationError(type="node", message=message, node_id=ids[i]))
+                # Root nodes feed on their own data
+                operations[ids[i]] = EXPECTED_OPERATIONS[node_type, int(node_type is text), node_type is not text]
                 continue
-                
-            if edge.target not in node_map:
-                errors.append(ValidationError(
-                    type="edge",
-                    message=f"Target node '{edge.target}' not found",
-                    edge_id=edge.id
+            if inputs > 2 and node_type is not text:
+                # Text nodes can have multiple text inputs for combination; media nodes cannot
+                node_errors.append(ValidationError(
+                    type="node",
+                    message=f"{node_type.value.title()} nodes can have at most 2 inputs (text + image)",
+                    node_id=ids[i]
                 ))
+            # Counts stop at two, the most any operation tells apart
+            operations[ids[i]] = EXPECTED_OPERATIONS[node_type, min(text_counts[i], 2), has_image[i]]
+        
+        # Kahn's algorithm, one wave at a time: a node becomes ready in the wave after
+        # its deepest input, so each wave is a level and the leftovers are cyclic.
+        remaining = in_degree[:]
+        levels: List[List[str]] = []
+        order: List[str] = []
+        ready = [i for i in range(count) if not in_degree[i]]
+        while ready:
+            level = [ids[i] for i in ready]
+            levels.append(level)
+            order.extend(level)
+            next_ready = []
+            for i in ready:
+                for j in successors[i]:
+                    remaining[j] -= 1
+                    if not remaining[j]:
+                        next_ready.append(j)
+            ready = next_ready
+        
+        dependents = {node_id: children for node_id, children in zip(ids, successor_ids) if children}
+        graph_errors = []
+        if len(order) < count:
+            members = self._find_cycle_members([ids[i] for i in range(count) if remaining[i]], dependents)
+            shown = ", ".join(members[:CYCLE_REPORT_LIMIT])
+            if len(members) > CYCLE_REPORT_LIMIT:
+                shown += f" and {len(members) - CYCLE_REPORT_LIMIT} more"
+            graph_errors.append(ValidationError(
+                type="graph",
+                message=f"Graph contains cycles which would prevent execution (nodes: {shown})"
+            ))
+        
+        incoming_edges = dict(zip(ids, incoming))
+        incoming_edges.update(dangling)
+        errors = edge_errors + node_errors + graph_errors
+        return ExecutionPlan(
+            structure=structure,
+            structure_hash=key,
+            validation=ValidationResult(valid=len(errors) == 0, errors=errors),
+            order=order,
+            levels=levels,
+            incoming_edges=incoming_edges,
+            dependents=dependents,
+            in_degree=dict(zip(ids, in_degree)),
+            operations=operations
+        )
+    
+    def _find_cycle_members(self, leftover: List[str], dependents: Dict[str, List[str]]) -> List[str]:
+        """Return the nodes that lie on a cycle, using an iterative Tarjan SCC search.
+        
+        ``leftover`` are the nodes Kahn's algorithm could not order: cycle members plus
+        anything downstream of a cycle. Only the former are reported.
+        """
+        candidates = set(leftover)
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+        members: Set[str] = set()
+        
+        for root in leftover:
+            if root in index:
                 continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(dependents.get(root, ())))]
             
-            source_node = node_map[edge.source]
-            target_node = node_map[edge.target]
-            
-            # Validate connection type compatibility
-            connection_valid = self._validate_connection_type(source_node, target_node)
-            if not connection_valid:
-                errors.append(ValidationError(
-                    type="edge",
-                    message=f"Invalid connection from {source_node.type} to {target_node.type}",
-                    edge_id=edge.id
-                ))
+            while work:
+                node_id, successors = work[-1]
+                descended = False
+                for successor in successors:
+                    if successor not in candidates:
+                        continue
+                    if successor not in index:
+                        index[successor] = low[successor] = len(index)
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(dependents.get(successor, ()))))
+                        descended = True
+                        break
+                    if successor in on_stack:
+                        low[node_id] = min(low[node_id], index[successor])
+                if descended:
+                    continue
+                
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node_id])
+                
+                if low[node_id] == index[node_id]:
+                    # node_id is the root of a strongly connected component
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node_id:
+                            break
+                    if len(component) > 1 or node_id in dependents.get(node_id, ()):
+                        members.update(component)
         
-        return errors
+        return [node_id for node_id in leftover if node_id in members]
     
     def _validate_connection_type(self, source: Node, target: Node) -> bool:
         """Check if connection between two node types is valid."""
-        valid_connections = {
-            # Source -> Target
-            (NodeType.TEXT, NodeType.TEXT): True,
-            (NodeType.TEXT, NodeType.IMAGE): True,
-            (NodeType.TEXT, NodeType.VIDEO): True,
-            (NodeType.IMAGE, NodeType.TEXT): True,
-            (NodeType.IMAGE, NodeType.IMAGE): True,  # For text + image -> image workflows
-            (NodeType.IMAGE, NodeType.VIDEO): True,
-        }
-        
-        return valid_connections.get((source.type, target.type), False)
+        return (source.type, target.type) in VALID_CONNECTIONS
+    
+    def _topological_sort(self, graph: GraphDefinition) -> List[str]:
+        """Return the execution order computed when the graph's plan was compiled."""
+        return self.get_plan(graph).order
     
-    def _validate_nodes(self, graph: GraphDefinition) -> List[ValidationError]:
-        """Validate individual nodes."""
-        errors = []
+    async def _run_dag(
+        self,
+        plan: ExecutionPlan,
+        node_map: Dict[str, Node],
+        run_id: str,
+        reuse: Dict[str, Any],
+        shared_results: Optional[Dict[str, asyncio.Future]] = None,
+        deadline: Optional[float] = None,
+        nodes: Optional[Set[str]] = None,
+        user_id: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        provider_jobs: Optional[Dict[str, Dict[str, str]]] = None
+    ) -> AsyncGenerator[Tuple[str, str, Any], None]:
+        """Run every node as soon as all of its upstream nodes have finished.
         
-        # Create adjacency map for input validation
-        incoming_edges = defaultdict(list)
-        for edge in graph.edges:
-            incoming_edges[edge.target].append(edge)
+        Ready nodes run concurrently on the event loop and report back through an
+        internal queue. Yields ``("start", node_id, None)`` when a node is launched, then
+        ``("complete", node_id, details)`` or ``("error", node_id, exception)`` when it
+        finishes, in the order those things actually happen. When a node fails, every
+        node downstream of it that has not started is dropped with a ``("skipped",
+        node_id, failed_node_id)`` event, while independent branches carry on. Events
+        reported from inside a node's provider calls, such as ``("retry", node_id,
+        details)`` or ``("job", node_id, details)``, are passed through; ``("progress",
+        node_id, details)`` ones are throttled and merged by a ProgressThrottle per node.
         
-        for node in graph.nodes:
-            # Check if nodes with no inputs have required data
-            if node.id not in incoming_edges:
-                if node.type == NodeType.TEXT and not node.data.text:
-                    errors.append(ValidationError(
-                        type="node",
-                        message="Text node without inputs must have text data",
-                        node_id=node.id
-                    ))
-                elif node.type in [NodeType.IMAGE, NodeType.VIDEO] and not node.data.file_url:
-                    errors.append(ValidationError(
-                        type="node",
-                        message=f"{node.type.value.title()} node without inputs must have file data",
-                        node_id=node.id
-                    ))
+        Provider calls made by the nodes are attributed to ``run_id`` of ``user_id`` at
+        ``priority`` and bounded by ``deadline`` (a time.monotonic() value); nodes listed in ``reuse`` take the given
+        result without being executed. With ``shared_results``, nodes are computed once
+        per fingerprint across every run given the same dict (see _execute_shared).
+        ``nodes`` limits the run to part of the graph; it must include the inputs of
+        every node in it that is not in ``reuse``. ``provider_jobs`` maps node ids to
+        the provider job an interrupted attempt at them submitted, to be waited on
+        rather than submitted again (see current_provider_job).
+        """
+        provider_jobs = provider_jobs or {}
+        if nodes is None:
+            remaining = dict(plan.in_degree)
+        else:
+            # Reused nodes can start straight away; what feeds them may not be part of the run
+            remaining = {node_id: 0 if node_id in reuse else plan.in_degree[node_id] for node_id in nodes}
+        incoming_edges = plan.incoming_edges
+        # Ready nodes start longest-remaining-path first, and provider slots favour
+        # them in the same order, so the slowest chain is never left until last
+        critical_path = plan.remaining_path(
+            {
+                node_id: 0.0 if node_id in reuse else self.latency.estimate(plan.operations.get(node_id))
+                for node_id in remaining
+            },
+            nodes
+        )
+        
+        events: asyncio.Queue = asyncio.Queue()
+        running: Dict[str, asyncio.Task] = {}
+        # Heap of (-critical path, arrival number, node id); equals keep the order they became ready in
+        arrivals = itertools.count()
+        ready = [
+            (-critical_path[node_id], next(arrivals), node_id) for node_id, count in remaining.items() if count == 0
+        ]
+        heapq.heapify(ready)
+        
+        async def run_node(node_id: str):
+            # Each task runs in its own context copy, so this never leaks to the caller
+            current_run_id.set(run_id)
+            current_critical_path.set(critical_path[node_id])
+            current_user_id.set(user_id)
+            current_priority.set(priority)
+            current_deadline.set(deadline)
+            if node_id in provider_jobs:
+                # A copy: the service taking the job mutates it
+                current_provider_job.set(dict(provider_jobs[node_id]))
+            progress = ProgressThrottle(
+                lambda details: events.put_nowait(("progress", node_id, details)), self.progress_interval
+            )
             
-            # Validate input count for nodes with specific requirements
-            input_count = len(incoming_edges[node.id])
-            if node.type == NodeType.TEXT and input_count > 0:
-                # Text nodes can have multiple text inputs for combination
-                pass
-            elif node.type == NodeType.IMAGE and input_count > 2:
-                errors.append(ValidationError(
-                    type="node",
-                    message="Image nodes can have at most 2 inputs (text + image)",
-                    node_id=node.id
-                ))
-            elif node.type == NodeType.VIDEO and input_count > 2:
-                errors.append(ValidationError(
-                    type="node",
-                    message="Video nodes can have at most 2 inputs (text + image)",
-                    node_id=node.id
-                ))
+            def report(event: str, details: Dict[str, Any]):
+                if event == "progress":
+                    progress.report(details)
+                else:
+                    events.put_nowait((event, node_id, details))
+            
+            current_event_sink.set(report)
+            if node_id in reuse:
+                node = node_map[node_id]
+                node.data.result = reuse[node_id]
+                node.data.error = None
+                events.put_nowait(("complete", node_id, {"reused": True}))
+                return
+            span = tracer.start(
+                node_id, "node", lane=node_id,
+                node_type=node_map[node_id].type.value, critical_path=critical_path[node_id]
+            )
+            token = current_span.set(span)
+            try:
+                if shared_results is None:
+                    details = await self._execute_node(node_map[node_id], incoming_edges.get(node_id, []), node_map)
+                else:
+                    details = await self._execute_shared(
+                        node_map[node_id], incoming_edges.get(node_id, []), node_map, shared_results
+                    )
+            except asyncio.CancelledError as e:
+                tracer.end(span, e)
+                raise
+            except Exception as e:
+                tracer.end(span, e)
+                events.put_nowait(("error", node_id, e))
+            else:
+                if span is not None:
+                    span.attributes.update((key, value) for key, value in details.items() if value is not None)
+                tracer.end(span)
+                events.put_nowait(("complete", node_id, details))
+            finally:
+                progress.close()
+                current_span.reset(token)
         
-        return errors
+        try:
+            while ready or running:
+                # Launch everything whose inputs are available
+                while ready:
+                    _, _, node_id = heapq.heappop(ready)
+                    # Launched nodes leave ``remaining``, so it only holds nodes yet to start
+                    del remaining[node_id]
+                    running[node_id] = asyncio.create_task(run_node(node_id))
+                    yield ("start", node_id, None)
+                
+                event, node_id, payload = await events.get()
+                if event not in ("complete", "error"):
+                    # Progress from a node that is still running
+                    yield (event, node_id, payload)
+                    continue
+                running.pop(node_id)
+                yield (event, node_id, payload)
+                
+                if event == "error":
+                    # Nothing downstream can get valid inputs now, so don't pay for it
+                    stack = [node_id]
+                    while stack:
+                        for neighbor in plan.dependents.get(stack.pop(), ()):
+                            if neighbor in remaining:
+                                del remaining[neighbor]
+                                stack.append(neighbor)
+                                yield ("skipped", neighbor, node_id)
+                    continue
+                
+                for neighbor in plan.dependents.get(node_id, ()):
+                    if neighbor not in remaining:
+                        continue
+                    remaining[neighbor] -= 1
+                    if remaining[neighbor] == 0:
+                        heapq.heappush(ready, (-critical_path[neighbor], next(arrivals), neighbor))
+        finally:
+            # Don't leave orphaned node tasks behind if the consumer stops early
+            for task in running.values():
+                task.cancel()
     
-    def _validate_graph_structure(self, graph: GraphDefinition) -> List[ValidationError]:
-        """Validate graph-level properties like cycles."""
-        errors = []
+    def compute_fingerprints(
+        self,
+        graph: GraphDefinition,
+        plan: Optional[ExecutionPlan] = None,
+        nodes: Optional[Set[str]] = None
+    ) -> Dict[str, str]:
+        """Hash each node's own data together with the fingerprints of everything upstream.
         
-        # Check for cycles using DFS
-        if self._has_cycles(graph):
-            errors.append(ValidationError(
-                type="graph",
-                message="Graph contains cycles which would prevent execution"
-            ))
+        Two nodes with the same fingerprint would receive identical inputs, so a result
+        produced under one fingerprint can be reused for the other. Files are hashed by
+        URL, which stands for their content because uploads are named after their bytes.
+        Assumes a valid DAG, or at least a valid ``nodes`` subset closed under its inputs.
+        """
+        plan = plan or self.get_plan(graph)
+        node_map = {node.id: node for node in graph.nodes}
+        
+        fingerprints = {}
+        for node_id in plan.order:
+            if nodes is not None and node_id not in nodes:
+                continue
+            node = node_map[node_id]
+            payload = json.dumps({
+                "type": node.type.value,
+                "text": node.data.text,
+                "file_url": node.data.file_url,
+                # Edge order matters: it decides the order of combined text inputs
+                "inputs": [
+                    [edge.sourceHandle, edge.targetHandle, fingerprints[edge.source]]
+                    for edge in plan.incoming_edges.get(node_id, ())
+                ]
+            })
+            fingerprints[node_id] = hashlib.sha256(payload.encode("utf-8")).hexdigest()
         
-        return errors
+        return fingerprints
     
-    def _has_cycles(self, graph: GraphDefinition) -> bool:
-        """Detect cycles in the graph using DFS."""
-        # Build adjacency list
-        adj = defaultdict(list)
-        for edge in graph.edges:
-            adj[edge.source].append(edge.target)
-        
-        # Track node states: 0=unvisited, 1=visiting, 2=visited
-        state = {node.id: 0 for node in graph.nodes}
-        
-        def dfs(node_id: str) -> bool:
-            # Skip if node doesn't exist (handled by edge validation)
-            if node_id not in state:
-                return False
-                
-            if state[node_id] == 1:  # Currently visiting - cycle detected
-                return True
-            if state[node_id] == 2:  # Already visited
-                return False
-            
-            state[node_id] = 1  # Mark as visiting
-            
-            for neighbor in adj[node_id]:
-                if dfs(neighbor):
-                    return True
-            
-            state[node_id] = 2  # Mark as visited
-            return False
+    def _find_reusable_results(
+        self,
+        graph: GraphDefinition,
+        fingerprints: Dict[str, str],
+        previous_run_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Collect results from a previous run for nodes whose inputs have not changed.
+        
+        Uses the stored results of ``previous_run_id`` when given, otherwise the results
+        and fingerprints the client echoed back in each node's data.
+        """
+        previous = self.run_history.get(previous_run_id) if previous_run_id else None
+        if previous_run_id and previous is None:
+            logger.warning(f"Unknown previous run {previous_run_id}, using results sent with the graph")
         
-        # Check all nodes
+        reusable = {}
         for node in graph.nodes:
-            if state[node.id] == 0 and dfs(node.id):
-                return True
+            fingerprint = fingerprints.get(node.id)
+            if fingerprint is None:
+                continue
+            if previous is not None:
+                entry = previous.get(node.id)
+                if entry and entry[0] == fingerprint:
+                    reusable[node.id] = entry[1]
+            elif (node.data.fingerprint == fingerprint
+                  and node.data.result is not None and not node.data.error):
+                reusable[node.id] = node.data.result
         
-        return False
+        return reusable
     
-    def _topological_sort(self, graph: GraphDefinition) -> List[str]:
-        """Perform topological sort to determine execution order."""
-        # Build adjacency list and in-degree count
-        adj = defaultdict(list)
-        in_degree = {node.id: 0 for node in graph.nodes}
-        
-        for edge in graph.edges:
-            adj[edge.source].append(edge.target)
-            in_degree[edge.target] += 1
-        
-        # Kahn's algorithm
-        queue = deque([node_id for node_id, degree in in_degree.items() if degree == 0])
-        result = []
-        
-        while queue:
-            node_id = queue.popleft()
-            result.append(node_id)
-            
-            for neighbor in adj[node_id]:
-                in_degree[neighbor] -= 1
-                if in_degree[neighbor] == 0:
-                    queue.append(neighbor)
+    def _blocking_errors(
+        self,
+        graph: GraphDefinition,
+        plan: ExecutionPlan,
+        nodes: Optional[Set[str]] = None
+    ) -> List[ValidationError]:
+        """Validation errors that stop a run of ``nodes`` (default: the whole graph).
         
-        return result
+        A half-built side branch should not stop a run that never reaches it, so only
+        errors on those nodes and their inputs count, plus graph-wide ones like cycles.
+        """
+        if nodes is None:
+            return plan.validation.errors
+        edge_targets = {edge.id: edge.target for edge in graph.edges}
+        return [
+            err for err in plan.validation.errors
+            if err.type == "graph" or err.node_id in nodes or edge_targets.get(err.edge_id) in nodes
+        ]
     
-    async def execute_graph(self, graph: GraphDefinition) -> ExecutionResult:
-        """Execute the graph in topological order."""
-        try:
-            # Validate graph first
-            validation = self.validate_graph(graph)
-            if not validation.valid:
+    def _remember_run(self, run_id: str, graph: GraphDefinition):
+        """Keep the results of a finished run so a later incremental run can refer to it."""
+        self.run_history[run_id] = {
+            node.id: (node.data.fingerprint, node.data.result)
+            for node in graph.nodes
+            if node.data.result is not None and not node.data.error
+        }
+        while len(self.run_history) > RUN_HISTORY_SIZE:
+            self.run_history.popitem(last=False)
+    
+    async def execute_graph(
+        self,
+        graph: GraphDefinition,
+        incremental: bool = False,
+        previous_run_id: Optional[str] = None,
+        targets: Optional[List[str]] = None,
+        user_id: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE
+    ) -> ExecutionResult:
+        """Execute the graph, running independent nodes concurrently."""
+        run_id = None
+        events = self.execute_graph_streaming(
+            graph, incremental, previous_run_id, targets=targets, user_id=user_id, priority=priority
+        )
+        async for event in events:
+            if event["type"] == "start":
+                run_id = event["run_id"]
+            elif event["type"] == "error":
+                return ExecutionResult(success=False, nodes=graph.nodes, errors=event["errors"], run_id=run_id)
+            elif event["type"] == "complete":
                 return ExecutionResult(
-                    success=False,
+                    success=event["success"],
                     nodes=graph.nodes,
-                    errors=[f"{err.type}: {err.message}" for err in validation.errors]
+                    errors=event["errors"],
+                    skipped_nodes=event["skipped_nodes"],
+                    run_id=run_id
                 )
-            
-            # Get execution order
-            execution_order = self._topological_sort(graph)
-            
-            # Create node map for easy access
-            node_map = {node.id: node for node in graph.nodes}
-            
-            # Build edge maps for efficient lookup
-            incoming_edges = defaultdict(list)
-            for edge in graph.edges:
-                incoming_edges[edge.target].append(edge)
-            
-            errors = []
-            
-            # Execute nodes in topological order
-            for node_id in execution_order:
-                node = node_map[node_id]
-                
-                try:
-                    await self._execute_node(node, incoming_edges[node_id], node_map)
-                except Exception as e:
-                    error_msg = f"Error executing node {node_id}: {str(e)}"
-                    logger.error(error_msg)
-                    errors.append(error_msg)
-                    node.data.error = str(e)
-            
-            return ExecutionResult(
-                success=len(errors) == 0,
-                nodes=list(node_map.values()),
-                errors=errors
-            )
-            
-        except Exception as e:
-            logger.error(f"Graph execution failed: {str(e)}")
-            return ExecutionResult(
-                success=False,
-                nodes=graph.nodes,
-                errors=[f"Graph execution failed: {str(e)}"]
-            )
-
-    async def execute_graph_streaming(self, graph: GraphDefinition) -> AsyncGenerator[Dict[str, Any], None]:
-        """Execute the graph in topological order, yielding node results as they complete."""
+    
+    async def execute_graph_streaming(
+        self,
+        graph: GraphDefinition,
+        incremental: bool = False,
+        previous_run_id: Optional[str] = None,
+        shared_results: Optional[Dict[str, asyncio.Future]] = None,
+        targets: Optional[List[str]] = None,
+        run_id: Optional[str] = None,
+        checkpoint: Optional[Dict[str, Any]] = None,
+        user_id: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        provider_jobs: Optional[Dict[str, Dict[str, str]]] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Execute the graph concurrently, yielding node events in the order they happen.
+        
+        With ``incremental`` set, nodes whose own data and upstream inputs are unchanged
+        since the previous run reuse that run's result instead of being recomputed.
+        ``shared_results`` lets the rows of a batch share node results with each other.
+        
+        With ``targets``, only those nodes and the ancestors they still need are
+        executed. Targeted runs always reuse unchanged results (supplied with the graph,
+        or from ``previous_run_id``), and every other node is left as it was sent.
+        ``run_id`` is generated unless the caller already assigned one (e.g. a queued run).
+        ``checkpoint`` maps node ids to results an interrupted attempt at this same run
+        already produced; those nodes take their result instead of running again, and
+        ``provider_jobs`` the provider jobs it left running, which are waited on rather
+        than submitted again. Each job a node submits is reported as a ``node_job``
+        event so it can be recorded. Provider calls queue behind those of other users and of more urgent runs
+        according to ``user_id`` and ``priority`` (see FairLimiter).
+        """
         try:
-            # Validate graph first
-            validation = self.validate_graph(graph)
-            if not validation.valid:
+            # Validation and sorting come from the cached plan for this structure
+            plan = self.get_plan(graph)
+            upstream = None
+            if targets is not None:
+                unknown = [node_id for node_id in targets if node_id not in plan.in_degree]
+                if unknown:
+                    yield {
+                        "type": "error",
+                        "errors": [f"Unknown target node '{node_id}'" for node_id in unknown]
+                    }
+                    return
+                upstream = plan.upstream(targets)
+            
+            blocking = self._blocking_errors(graph, plan, upstream)
+            if blocking:
                 yield {
                     "type": "error",
-                    "errors": [f"{err.type}: {err.message}" for err in validation.errors]
+                    "errors": [f"{err.type}: {err.message}" for err in blocking]
                 }
                 return
             
+            run_id = run_id or uuid.uuid4().hex
+            deadline = time.monotonic() + self.run_timeout if self.run_timeout else None
+            fingerprints = self.compute_fingerprints(graph, plan, upstream)
+            selected = None
+            reuse = {}
+            if targets is not None or incremental:
+                reuse = self._find_reusable_results(graph, fingerprints, previous_run_id)
+            if checkpoint:
+                reuse.update((node_id, result) for node_id, result in checkpoint.items() if node_id in fingerprints)
+            if targets is not None:
+                # Pull from the targets, stopping at reusable results: whatever feeds
+                # those is never visited, and side branches are never reached at all
+                selected = plan.upstream(targets, stop_at=reuse)
+                reuse = {node_id: reuse[node_id] for node_id in selected if node_id in reuse}
+            total_nodes = len(graph.nodes) if selected is None else len(selected)
+            
             # Yield initial status
             yield {
                 "type": "start",
-                "total_nodes": len(graph.nodes),
+                "run_id": run_id,
+                "total_nodes": total_nodes,
+                "reused_nodes": len(reuse),
                 "message": "Starting workflow execution..."
             }
             
-            # Get execution order
-            execution_order = self._topological_sort(graph)
-            
             # Create node map for easy access
             node_map = {node.id: node for node in graph.nodes}
-            
-            # Build edge maps for efficient lookup
-            incoming_edges = defaultdict(list)
-            for edge in graph.edges:
-                incoming_edges[edge.target].append(edge)
+            for node_id in (fingerprints if selected is None else selected):
+                node_map[node_id].data.fingerprint = fingerprints[node_id]
             
             errors = []
+            skipped_nodes = []
             completed_nodes = 0
+            retries: Dict[str, int] = defaultdict(int)
             
-            # Execute nodes in topological order
-            for node_id in execution_order:
-                node = node_map[node_id]
-                
-                # Yield node start event
-                yield {
-                    "type": "node_start",
-                    "node_id": node_id,
-                    "node_type": node.type.value,
-                    "progress": completed_nodes / len(graph.nodes),
-                    "message": f"Executing {node.type.value} node: {node_id}"
-                }
-                
-                try:
-                    await self._execute_node(node, incoming_edges[node_id], node_map)
+            # Events arrive in completion order, not topological order. Closing this
+            # generator early (e.g. the client went away) cancels the running nodes.
+            run_span = tracer.start_run(
+                run_id, total_nodes=total_nodes, reused_nodes=len(reuse), priority=priority, user_id=user_id or ""
+            )
+            run_error = None
+            GRAPH_RUNS_IN_PROGRESS.inc()
+            node_events = self._run_dag(
+                plan, node_map, run_id, reuse, shared_results, deadline, selected, user_id, priority, provider_jobs
+            )
+            try:
+                async for event, node_id, payload in node_events:
+                    node = node_map[node_id]
                     
-                    # Yield node completion event
-                    completed_nodes += 1
-                    yield {
-                        "type": "node_complete",
-                        "node_id": node_id,
-                        "node_type": node.type.value,
-                        "result": node.data.result,
-                        "error": node.data.error,
-                        "progress": completed_nodes / len(graph.nodes),
-                        "message": f"Completed {node.type.value} node: {node_id}"
-                    }
+                    if event == "start":
+                        yield {
+                            "type": "node_start",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            "progress": completed_nodes / total_nodes,
+                            "message": f"Executing {node.type.value} node: {node_id}"
+                        }
+                        continue
+                    
+                    if event == "progress":
+                        yield {
+                            "type": "node_progress",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            **payload,
+                            "progress": completed_nodes / total_nodes,
+                            "message": payload.get("message") or f"Executing {node.type.value} node: {node_id}"
+                        }
+                        continue
+                    
+                    if event == "retry":
+                        retries[node_id] += 1
+                        yield {
+                            "type": "node_retry",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            "attempt": payload["attempt"],
+                            "max_attempts": payload["max_attempts"],
+                            "delay": payload["delay"],
+                            "error": payload["error"],
+                            "message": f"Retrying {node.type.value} node {node_id} in {payload['delay']:.1f}s"
+                        }
+                        continue
+                    
+                    if event == "job":
+                        yield {
+                            "type": "node_job",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            "provider": payload["provider"],
+                            "endpoint": payload["endpoint"],
+                            "request_id": payload["request_id"],
+                            "message": f"Submitted {node.type.value} node {node_id} as job {payload['request_id']}"
+                        }
+                        continue
                     
-                except Exception as e:
-                    error_msg = f"Error executing node {node_id}: {str(e)}"
-                    logger.error(error_msg)
-                    errors.append(error_msg)
-                    node.data.error = str(e)
                     completed_nodes += 1
                     
-                    # Yield node error event
-                    yield {
-                        "type": "node_error",
-                        "node_id": node_id,
-                        "node_type": node.type.value,
-                        "error": str(e),
-                        "progress": completed_nodes / len(graph.nodes),
-                        "message": f"Error in {node.type.value} node: {node_id}"
-                    }
+                    if event == "skipped":
+                        # Clear any stale result so it can't be mistaken for this run's
+                        node.data.result = None
+                        node.data.error = None
+                        skipped_nodes.append(node_id)
+                        yield {
+                            "type": "node_skipped",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            "failed_node_id": payload,
+                            "progress": completed_nodes / total_nodes,
+                            "message": f"Skipped {node.type.value} node {node_id}: upstream node {payload} failed"
+                        }
+                    elif event == "complete":
+                        yield {
+                            "type": "node_complete",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            "result": node.data.result,
+                            "error": node.data.error,
+                            "cache": payload.get("cache"),
+                            "reused": payload.get("reused", False),
+                            "shared": payload.get("shared", False),
+                            "attempts": retries[node_id] + 1,
+                            "progress": completed_nodes / total_nodes,
+                            "message": f"Completed {node.type.value} node: {node_id}"
+                        }
+                    else:
+                        error_msg = f"Error executing node {node_id}: {str(payload)}"
+                        logger.error(error_msg)
+                        errors.append(error_msg)
+                        node.data.error = str(payload)
+                        
+                        yield {
+                            "type": "node_error",
+                            "node_id": node_id,
+                            "node_type": node.type.value,
+                            "error": str(payload),
+                            "attempts": retries[node_id] + 1,
+                            "progress": completed_nodes / total_nodes,
+                            "message": f"Error in {node.type.value} node: {node_id}"
+                        }
+            except BaseException as e:
+                run_error = e
+                raise
+            finally:
+                try:
+                    await node_events.aclose()
+                finally:
+                    run_span.attributes.update(
+                        completed_nodes=completed_nodes, failed_nodes=len(errors), skipped_nodes=len(skipped_nodes)
+                    )
+                    tracer.end_run(run_span, run_error)
+                    GRAPH_RUNS_IN_PROGRESS.dec()
+                    if run_error is None:
+                        GRAPH_RUNS.inc(outcome="succeeded" if not errors else "failed")
+                    elif isinstance(run_error, (asyncio.CancelledError, GeneratorExit)):
+                        GRAPH_RUNS.inc(outcome="cancelled")
+                    else:
+                        GRAPH_RUNS.inc(outcome="error")
+            
+            # Batch rows are left out of the history so they cannot flush interactive runs
+            if shared_results is None:
+                self._remember_run(run_id, graph)
             
             # Yield final completion event
             yield {
                 "type": "complete",
+                "run_id": run_id,
                 "success": len(errors) == 0,
-                "total_nodes": len(graph.nodes),
+                "total_nodes": total_nodes,
                 "completed_nodes": completed_nodes,
+                "skipped_nodes": skipped_nodes,
                 "errors": errors,
                 "message": f"Workflow execution {'completed successfully' if len(errors) == 0 else 'completed with errors'}"
             }
-            
+        
         except Exception as e:
             logger.error(f"Graph execution failed: {str(e)}")
             yield {
                 "type": "error",
                 "errors": [f"Graph execution failed: {str(e)}"]
             }
-
-    async def _execute_node(self, node: Node, incoming_edges: List[Edge], node_map: Dict[str, Node]):
-        """Execute a single node based on its type and inputs."""
+    
+    async def execute_batch(
+        self,
+        graph: GraphDefinition,
+        rows: List[Dict[str, NodeOverride]],
+        max_concurrency: int = 4,
+        user_id: Optional[str] = None,
+        priority: str = PRIORITY_BATCH
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Run ``graph`` once per row of node overrides, yielding a record per finished row.
+        
+        Up to ``max_concurrency`` rows run at once and records arrive in completion
+        order. Every row uses the same compiled plan, and a node whose inputs come out
+        identical in several rows (an unchanged style prompt, say) runs only once.
+        Rows run at batch priority unless told otherwise, so a large batch only gets
+        the provider capacity interactive runs leave over.
+        """
+        shared_results: Dict[str, asyncio.Future] = {}
+        records: asyncio.Queue = asyncio.Queue()
+        pending_rows = iter(enumerate(rows))
+        
+        async def worker():
+            # Workers share one iterator, so each row is taken exactly once
+            for index, overrides in pending_rows:
+                records.put_nowait(await self._run_batch_row(
+                    graph, index, overrides, shared_results, user_id, priority
+                ))
+        
+        yield {
+            "type": "batch_start",
+            "total_rows": len(rows),
+            "max_concurrency": max_concurrency,
+            "message": f"Starting batch of {len(rows)} rows..."
+        }
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(max_concurrency, len(rows)))]
+        succeeded = 0
+        shared_nodes = 0
+        try:
+            for _ in range(len(rows)):
+                record = await records.get()
+                succeeded += record["success"]
+                shared_nodes += record["shared_nodes"]
+                yield record
+        finally:
+            for task in workers:
+                task.cancel()
+        
+        yield {
+            "type": "batch_complete",
+            "total_rows": len(rows),
+            "succeeded_rows": succeeded,
+            "failed_rows": len(rows) - succeeded,
+            "shared_nodes": shared_nodes,
+            "message": f"Batch finished: {succeeded} of {len(rows)} rows succeeded"
+        }
+    
+    async def _run_batch_row(
+        self,
+        graph: GraphDefinition,
+        index: int,
+        overrides: Dict[str, NodeOverride],
+        shared_results: Dict[str, asyncio.Future],
+        user_id: Optional[str] = None,
+        priority: str = PRIORITY_BATCH
+    ) -> Dict[str, Any]:
+        """Apply one row's overrides to a copy of the graph and execute it."""
+        record = {
+            "type": "row",
+            "row": index,
+            "run_id": None,
+            "success": False,
+            "errors": [],
+            "shared_nodes": 0,
+            "skipped_nodes": [],
+            "results": {}
+        }
+        
+        row_graph = graph.model_copy(deep=True)
+        node_map = {node.id: node for node in row_graph.nodes}
+        unknown = [node_id for node_id in overrides if node_id not in node_map]
+        if unknown:
+            record["errors"] = [f"Override for unknown node '{node_id}'" for node_id in unknown]
+            return record
+        for node_id, override in overrides.items():
+            for field, value in override.model_dump(exclude_unset=True).items():
+                setattr(node_map[node_id].data, field, value)
+        if overrides:
+            # Emptying or filling in a prompt changes the structure the key stands for
+            row_graph.structure_key = None
+        
+        events = self.execute_graph_streaming(
+            row_graph, shared_results=shared_results, user_id=user_id, priority=priority
+        )
+        async for event in events:
+            if event["type"] == "start":
+                record["run_id"] = event["run_id"]
+            elif event["type"] == "node_complete" and event["shared"]:
+                record["shared_nodes"] += 1
+            elif event["type"] == "error":
+                record["errors"] = event["errors"]
+            elif event["type"] == "complete":
+                record["success"] = event["success"]
+                record["errors"] = event["errors"]
+                record["skipped_nodes"] = event["skipped_nodes"]
+        
+        record["results"] = {node.id: node.data.result for node in row_graph.nodes}
+        return record
+    
+    async def _execute_shared(
+        self,
+        node: Node,
+        incoming_edges: List[Edge],
+        node_map: Dict[str, Node],
+        shared_results: Dict[str, asyncio.Future]
+    ) -> Dict[str, Any]:
+        """Execute a node at most once per fingerprint among runs sharing ``shared_results``.
+        
+        A run that reaches a fingerprint another run has computed, or is still computing,
+        waits for that result instead of calling the provider again. Failures are not
+        kept, so a later run gets to try again.
+        """
+        fingerprint = node.data.fingerprint
+        while fingerprint in shared_results:
+            pending = shared_results[fingerprint]
+            try:
+                # Shielded so that cancelling this run leaves the owning run alone
+                result = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The owning run was cancelled; take over unless someone else already has
+                continue
+            except Exception as e:
+                node.data.error = str(e)
+                raise
+            node.data.result = result
+            node.data.error = None
+            return {"shared": True}
+        
+        pending = asyncio.get_running_loop().create_future()
+        shared_results[fingerprint] = pending
+        try:
+            details = await self._execute_node(node, incoming_edges, node_map)
+        except asyncio.CancelledError:
+            del shared_results[fingerprint]
+            pending.cancel()
+            raise
+        except Exception as e:
+            del shared_results[fingerprint]
+            pending.set_exception(e)
+            # Mark the exception as retrieved; it is re-raised here, whether or not anyone waits
+            pending.exception()
+            raise
+        pending.set_result(node.data.result)
+        return details
+    
+    async def _execute_node(self, node: Node, incoming_edges: List[Edge], node_map: Dict[str, Node]) -> Dict[str, Any]:
+        """Execute a single node based on its type and inputs.
+        
+        Returns extra details for the node's completion event (e.g. cache status).
+        """
         logger.info(f"Executing node {node.id} of type {node.type}")
         
         # Clear previous results and errors
@@ -397,73 +1040,86 @@ class GraphProcessor:
             elif node.type in [NodeType.IMAGE, NodeType.VIDEO] and node.data.file_url:
                 image_input = node.data.file_url
         
+        details = {}
+        # Time spent in provider calls, which is what the latency estimates learn from
+        call_seconds: List[float] = []
+        current_call_timer.set(call_seconds.append)
+        
         # Determine the type of operation based on inputs and target
+        started = time.monotonic()
+        operation = None
+        outcome = "error"
         try:
-            result = await self._process_node_operation(node, text_inputs, image_input)
+            operation = self._resolve_operation(node, text_inputs, image_input)
+            cache_key = None
+            if self.result_cache is not None and operation is not None:
+                cache_key = make_cache_key(
+                    node.type.value, operation.value, text_inputs, image_input,
+                    {"model": OPERATION_MODELS[operation]}
+                )
+            
+            result = await self.result_cache.aget(cache_key) if cache_key else None
+            if result is not None:
+                details["cache"] = "hit"
+                outcome = "cache_hit"
+                logger.info(f"Node {node.id} served from result cache")
+            else:
+                result = await self._process_node_operation(node, text_inputs, image_input)
+                outcome = "success"
+                if operation is not None and call_seconds:
+                    self.latency.record(operation, sum(call_seconds))
+                if cache_key:
+                    await self.result_cache.aset(cache_key, result)
+                    details["cache"] = "miss"
+            
             node.data.result = result
             logger.info(f"Node {node.id} executed successfully")
+            return details
         except Exception as e:
             logger.error(f"Node {node.id} execution failed: {str(e)}")
             node.data.error = str(e)
             raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            NODE_EXECUTION_SECONDS.observe(
+                time.monotonic() - started,
+                node_type=node.type.value,
+                operation=operation.value if operation is not None else "passthrough",
+                outcome=outcome
+            )
+    
+    def _resolve_operation(self, node: Node, text_inputs: List[str], image_input: Optional[str]) -> Optional[ConnectionType]:
+        """Work out which provider operation a node needs, or None for a passthrough."""
+        return resolve_operation(node.type, len(text_inputs), bool(image_input))
     
     async def _process_node_operation(self, node: Node, text_inputs: List[str], image_input: Optional[str]) -> Any:
         """Process the specific operation for this node."""
+        operation = self._resolve_operation(node, text_inputs, image_input)
         
         # Convert image_input to full URL if it's a relative path
         if image_input:
             image_input = self._convert_to_full_url(image_input)
         
-        # Determine operation type
-        if node.type == NodeType.TEXT:
-            if len(text_inputs) > 1:
-                # Multiple text inputs -> combine/summarize
-                return await self.service_manager.process_text_to_text(text_inputs, "combine")
-            elif len(text_inputs) == 1 and image_input:
-                # Text + Image -> Text (QA)
-                return await self.service_manager.process_image_to_text(
-                    image_input, text_inputs[0]
-                )
-            elif image_input and not text_inputs:
-                # Image only -> Text (description)
-                return await self.service_manager.process_image_to_text(image_input)
-            elif len(text_inputs) == 1:
-                # Single text input - pass through or process
-                return text_inputs[0]
-            else:
-                raise ValueError("Text node has no valid inputs")
-        
-        elif node.type == NodeType.IMAGE:
-            if len(text_inputs) == 1 and not image_input:
-                # Text -> Image
-                return await self.service_manager.process_text_to_image(text_inputs[0])
-            elif len(text_inputs) == 1 and image_input:
-                # Text + Image -> Image (editing)
-                return await self.service_manager.process_text_image_to_image(
-                    text_inputs[0], image_input
-                )
-            elif image_input and not text_inputs:
-                # Image passthrough
-                return image_input
-            else:
-                raise ValueError("Image node has no valid inputs")
-        
-        elif node.type == NodeType.VIDEO:
-            if len(text_inputs) == 1 and not image_input:
-                # Text -> Video
-                return await self.service_manager.process_text_to_video(text_inputs[0])
-            elif len(text_inputs) == 1 and image_input:
-                # Text + Image -> Video
-                return await self.service_manager.process_image_to_video(
-                    image_input, text_inputs[0]
-                )
-            elif image_input and not text_inputs:
-                # Image -> Video
-                return await self.service_manager.process_image_to_video(
-                    image_input, "Create a video from this image with natural movement"
-                )
-            else:
-                raise ValueError("Video node has no valid inputs")
-        
+        if operation is None:
+            # Passthrough of the single text or image input
+            return text_inputs[0] if node.type == NodeType.TEXT else image_input
+        elif operation == ConnectionType.TEXT_TO_TEXT:
+            return await self.service_manager.process_text_to_text(text_inputs, "combine")
+        elif operation == ConnectionType.TEXT_IMAGE_TO_TEXT:
+            return await self.service_manager.process_image_to_text(image_input, text_inputs[0])
+        elif operation == ConnectionType.IMAGE_TO_TEXT:
+            return await self.service_manager.process_image_to_text(image_input)
+        elif operation == ConnectionType.TEXT_TO_IMAGE:
+            return await self.service_manager.process_text_to_image(text_inputs[0])
+        elif operation == ConnectionType.TEXT_IMAGE_TO_IMAGE:
+            return await self.service_manager.process_text_image_to_image(text_inputs[0], image_input)
+        elif operation == ConnectionType.TEXT_TO_VIDEO:
+            return await self.service_manager.process_text_to_video(text_inputs[0])
+        elif operation == ConnectionType.TEXT_IMAGE_TO_VIDEO:
+            return await self.service_manager.process_image_to_video(image_input, text_inputs[0])
         else:
-            raise ValueError(f"Unknown node type: {node.type}")
\ No newline at end of file
+            return await self.service_manager.process_image_to_video(
+                image_input, "Create a video from this image with natural movement"
+            )
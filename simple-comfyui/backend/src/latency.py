@@ -0,0 +1,62 @@
+"""Running estimates of how long each kind of node operation takes."""
+
+import threading
+from typing import Dict, Optional
+
+from .models import ConnectionType
+
+# Rough starting points, used until an operation has been seen to run
+DEFAULT_LATENCIES: Dict[ConnectionType, float] = {
+    ConnectionType.TEXT_TO_TEXT: 3.0,
+    ConnectionType.TEXT_IMAGE_TO_TEXT: 5.0,
+    ConnectionType.IMAGE_TO_TEXT: 5.0,
+    ConnectionType.TEXT_TO_IMAGE: 8.0,
+    ConnectionType.TEXT_IMAGE_TO_IMAGE: 10.0,
+    ConnectionType.TEXT_TO_VIDEO: 90.0,
+    ConnectionType.TEXT_IMAGE_TO_VIDEO: 90.0,
+    ConnectionType.IMAGE_TO_VIDEO: 90.0,
+}
+
+
+class LatencyHistory:
+    """Exponentially weighted average of recent node latencies, per operation.
+    
+    The first observation replaces the default outright; after that each one moves
+    the estimate ``alpha`` of the way towards it, so the estimate follows a provider
+    that gets slower or faster without jumping on every outlier. Latencies are the
+    time spent with the provider, without waits for a slot or retry backoff, so a
+    tightly limited endpoint doesn't look slower the busier it gets.
+    """
+    
+    def __init__(self, alpha: float = 0.2, defaults: Optional[Dict[ConnectionType, float]] = None):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self._estimates: Dict[ConnectionType, float] = dict(DEFAULT_LATENCIES)
+        self._estimates.update(defaults or {})
+        self._samples: Dict[ConnectionType, int] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, operation: ConnectionType, seconds: float):
+        """Fold one observed latency into the operation's estimate."""
+        with self._lock:
+            samples = self._samples.get(operation, 0)
+            if samples == 0:
+                self._estimates[operation] = seconds
+            else:
+                self._estimates[operation] += self.alpha * (seconds - self._estimates[operation])
+            self._samples[operation] = samples + 1
+    
+    def estimate(self, operation: Optional[ConnectionType]) -> float:
+        """Expected seconds for ``operation``; passthroughs (None) cost nothing."""
+        if operation is None:
+            return 0.0
+        return self._estimates.get(operation, 0.0)
+    
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Current estimate and number of observations for every operation."""
+        with self._lock:
+            return {
+                operation.value: {"estimate_seconds": estimate, "samples": self._samples.get(operation, 0)}
+                for operation, estimate in self._estimates.items()
+            }
@@ -1,33 +1,45 @@
 """Main FastAPI application for node-based media generation."""
 
 import os
+import asyncio
+import hashlib
 import logging
 import json
+import time
 from pathlib import Path
 from datetime import timedelta
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 import uvicorn
-from typing import Optional, List
+from typing import Any, AsyncIterator, Optional, List
 
 from .models import (
     GraphDefinition, ValidationResult, ExecutionResult, 
-    FileUploadResponse, APIConfig
+    FileUploadResponse, APIConfig, BatchRunRequest
 )
+from .artifacts import ArtifactStore
 from .graph_processor import GraphProcessor
+from .result_cache import ResultCache
 from .services import ServiceManager
 from .database import engine, get_db, Base
 from .user_models import (
     User, UserWorkflow, UserCreate, UserLogin, UserResponse, 
     WorkflowCreate, WorkflowUpdate, WorkflowResponse
 )
+from .run_models import RunSubmitRequest, RunSubmitResponse, RunStatusResponse
+from .run_queue import RunStore, RunWorkerPool, make_run_queue
 from .auth import (
     authenticate_user, create_access_token, get_password_hash,
-    get_current_active_user, ACCESS_TOKEN_EXPIRE_MINUTES, Token
+    get_current_active_user, get_optional_user, ACCESS_TOKEN_EXPIRE_MINUTES, Token
 )
+from .services.run_context import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from .services.metrics import (
+    CONTENT_TYPE, HTTP_REQUEST_SECONDS, Counter, Gauge, InstrumentedThreadPoolExecutor, registry
+)
+from .services.tracing import to_chrome_trace, to_otlp, tracer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -61,11 +73,205 @@ app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
 FAL_API_KEY = os.getenv("FAL_API_KEY", None)
+# Optional JSON object of concurrency limits, e.g. {"fal": 20, "openai:gpt-4o": 32}
+PROVIDER_CONCURRENCY_LIMITS = json.loads(os.getenv("PROVIDER_CONCURRENCY_LIMITS", "{}"))
+# Processes calling the providers with these keys: the API plus every worker process.
+# Limits are enforced per process, so each takes this share of them.
+PROVIDER_CONCURRENCY_PROCESSES = int(os.getenv("PROVIDER_CONCURRENCY_PROCESSES", "1"))
+# Optional JSON object of per-call timeouts in seconds, keyed like the concurrency limits
+PROVIDER_TIMEOUTS = json.loads(os.getenv("PROVIDER_TIMEOUTS", "{}"))
+# Optional JSON object of retry policies, e.g. {"fal": {"max_attempts": 5, "base_delay": 1}}
+PROVIDER_RETRY_POLICIES = json.loads(os.getenv("PROVIDER_RETRY_POLICIES", "{}"))
+# Optional JSON object of fair-share weights by user id, e.g. {"42": 4}; others get 1
+USER_SHARE_WEIGHTS = json.loads(os.getenv("USER_SHARE_WEIGHTS", "{}"))
+# Optional JSON object for the OpenAI connection pool, e.g. {"max_connections": 200, "http2": true}
+OPENAI_CONNECTION_POOL = json.loads(os.getenv("OPENAI_CONNECTION_POOL", "{}"))
+# OpenAI connections opened at startup, so the first runs skip connection setup
+OPENAI_WARM_CONNECTIONS = int(os.getenv("OPENAI_WARM_CONNECTIONS", "4"))
+# Deadline for a whole graph run; 0 disables it
+RUN_TIMEOUT_SECONDS = float(os.getenv("RUN_TIMEOUT_SECONDS", "1800"))
+# Least seconds between two node_progress events of a node; provider updates in between are merged
+NODE_PROGRESS_INTERVAL = float(os.getenv("NODE_PROGRESS_INTERVAL", "0.5"))
+# Traces of the most recent runs are kept in memory; set TRACE_EXPORT_DIR to also write
+# every run's trace to files, which is how traces of runs on worker processes are served
+tracer.max_runs = int(os.getenv("TRACE_MAX_RUNS", "256"))
+if os.getenv("TRACE_EXPORT_DIR"):
+    tracer.export_dir = Path(os.getenv("TRACE_EXPORT_DIR"))
+# How often a streaming response checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 1.0
+
+service_manager = ServiceManager(
+    OPENAI_API_KEY, FAL_API_KEY, PROVIDER_CONCURRENCY_LIMITS, PROVIDER_TIMEOUTS, PROVIDER_RETRY_POLICIES,
+    USER_SHARE_WEIGHTS, OPENAI_CONNECTION_POOL, PROVIDER_CONCURRENCY_PROCESSES
+)
+# Node result cache (set NODE_CACHE_DB to also persist results to a SQLite file)
+result_cache = None
+if os.getenv("NODE_CACHE_ENABLED", "true").lower() == "true":
+    result_cache = ResultCache(
+        max_entries=int(os.getenv("NODE_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.getenv("NODE_CACHE_TTL_SECONDS", str(6 * 3600))),
+        db_path=os.getenv("NODE_CACHE_DB", None)
+    )
 
-service_manager = ServiceManager(OPENAI_API_KEY, FAL_API_KEY)
 # Get base URL from environment or use default
 BASE_URL = "http://localhost:8080"
-graph_processor = GraphProcessor(service_manager, BASE_URL)
+graph_processor = GraphProcessor(
+    service_manager, BASE_URL, result_cache, RUN_TIMEOUT_SECONDS or None, progress_interval=NODE_PROGRESS_INTERVAL
+)
+
+# Runs submitted to /runs are executed by this many background workers in the API
+# process; set 0 to leave them to separate worker processes (python -m src.worker)
+RUN_WORKERS = int(os.getenv("RUN_WORKERS", "4"))
+# "database" (the run table; fine for workers on one host) or "redis" (REDIS_URL)
+RUN_QUEUE_BACKEND = os.getenv("RUN_QUEUE_BACKEND", "database")
+# A run whose worker has not renewed its lease for this long is given to another worker
+RUN_LEASE_SECONDS = float(os.getenv("RUN_LEASE_SECONDS", "60"))
+# Resumed runs pass provider-hosted results on as they are for this long, then use the copies
+PROVIDER_URL_LIFETIME_SECONDS = float(os.getenv("PROVIDER_URL_LIFETIME_SECONDS", "3600"))
+run_store = RunStore(user_weights=USER_SHARE_WEIGHTS, provider_url_lifetime=PROVIDER_URL_LIFETIME_SECONDS)
+run_queue = make_run_queue(RUN_QUEUE_BACKEND, run_store, os.getenv("REDIS_URL"))
+# Generated media of queued runs is copied here so checkpoints outlive provider URLs
+artifact_store = ArtifactStore(UPLOADS_DIR / "artifacts", "/uploads/artifacts")
+run_workers = RunWorkerPool(
+    graph_processor, run_store, RUN_WORKERS, run_queue, artifact_store, RUN_LEASE_SECONDS
+)
+
+# Blocking work handed to threads (fal.ai client calls, database access, files) runs on
+# this pool; EXECUTOR_THREADS sizes it, by default as Python would (cores + 4, up to 32)
+default_executor = InstrumentedThreadPoolExecutor(int(os.getenv("EXECUTOR_THREADS", "0")) or None, "executor")
+
+
+def collect_app_metrics() -> List[Any]:
+    """Metrics read from the components' own counters when /metrics is scraped."""
+    slots_active = Gauge("provider_slots_active", "Provider calls holding a concurrency slot", ("limiter",))
+    slots_limit = Gauge("provider_slots_limit", "Concurrency limit of a provider or endpoint", ("limiter",))
+    slots_waiting = Gauge("provider_slots_waiting", "Provider calls waiting for a concurrency slot", ("limiter",))
+    for key, limiter in service_manager.get_concurrency_metrics().items():
+        slots_active.set(limiter["active"], limiter=key)
+        slots_limit.set(limiter["limit"], limiter=key)
+        slots_waiting.set(limiter["queue_depth"], limiter=key)
+    
+    in_flight = service_manager.get_in_flight_metrics()
+    calls_started = Counter("provider_calls_started_total", "Provider calls started after deduplication")
+    calls_started.inc(in_flight["started"])
+    calls_coalesced = Counter("provider_calls_coalesced_total", "Provider calls answered by an identical call in flight")
+    calls_coalesced.inc(in_flight["coalesced"])
+    
+    fal_requests = Gauge("fal_requests_in_flight", "fal.ai jobs this process is waiting on, by status", ("status",))
+    for request in service_manager.get_fal_requests():
+        fal_requests.inc(status=request["status"])
+    
+    cache_lookups = Counter("cache_lookups_total", "Cache lookups, by cache and result", ("cache", "result"))
+    cache_hit_ratio = Gauge("cache_hit_ratio", "Share of cache lookups that were hits since start", ("cache",))
+    caches = {"plan": graph_processor.plan_cache.get_stats()}
+    if graph_processor.result_cache is not None:
+        caches["node_result"] = graph_processor.result_cache.get_stats()
+    for name, stats in caches.items():
+        cache_lookups.inc(stats["hits"], cache=name, result="hit")
+        cache_lookups.inc(stats["misses"], cache=name, result="miss")
+        lookups = stats["hits"] + stats["misses"]
+        cache_hit_ratio.set(stats["hits"] / lookups if lookups else 0.0, cache=name)
+    return [
+        slots_active, slots_limit, slots_waiting, calls_started, calls_coalesced, fal_requests,
+        cache_lookups, cache_hit_ratio
+    ]
+
+
+registry.add_collector(default_executor.collect)
+registry.add_collector(collect_app_metrics)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by route template, so /runs/{run_id} is one series, not one per run."""
+    started = time.monotonic()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Streaming responses are timed to their first byte
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUEST_SECONDS.observe(
+            time.monotonic() - started, method=request.method, route=route, status=status_code
+        )
+
+
+@app.on_event("startup")
+async def use_instrumented_executor():
+    """Send the app's blocking work to the thread pool that /metrics reports on."""
+    asyncio.get_running_loop().set_default_executor(default_executor)
+
+
+@app.on_event("startup")
+async def start_run_workers():
+    """Start executing queued runs, including any a previous process left unfinished."""
+    await run_workers.start()
+
+
+@app.on_event("startup")
+async def warm_up_providers():
+    """Open provider connections in the background; startup does not wait for them."""
+    app.state.warm_up = asyncio.ensure_future(service_manager.warm_up(OPENAI_WARM_CONNECTIONS))
+
+
+@app.on_event("shutdown")
+async def stop_run_workers():
+    """Stop the run workers; their unfinished runs are picked up again on restart."""
+    await run_workers.stop()
+
+
+@app.on_event("shutdown")
+async def close_provider_connections():
+    """Close pooled provider connections once nothing is using them."""
+    warm_up = getattr(app.state, "warm_up", None)
+    if warm_up is not None:
+        warm_up.cancel()
+    await service_manager.aclose()
+
+
+def user_key(user: Optional[User]) -> Optional[str]:
+    """Who work is scheduled for when sharing capacity fairly; None for anonymous requests."""
+    return str(user.id) if user is not None else None
+
+
+def check_run_owner(owner: Optional[str], user: Optional[User]):
+    """404 unless the run is known and ``user`` submitted it ("" owns anonymous runs).
+    
+    Someone else's run is reported as not found rather than forbidden, so run ids
+    can't be probed.
+    """
+    if owner is None or owner != (user_key(user) or ""):
+        raise HTTPException(status_code=404, detail="Run not found")
+
+
+async def until_disconnected(request: Request, events: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Relay ``events`` while the client is connected, then cancel the producer.
+    
+    A run can go minutes without emitting anything (a long video job), so the
+    client is polled between events rather than only noticed on the next write.
+    Cancelling the producer cancels its running nodes and their provider requests.
+    """
+    next_event = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(events.__anext__())
+            while not next_event.done():
+                await asyncio.wait([next_event], timeout=DISCONNECT_POLL_SECONDS)
+                if not next_event.done() and await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling execution")
+                    return
+            try:
+                yield next_event.result()
+            except StopAsyncIteration:
+                return
+    finally:
+        if next_event is not None and not next_event.done():
+            # Cancelling the pending step unwinds the producer; it cannot be closed mid-step
+            next_event.cancel()
+        else:
+            await events.aclose()
 
 
 # Authentication endpoints
@@ -260,10 +466,19 @@ async def health_check():
     return {
         "status": "healthy",
         "openai_configured": service_manager.is_openai_configured(),
-        "fal_configured": service_manager.is_fal_configured()
+        "fal_configured": service_manager.is_fal_configured(),
+        "concurrency": service_manager.get_concurrency_metrics(),
+        "in_flight": service_manager.get_in_flight_metrics(),
+        "latency": graph_processor.latency.get_stats()
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics of this process in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
 @app.post("/configure-api", response_model=dict)
 async def configure_api(config: APIConfig):
     """Configure API keys for external services."""
@@ -297,8 +512,19 @@ async def validate_graph(graph: GraphDefinition):
 
 
 @app.post("/run-graph", response_model=ExecutionResult)
-async def run_graph(graph: GraphDefinition):
-    """Execute a workflow graph."""
+async def run_graph(
+    graph: GraphDefinition,
+    incremental: bool = False,
+    previous_run_id: Optional[str] = None,
+    targets: Optional[List[str]] = Query(None),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """Execute a workflow graph.
+    
+    With ``incremental=true`` only nodes whose data or upstream inputs changed since the
+    previous run (``previous_run_id``, or the results sent back in the graph) are recomputed.
+    Passing ``targets`` (repeatable) runs only those nodes and the ancestors they still need.
+    """
     try:
         logger.info(f"Executing graph with {len(graph.nodes)} nodes and {len(graph.edges)} edges")
         
@@ -309,7 +535,9 @@ async def run_graph(graph: GraphDefinition):
                 detail="No API keys configured. Please configure OpenAI and/or fal.ai API keys first."
             )
         
-        result = await graph_processor.execute_graph(graph)
+        result = await graph_processor.execute_graph(
+            graph, incremental, previous_run_id, targets, user_key(current_user), PRIORITY_INTERACTIVE
+        )
         
         logger.info(f"Graph execution completed - Success: {result.success}")
         return result
@@ -320,7 +548,14 @@ async def run_graph(graph: GraphDefinition):
 
 
 @app.post("/run-graph-stream")
-async def run_graph_stream(graph: GraphDefinition):
+async def run_graph_stream(
+    graph: GraphDefinition,
+    request: Request,
+    incremental: bool = False,
+    previous_run_id: Optional[str] = None,
+    targets: Optional[List[str]] = Query(None),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
     """Execute a workflow graph with streaming results."""
     try:
         logger.info(f"Starting streaming execution of graph with {len(graph.nodes)} nodes and {len(graph.edges)} edges")
@@ -335,7 +570,11 @@ async def run_graph_stream(graph: GraphDefinition):
         async def event_stream():
             """Generate Server-Sent Events for graph execution."""
             try:
-                async for event in graph_processor.execute_graph_streaming(graph):
+                events = graph_processor.execute_graph_streaming(
+                    graph, incremental, previous_run_id, targets=targets,
+                    user_id=user_key(current_user), priority=PRIORITY_INTERACTIVE
+                )
+                async for event in until_disconnected(request, events):
                     # Format as Server-Sent Events
                     event_data = json.dumps(event)
                     yield f"data: {event_data}\n\n"
@@ -363,6 +602,141 @@ async def run_graph_stream(graph: GraphDefinition):
         raise HTTPException(status_code=500, detail=f"Failed to start streaming execution: {str(e)}")
 
 
+@app.post("/run-batch")
+async def run_batch(
+    batch: BatchRunRequest,
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """Execute one workflow over many rows of node overrides.
+    
+    Rows run at batch priority, so interactive runs keep their latency while a batch
+    is going; the batch gets whatever provider capacity they leave.
+    
+    Streams newline-delimited JSON: a ``batch_start`` record, one ``row`` record per
+    row as it finishes, then ``batch_complete``.
+    """
+    try:
+        logger.info(f"Starting batch of {len(batch.rows)} rows over a graph with {len(batch.graph.nodes)} nodes")
+        
+        # Check if required services are configured
+        if not service_manager.is_openai_configured() and not service_manager.is_fal_configured():
+            raise HTTPException(
+                status_code=400, 
+                detail="No API keys configured. Please configure OpenAI and/or fal.ai API keys first."
+            )
+        
+        async def record_stream():
+            """Generate one JSON line per batch record."""
+            try:
+                records = graph_processor.execute_batch(
+                    batch.graph, batch.rows, batch.max_concurrency, user_key(current_user), PRIORITY_BATCH
+                )
+                async for record in until_disconnected(request, records):
+                    yield json.dumps(record) + "\n"
+            except Exception as e:
+                logger.error(f"Batch execution failed: {str(e)}")
+                yield json.dumps({"type": "error", "errors": [f"Batch execution failed: {str(e)}"]}) + "\n"
+        
+        return StreamingResponse(record_stream(), media_type="application/x-ndjson")
+        
+    except Exception as e:
+        logger.error(f"Failed to start batch execution: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to start batch execution: {str(e)}")
+
+
+@app.post("/runs", response_model=RunSubmitResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_run(run: RunSubmitRequest, current_user: Optional[User] = Depends(get_optional_user)):
+    """Queue a workflow graph for background execution and return its run id at once.
+    
+    Poll ``/runs/{run_id}`` for progress (and queue position) and fetch
+    ``/runs/{run_id}/result`` when done. Runs are picked up by priority and then
+    shared fairly between users; anonymous runs share one user's share.
+    """
+    try:
+        # Check if required services are configured
+        if not service_manager.is_openai_configured() and not service_manager.is_fal_configured():
+            raise HTTPException(
+                status_code=400, 
+                detail="No API keys configured. Please configure OpenAI and/or fal.ai API keys first."
+            )
+        
+        # The store is synchronous SQLite; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        run_id = await loop.run_in_executor(None, run_store.create_run, run, user_key(current_user))
+        await run_workers.submit(run_id)
+        logger.info(f"Queued run {run_id} with {len(run.graph.nodes)} nodes")
+        return RunSubmitResponse(run_id=run_id, status="queued")
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to queue run: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue run: {str(e)}")
+
+
+@app.get("/runs/{run_id}", response_model=RunStatusResponse)
+async def get_run_status(run_id: str, current_user: Optional[User] = Depends(get_optional_user)):
+    """Get the status of a queued run and of each node it has started."""
+    loop = asyncio.get_running_loop()
+    check_run_owner(await loop.run_in_executor(None, run_store.get_owner, run_id), current_user)
+    run_status = await loop.run_in_executor(None, run_store.get_status, run_id)
+    if run_status is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run_status
+
+
+@app.post("/runs/{run_id}/resume", response_model=RunSubmitResponse, status_code=status.HTTP_202_ACCEPTED)
+async def resume_run(run_id: str, current_user: Optional[User] = Depends(get_optional_user)):
+    """Queue a failed run again; nodes that already succeeded are not executed again."""
+    loop = asyncio.get_running_loop()
+    check_run_owner(await loop.run_in_executor(None, run_store.get_owner, run_id), current_user)
+    previous_status = await loop.run_in_executor(None, run_store.resume_run, run_id)
+    if previous_status is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if previous_status != "failed":
+        raise HTTPException(status_code=409, detail=f"Only failed runs can be resumed; run is {previous_status}")
+    await run_workers.submit(run_id)
+    logger.info(f"Resuming run {run_id}")
+    return RunSubmitResponse(run_id=run_id, status="queued")
+
+
+@app.get("/runs/{run_id}/trace")
+async def get_run_trace(
+    run_id: str,
+    format: str = Query("chrome", pattern="^(chrome|otlp)$"),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """Get a run's execution trace, as Chrome trace events (chrome://tracing, Perfetto) or OTLP JSON."""
+    # The trace records who the run was for, whether or not it was queued
+    loop = asyncio.get_running_loop()
+    owner = await loop.run_in_executor(None, tracer.get_owner, run_id)
+    if owner is None:
+        raise HTTPException(status_code=404, detail="No trace recorded for this run")
+    check_run_owner(owner, current_user)
+    spans = tracer.get_spans(run_id)
+    if spans:
+        return to_chrome_trace(spans) if format == "chrome" else to_otlp(spans)
+    exported = await loop.run_in_executor(None, tracer.load_export, run_id, format)
+    if exported is None:
+        raise HTTPException(status_code=404, detail="No trace recorded for this run")
+    return exported
+
+
+@app.get("/runs/{run_id}/result", response_model=ExecutionResult)
+async def get_run_result(run_id: str, current_user: Optional[User] = Depends(get_optional_user)):
+    """Get the result of a finished run; 409 while it is still queued or running."""
+    loop = asyncio.get_running_loop()
+    check_run_owner(await loop.run_in_executor(None, run_store.get_owner, run_id), current_user)
+    found = await loop.run_in_executor(None, run_store.get_result, run_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    run_status, result = found
+    if result is None:
+        raise HTTPException(status_code=409, detail=f"Run is still {run_status}")
+    return result
+
+
 @app.post("/upload-file", response_model=FileUploadResponse)
 async def upload_file(file: UploadFile = File(...)):
     """Upload a file (image or video) for use in workflows."""
@@ -382,14 +756,15 @@ async def upload_file(file: UploadFile = File(...)):
         # Determine file type category
         file_type = "image" if file.content_type.startswith("image/") else "video"
         
-        # Generate unique filename
-        file_extension = file.filename.split(".")[-1] if "." in file.filename else ""
-        unique_filename = f"{file_type}_{hash(file.filename)}_{file.filename}"
+        # Name the file after its content: the URL is what result caching and
+        # incremental runs key on, so a changed file must never keep an old URL
+        content = await file.read()
+        digest = hashlib.sha256(content).hexdigest()[:32]
+        unique_filename = f"{file_type}_{digest}_{file.filename}"
         file_path = UPLOADS_DIR / unique_filename
         
         # Save file
         with open(file_path, "wb") as buffer:
-            content = await file.read()
             buffer.write(content)
         
         # Create file URL
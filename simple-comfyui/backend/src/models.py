@@ -29,6 +29,7 @@ class NodeData(BaseModel):
     file_type: Optional[str] = None  # 'image' or 'video'
     result: Optional[Any] = None
     error: Optional[str] = None
+    fingerprint: Optional[str] = None  # hash of the inputs that produced result
 
 
 class Node(BaseModel):
@@ -52,6 +53,10 @@ class GraphDefinition(BaseModel):
     """Complete graph definition with nodes and edges."""
     nodes: List[Node]
     edges: List[Edge]
+    # Optional client-chosen id of the graph's structure (e.g. a saved workflow's id and
+    # revision). Graphs sent with the same key must have the same nodes, node types,
+    # edges and nodes with text or a file; their plan is then found without reading them.
+    structure_key: Optional[str] = None
 
 
 class ValidationError(BaseModel):
@@ -73,6 +78,24 @@ class ExecutionResult(BaseModel):
     success: bool
     nodes: List[Node]
     errors: List[str] = Field(default_factory=list)
+    skipped_nodes: List[str] = Field(default_factory=list)  # downstream of a failed node
+    run_id: Optional[str] = None
+
+
+class NodeOverride(BaseModel):
+    """Replacement input data for one node in one row of a batch run."""
+    text: Optional[str] = None
+    file_url: Optional[str] = None
+    
+    class Config:
+        extra = "forbid"
+
+
+class BatchRunRequest(BaseModel):
+    """One graph executed once per row, each row overriding the data of some nodes."""
+    graph: GraphDefinition
+    rows: List[Dict[str, NodeOverride]]  # node id -> override, one mapping per row
+    max_concurrency: int = Field(default=4, ge=1, le=64)  # rows executing at once
 
 
 class FileUploadResponse(BaseModel):
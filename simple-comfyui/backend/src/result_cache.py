@@ -0,0 +1,169 @@
+"""Content-addressed cache for node operation results."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(
+    node_type: str,
+    operation: str,
+    text_inputs: List[str],
+    image_input: Optional[str],
+    params: Dict[str, Any]
+) -> str:
+    """Hash everything that determines a node's provider output."""
+    payload = json.dumps(
+        {
+            "node_type": node_type,
+            "operation": operation,
+            "text_inputs": text_inputs,
+            "image_input": image_input,
+            "params": params,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier result cache: an in-memory LRU in front of an optional SQLite file.
+    
+    Every entry carries an expiry, since generated fal.ai URLs stop working after a
+    while and must not be served forever. ``aget`` and ``aset`` are for the event
+    loop: they touch the LRU inline and leave the SQLite tier to a thread.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 6 * 3600, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Separate, so a slow query never holds up lookups in memory
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        
+        self.hits = 0
+        self.misses = 0
+        
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS node_results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached result for ``key``, or None on a miss."""
+        value = self._from_memory(key)
+        if value is None:
+            value = self._from_db(key)
+        self._count(value)
+        return value
+    
+    async def aget(self, key: str) -> Optional[Any]:
+        """Like :meth:`get`, reading the SQLite tier in a thread."""
+        value = self._from_memory(key)
+        if value is None and self._db is not None:
+            value = await asyncio.get_running_loop().run_in_executor(None, self._from_db, key)
+        self._count(value)
+        return value
+    
+    def set(self, key: str, value: Any):
+        """Store a result in both tiers."""
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+        self._to_db(key, value, expires_at)
+    
+    async def aset(self, key: str, value: Any):
+        """Like :meth:`set`, writing the SQLite tier in a thread."""
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+        if self._db is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._to_db, key, value, expires_at)
+    
+    def _from_memory(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                return value
+            del self._memory[key]
+            return None
+    
+    def _from_db(self, key: str) -> Optional[Any]:
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM node_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        value = json.loads(row[0])
+        with self._lock:
+            self._remember(key, value, row[1])
+        return value
+    
+    def _to_db(self, key: str, value: Any, expires_at: float):
+        if self._db is None:
+            return
+        with self._db_lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO node_results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                # Opportunistically drop expired rows so the file does not grow forever
+                self._db.execute("DELETE FROM node_results WHERE expires_at <= ?", (time.time(),))
+                self._db.commit()
+            except (sqlite3.Error, TypeError) as e:
+                logger.warning(f"Failed to persist cached result: {str(e)}")
+    
+    def _count(self, value: Optional[Any]):
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+    
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+    
+    def clear(self):
+        """Drop every cached result."""
+        with self._lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM node_results")
+                self._db.commit()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "persistent": self._db is not None,
+        }
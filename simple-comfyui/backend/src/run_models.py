@@ -0,0 +1,109 @@
+"""Models for queued graph runs and the state of their nodes."""
+
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from pydantic import BaseModel, Field
+from typing import Any, Optional, List, Literal
+from datetime import datetime
+
+from .database import Base
+from .models import GraphDefinition
+from .services.run_context import PRIORITY_INTERACTIVE
+
+# Run statuses
+RUN_QUEUED = "queued"
+RUN_RUNNING = "running"
+RUN_SUCCEEDED = "succeeded"
+RUN_FAILED = "failed"
+FINISHED_RUN_STATUSES = (RUN_SUCCEEDED, RUN_FAILED)
+
+# Node statuses
+NODE_PENDING = "pending"
+NODE_RUNNING = "running"
+NODE_SUCCEEDED = "succeeded"
+NODE_FAILED = "failed"
+NODE_SKIPPED = "skipped"
+
+class GraphRun(Base):
+    """A graph submitted for background execution."""
+    __tablename__ = "graph_runs"
+    
+    id = Column(String, primary_key=True)  # also the run id used by the graph processor
+    status = Column(String, nullable=False, default=RUN_QUEUED)
+    graph_data = Column(Text, nullable=False)  # JSON of the submitted graph
+    options = Column(Text, nullable=False, default="{}")  # JSON of execution options
+    user_id = Column(String)  # submitting user, for fair sharing; None if anonymous
+    priority = Column(String, nullable=False, default=PRIORITY_INTERACTIVE)
+    result_data = Column(Text)  # JSON of the graph with results, once finished
+    errors = Column(Text, nullable=False, default="[]")  # JSON list of error messages
+    total_nodes = Column(Integer, nullable=False, default=0)
+    completed_nodes = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    worker_id = Column(String)  # worker executing the run
+    heartbeat_at = Column(DateTime(timezone=True))  # last sign of life from that worker
+    
+    # Relationship to node states
+    nodes = relationship("GraphRunNode", back_populates="run", cascade="all, delete-orphan")
+    
+    # Workers look for the oldest queued run of each priority and user
+    __table_args__ = (Index("ix_graph_runs_status_created", "status", "created_at"),)
+
+class GraphRunNode(Base):
+    """Execution state of one node within a queued run."""
+    __tablename__ = "graph_run_nodes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, ForeignKey("graph_runs.id"), nullable=False, index=True)
+    node_id = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=NODE_PENDING)
+    result = Column(Text)  # JSON of the node's result
+    artifact_url = Column(String)  # durable local copy of a provider-hosted result
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    provider_job = Column(Text)  # JSON of the provider job the node is waiting on, to resume it
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    
+    # Relationship to run
+    run = relationship("GraphRun", back_populates="nodes")
+
+# Pydantic models for API
+
+class RunSubmitRequest(BaseModel):
+    """A graph to execute in the background, with the same options as /run-graph."""
+    graph: GraphDefinition
+    incremental: bool = False
+    previous_run_id: Optional[str] = None
+    targets: Optional[List[str]] = None
+    # Batch runs only get workers and provider capacity interactive runs leave over
+    priority: Literal["interactive", "batch"] = PRIORITY_INTERACTIVE
+
+class RunSubmitResponse(BaseModel):
+    run_id: str
+    status: str
+
+class RunNodeStatus(BaseModel):
+    node_id: str
+    status: str
+    result: Optional[Any] = None
+    artifact_url: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class RunStatusResponse(BaseModel):
+    run_id: str
+    status: str
+    total_nodes: int
+    completed_nodes: int
+    priority: str = PRIORITY_INTERACTIVE
+    queue_position: Optional[int] = None  # 1 when next to be picked up; only while queued
+    errors: List[str] = Field(default_factory=list)
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    nodes: List[RunNodeStatus] = Field(default_factory=list)
@@ -0,0 +1,798 @@
+"""Background execution of submitted graphs, with run and node state kept in the database."""
+
+import asyncio
+import functools
+import heapq
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, sessionmaker
+
+from .artifacts import ArtifactStore
+from .database import SessionLocal
+from .graph_processor import GraphProcessor
+from .models import ExecutionResult, GraphDefinition
+from .run_models import (
+    GraphRun, GraphRunNode, RunSubmitRequest, RunStatusResponse, RunNodeStatus,
+    RUN_QUEUED, RUN_RUNNING, RUN_SUCCEEDED, RUN_FAILED, FINISHED_RUN_STATUSES,
+    NODE_PENDING, NODE_RUNNING, NODE_SUCCEEDED, NODE_FAILED, NODE_SKIPPED
+)
+from .services.concurrency import ANONYMOUS_USER
+from .services.run_context import PRIORITIES
+from .services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Node events from the graph processor and the node status each one leaves behind
+NODE_EVENT_STATUSES = {
+    "node_start": NODE_RUNNING,
+    "node_complete": NODE_SUCCEEDED,
+    "node_error": NODE_FAILED,
+    "node_skipped": NODE_SKIPPED,
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _priority_rank(priority: str) -> int:
+    return PRIORITIES.index(priority) if priority in PRIORITIES else len(PRIORITIES)
+
+
+class RunStore:
+    """Database access for queued runs and the state of their nodes.
+    
+    Every method opens its own short session, so the store can be used from worker
+    threads as well as request handlers.
+    
+    Queued runs are handed out by priority first (interactive before batch). Within
+    a priority the next run goes to the user with the fewest runs executing relative
+    to their weight in ``user_weights`` (default 1), and each user's runs are taken
+    oldest first, so one user's pile of runs cannot hold up everyone else's.
+    
+    Provider-hosted results are taken to stay reachable for ``provider_url_lifetime``
+    seconds after their node finished; resumed runs feed them to downstream nodes
+    until then, and the durable copy after that.
+    """
+    
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        user_weights: Optional[Dict[str, float]] = None,
+        provider_url_lifetime: float = 3600.0
+    ):
+        self.session_factory = session_factory
+        self.user_weights = {str(user): float(weight) for user, weight in (user_weights or {}).items()}
+        self.provider_url_lifetime = provider_url_lifetime
+    
+    @contextmanager
+    def _session(self) -> Iterator[Session]:
+        db = self.session_factory()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def create_run(self, request: RunSubmitRequest, user_id: Optional[str] = None) -> str:
+        """Queue a graph for ``user_id`` (None for anonymous) and return its run id."""
+        run_id = uuid.uuid4().hex
+        options = {
+            "incremental": request.incremental,
+            "previous_run_id": request.previous_run_id,
+            "targets": request.targets,
+        }
+        with self._session() as db:
+            db.add(GraphRun(
+                id=run_id,
+                status=RUN_QUEUED,
+                graph_data=request.graph.model_dump_json(),
+                options=json.dumps(options),
+                user_id=user_id,
+                priority=request.priority,
+                total_nodes=len(request.graph.nodes),
+                # Set here rather than by the database, which may only keep whole seconds
+                created_at=_now()
+            ))
+        return run_id
+    
+    def claim(self, run_id: str, worker_id: str) -> bool:
+        """Mark a queued run as running on ``worker_id``; False if it is not queued.
+        
+        The status check in the update makes the claim atomic, so two workers, even
+        in different processes, can never pick up the same run.
+        """
+        with self._session() as db:
+            now = _now()
+            claimed = (
+                db.query(GraphRun)
+                .filter(GraphRun.id == run_id, GraphRun.status == RUN_QUEUED)
+                .update(
+                    {"status": RUN_RUNNING, "started_at": now, "worker_id": worker_id, "heartbeat_at": now},
+                    synchronize_session=False
+                )
+            )
+            return claimed == 1
+    
+    def claim_next(self, worker_id: str) -> Optional[str]:
+        """Claim the run that is due next and return its id, or None if there is none."""
+        while True:
+            with self._session() as db:
+                run_id = self._next_run(db)
+            if run_id is None:
+                return None
+            if self.claim(run_id, worker_id):
+                return run_id
+            # Someone else got there first
+    
+    def _share(self, user_id: Optional[str], running: int) -> float:
+        """How much of its fair share a user with ``running`` runs executing is using."""
+        return running / self.user_weights.get(user_id or ANONYMOUS_USER, 1.0)
+    
+    @staticmethod
+    def _running_per_user(db: Session) -> Dict[Optional[str], int]:
+        return dict(
+            db.query(GraphRun.user_id, func.count(GraphRun.id))
+            .filter(GraphRun.status == RUN_RUNNING)
+            .group_by(GraphRun.user_id)
+            .all()
+        )
+    
+    def _next_run(self, db: Session) -> Optional[str]:
+        heads = (
+            db.query(GraphRun.priority, GraphRun.user_id, func.min(GraphRun.created_at))
+            .filter(GraphRun.status == RUN_QUEUED)
+            .group_by(GraphRun.priority, GraphRun.user_id)
+            .all()
+        )
+        if not heads:
+            return None
+        running = self._running_per_user(db)
+        priority, user_id, created_at = min(
+            heads,
+            key=lambda head: (
+                _priority_rank(head[0]), self._share(head[1], running.get(head[1], 0)), head[2]
+            )
+        )
+        run = (
+            db.query(GraphRun.id)
+            .filter(
+                GraphRun.status == RUN_QUEUED,
+                GraphRun.priority == priority,
+                GraphRun.user_id.is_(None) if user_id is None else GraphRun.user_id == user_id
+            )
+            .order_by(GraphRun.created_at, GraphRun.id)
+            .first()
+        )
+        return run.id if run else None
+    
+    def _queue_position(self, db: Session, run: GraphRun) -> int:
+        """Where a queued run stands: 1 if it is due next, assuming nothing else changes.
+        
+        Replays the order claim_next would hand out runs in; every claim counts as one
+        more run executing for its user, and nothing finishes in the meantime.
+        """
+        rank = _priority_rank(run.priority)
+        ahead = 0
+        for priority in PRIORITIES[:rank]:
+            ahead += (
+                db.query(func.count(GraphRun.id))
+                .filter(GraphRun.status == RUN_QUEUED, GraphRun.priority == priority)
+                .scalar()
+            )
+        
+        queued: Dict[Optional[str], List[Tuple[datetime, str]]] = {}
+        for run_id, user_id, created_at in (
+            db.query(GraphRun.id, GraphRun.user_id, GraphRun.created_at)
+            .filter(GraphRun.status == RUN_QUEUED, GraphRun.priority == run.priority)
+            .order_by(GraphRun.created_at.desc(), GraphRun.id.desc())
+        ):
+            # Newest first, so each user's next run pops off the end
+            queued.setdefault(user_id, []).append((created_at, run_id))
+        running = self._running_per_user(db)
+        # Heads are unique, so the user ids (which may be None) are never compared
+        line = [(self._share(user_id, running.get(user_id, 0)), runs[-1], user_id) for user_id, runs in queued.items()]
+        heapq.heapify(line)
+        while line:
+            _, (_, run_id), user_id = heapq.heappop(line)
+            ahead += 1
+            if run_id == run.id:
+                break
+            queued[user_id].pop()
+            running[user_id] = running.get(user_id, 0) + 1
+            if queued[user_id]:
+                heapq.heappush(line, (self._share(user_id, running[user_id]), queued[user_id][-1], user_id))
+        return ahead
+    
+    def load_run(self, run_id: str) -> Tuple[GraphDefinition, Dict[str, Any]]:
+        """The graph and execution options of a run, including who it is for."""
+        with self._session() as db:
+            run = db.get(GraphRun, run_id)
+            options = json.loads(run.options)
+            options.update(user_id=run.user_id, priority=run.priority)
+            return GraphDefinition.model_validate_json(run.graph_data), options
+    
+    def heartbeat(self, worker_id: str, run_ids: Iterable[str]):
+        """Renew the lease ``worker_id`` holds on the runs it is executing."""
+        run_ids = list(run_ids)
+        if not run_ids:
+            return
+        with self._session() as db:
+            (
+                db.query(GraphRun)
+                .filter(GraphRun.id.in_(run_ids), GraphRun.worker_id == worker_id)
+                .update({"heartbeat_at": _now()}, synchronize_session=False)
+            )
+    
+    @staticmethod
+    def _requeue(run: GraphRun):
+        """Queue a run again, keeping the results of the nodes that already succeeded.
+        
+        Unfinished nodes waiting on a provider job keep it, so the job is picked up
+        again rather than paid for twice.
+        """
+        run.status = RUN_QUEUED
+        run.started_at = None
+        run.finished_at = None
+        run.completed_nodes = 0
+        run.errors = "[]"
+        run.result_data = None
+        run.worker_id = None
+        run.heartbeat_at = None
+        run.nodes = [node for node in run.nodes if node.status == NODE_SUCCEEDED or node.provider_job is not None]
+        for node in run.nodes:
+            if node.status != NODE_SUCCEEDED:
+                node.status = NODE_PENDING
+                node.started_at = None
+    
+    def requeue_interrupted(self, lease_timeout: float = 0.0) -> List[str]:
+        """Put runs whose worker stopped sending heartbeats back in the queue to resume.
+        
+        Returns the ids of the runs queued again. With no ``lease_timeout`` every
+        running run counts as interrupted, which is only right for a lone process.
+        """
+        stale_before = _now() - timedelta(seconds=lease_timeout)
+        with self._session() as db:
+            interrupted = (
+                db.query(GraphRun)
+                .filter(
+                    GraphRun.status == RUN_RUNNING,
+                    or_(GraphRun.heartbeat_at.is_(None), GraphRun.heartbeat_at <= stale_before)
+                )
+                .all()
+            )
+            for run in interrupted:
+                self._requeue(run)
+            return [run.id for run in interrupted]
+    
+    def release(self, worker_id: str) -> List[str]:
+        """Queue the runs ``worker_id`` is executing again, for a worker shutting down."""
+        with self._session() as db:
+            held = (
+                db.query(GraphRun)
+                .filter(GraphRun.status == RUN_RUNNING, GraphRun.worker_id == worker_id)
+                .all()
+            )
+            for run in held:
+                self._requeue(run)
+            return [run.id for run in held]
+    
+    def resume_run(self, run_id: str) -> Optional[str]:
+        """Queue a failed run again to continue from its unfinished nodes.
+        
+        Returns the status the run had, or None if unknown. Only failed runs are
+        queued again; the caller decides what to tell the client about the others.
+        """
+        with self._session() as db:
+            run = db.get(GraphRun, run_id)
+            if run is None:
+                return None
+            status = run.status
+            if status == RUN_FAILED:
+                self._requeue(run)
+            return status
+    
+    def load_checkpoint(self, run_id: str) -> Dict[str, Any]:
+        """Results of the nodes that already succeeded, to execute the rest from.
+        
+        These are the results as the provider returned them while its URLs are still
+        valid: a durable copy is only served by this app, at an address providers
+        cannot fetch from. Once the URL has expired, the durable copy is used instead.
+        """
+        expired_before = _now() - timedelta(seconds=self.provider_url_lifetime)
+        with self._session() as db:
+            nodes = (
+                db.query(GraphRunNode, (GraphRunNode.finished_at > expired_before).label("fresh"))
+                .filter(GraphRunNode.run_id == run_id, GraphRunNode.status == NODE_SUCCEEDED)
+                .all()
+            )
+            checkpoint = {}
+            for node, fresh in nodes:
+                if node.result is not None and (fresh or not node.artifact_url):
+                    checkpoint[node.node_id] = json.loads(node.result)
+                elif node.artifact_url:
+                    checkpoint[node.node_id] = node.artifact_url
+            return checkpoint
+    
+    def load_provider_jobs(self, run_id: str) -> Dict[str, Dict[str, str]]:
+        """Provider jobs that unfinished nodes were waiting on when the run was interrupted."""
+        with self._session() as db:
+            nodes = (
+                db.query(GraphRunNode)
+                .filter(
+                    GraphRunNode.run_id == run_id,
+                    GraphRunNode.status != NODE_SUCCEEDED,
+                    GraphRunNode.provider_job.isnot(None)
+                )
+                .all()
+            )
+            return {node.node_id: json.loads(node.provider_job) for node in nodes}
+    
+    @staticmethod
+    def _owned_run(db: Session, run_id: str, worker_id: Optional[str]) -> Optional[GraphRun]:
+        """The run, unless ``worker_id`` is given and no longer holds it (its lease expired)."""
+        run = db.get(GraphRun, run_id)
+        if run is None or (worker_id is not None and (run.status != RUN_RUNNING or run.worker_id != worker_id)):
+            return None
+        return run
+    
+    def record_event(self, run_id: str, event: Dict[str, Any], worker_id: Optional[str] = None):
+        """Apply one event from the graph processor to the stored run state."""
+        self.record_events(run_id, [event], worker_id)
+    
+    def record_events(self, run_id: str, events: List[Dict[str, Any]], worker_id: Optional[str] = None):
+        """Apply events from the graph processor to the stored run state, in one transaction."""
+        with self._session() as db:
+            run = self._owned_run(db, run_id, worker_id)
+            if run is None:
+                return
+            # Rows touched earlier in the batch; they are not flushed, so a query would miss new ones
+            nodes: Dict[str, GraphRunNode] = {}
+            for event in events:
+                self._apply_event(db, run, nodes, event)
+    
+    @staticmethod
+    def _apply_event(db: Session, run: GraphRun, nodes: Dict[str, GraphRunNode], event: Dict[str, Any]):
+        event_type = event["type"]
+        if event_type == "start":
+            run.total_nodes = event["total_nodes"]
+            return
+        
+        node_status = NODE_EVENT_STATUSES.get(event_type)
+        if node_status is None and event_type not in ("node_retry", "node_job"):
+            return
+        node_id = event["node_id"]
+        node = nodes.get(node_id)
+        if node is None:
+            node = (
+                db.query(GraphRunNode)
+                .filter(GraphRunNode.run_id == run.id, GraphRunNode.node_id == node_id)
+                .first()
+            )
+            if node is None:
+                node = GraphRunNode(run_id=run.id, node_id=node_id, attempts=0)
+                db.add(node)
+            nodes[node_id] = node
+        
+        if event_type == "node_retry":
+            node.attempts = event["attempt"] + 1
+            return
+        if event_type == "node_job":
+            node.provider_job = json.dumps(
+                {"provider": event["provider"], "endpoint": event["endpoint"], "request_id": event["request_id"]}
+            )
+            return
+        node.status = node_status
+        if event_type == "node_start":
+            node.started_at = _now()
+            node.attempts = 1
+            return
+        
+        node.finished_at = _now()
+        node.provider_job = None
+        run.completed_nodes += 1
+        if event_type == "node_complete":
+            node.result = json.dumps(event["result"])
+            node.attempts = event.get("attempts", node.attempts)
+        elif event_type == "node_error":
+            node.error = event["error"]
+            node.attempts = event.get("attempts", node.attempts)
+    
+    def record_artifact(self, run_id: str, node_id: str, artifact_url: str):
+        """Attach the durable copy of a node's result to its checkpoint."""
+        with self._session() as db:
+            (
+                db.query(GraphRunNode)
+                .filter(GraphRunNode.run_id == run_id, GraphRunNode.node_id == node_id)
+                .update({"artifact_url": artifact_url}, synchronize_session=False)
+            )
+    
+    def finish_run(
+        self,
+        run_id: str,
+        success: bool,
+        errors: List[str],
+        graph: Optional[GraphDefinition] = None,
+        worker_id: Optional[str] = None
+    ):
+        """Record the outcome of a run, with the graph carrying its results."""
+        with self._session() as db:
+            run = self._owned_run(db, run_id, worker_id)
+            if run is None:
+                return
+            run.status = RUN_SUCCEEDED if success else RUN_FAILED
+            run.errors = json.dumps(errors)
+            run.finished_at = _now()
+            if graph is not None:
+                run.result_data = graph.model_dump_json()
+    
+    def get_owner(self, run_id: str) -> Optional[str]:
+        """Who the run is for ("" if it was submitted anonymously), or None if unknown."""
+        with self._session() as db:
+            run = db.get(GraphRun, run_id)
+            if run is None:
+                return None
+            return run.user_id or ""
+    
+    def get_status(self, run_id: str) -> Optional[RunStatusResponse]:
+        """Current state of a run and of every node that has started, or None if unknown."""
+        with self._session() as db:
+            run = db.get(GraphRun, run_id)
+            if run is None:
+                return None
+            return RunStatusResponse(
+                run_id=run.id,
+                status=run.status,
+                total_nodes=run.total_nodes,
+                completed_nodes=run.completed_nodes,
+                priority=run.priority,
+                queue_position=self._queue_position(db, run) if run.status == RUN_QUEUED else None,
+                errors=json.loads(run.errors),
+                created_at=run.created_at,
+                started_at=run.started_at,
+                finished_at=run.finished_at,
+                nodes=[
+                    RunNodeStatus(
+                        node_id=node.node_id,
+                        status=node.status,
+                        result=json.loads(node.result) if node.result is not None else None,
+                        artifact_url=node.artifact_url,
+                        error=node.error,
+                        attempts=node.attempts,
+                        started_at=node.started_at,
+                        finished_at=node.finished_at
+                    )
+                    for node in sorted(run.nodes, key=lambda node: node.id)
+                ]
+            )
+    
+    def get_result(self, run_id: str) -> Optional[Tuple[str, Optional[ExecutionResult]]]:
+        """The run's status and, once it has finished, its result; None if unknown."""
+        with self._session() as db:
+            run = db.get(GraphRun, run_id)
+            if run is None:
+                return None
+            if run.status not in FINISHED_RUN_STATUSES:
+                return run.status, None
+            graph = GraphDefinition.model_validate_json(run.result_data or run.graph_data)
+            # Point at the durable copies; provider URLs stop working after a while
+            artifacts = {node.node_id: node.artifact_url for node in run.nodes if node.artifact_url}
+            for node in graph.nodes:
+                if node.id in artifacts:
+                    node.data.result = artifacts[node.id]
+            return run.status, ExecutionResult(
+                success=run.status == RUN_SUCCEEDED,
+                nodes=graph.nodes,
+                errors=json.loads(run.errors),
+                skipped_nodes=[node.node_id for node in run.nodes if node.status == NODE_SKIPPED],
+                run_id=run.id
+            )
+
+
+class DatabaseRunQueue:
+    """Run queue that is simply the queued rows of the run table.
+    
+    Enough for any number of worker processes sharing one database (e.g. a SQLite
+    file on one host). Workers poll for new runs; ones in the same process as the
+    submitter are woken straight away instead.
+    """
+    
+    def __init__(self, store: RunStore, poll_interval: float = 1.0):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+    
+    async def push(self, run_id: str):
+        """Announce a run that has just been queued in the store."""
+        self._wakeup.set()
+    
+    async def claim(self, worker_id: str, timeout: float) -> Optional[str]:
+        """Claim the next queued run for ``worker_id``, waiting up to ``timeout`` seconds."""
+        self._wakeup.clear()
+        run_id = await _in_thread(self.store.claim_next, worker_id)
+        if run_id is None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(timeout, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+        return run_id
+
+
+class RedisRunQueue:
+    """Run queue kept in a Redis list, for workers spread across hosts.
+    
+    Workers block on the list instead of polling the database. ``client`` is an
+    asyncio Redis client (redis.asyncio, or anything offering the same ``lpush`` and
+    ``brpop`` coroutines, so a local Redis-compatible server works too). Each entry
+    is a token for one queued run: the store still decides which run is due next
+    (by priority and fair share) and who owns it, so a token whose run was taken
+    elsewhere in the meantime simply finds nothing to claim.
+    
+    Tokens can also go missing (the push after storing a run failed, or Redis lost
+    the list), so a worker that finds the list empty checks the store itself every
+    ``sweep_interval`` seconds, and such runs are only delayed.
+    """
+    
+    def __init__(self, store: RunStore, client: Any, key: str = "graph_runs:queue", sweep_interval: float = 30.0):
+        self.store = store
+        self.client = client
+        self.key = key
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+    
+    async def push(self, run_id: str):
+        """Announce a run that has just been queued in the store."""
+        await self.client.lpush(self.key, run_id)
+    
+    async def claim(self, worker_id: str, timeout: float) -> Optional[str]:
+        """Take a token and claim the run due next for ``worker_id``, waiting up to ``timeout`` seconds."""
+        # BRPOP only takes whole seconds, and 0 would mean wait forever
+        item = await self.client.brpop(self.key, timeout=max(1, int(timeout)))
+        if item is None:
+            if time.monotonic() < self._next_sweep:
+                return None
+            self._next_sweep = time.monotonic() + self.sweep_interval
+        return await _in_thread(self.store.claim_next, worker_id)
+
+
+def make_run_queue(backend: str, store: RunStore, redis_url: Optional[str] = None):
+    """Build the run queue named by ``backend`` ("database" or "redis")."""
+    if backend == "database":
+        return DatabaseRunQueue(store)
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("The redis run queue needs the 'redis' package (pip install redis)")
+        return RedisRunQueue(store, redis.from_url(redis_url or "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown run queue backend: {backend}")
+
+
+async def _in_thread(func: Callable[..., Any], *args) -> Any:
+    """Run a blocking store or client call without holding up the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+async def _traced_in_thread(run_id: str, func: Callable[..., Any], *args) -> Any:
+    """``_in_thread`` for a store call made on behalf of a run, recorded in the run's trace."""
+    with tracer.span(func.__name__, "db", run_id):
+        return await _in_thread(func, *args)
+
+
+class RunWorkerPool:
+    """A fixed number of workers executing queued runs in the background.
+    
+    Submitting a run only writes it to the store and the queue, so requests return
+    at once and the rate of submissions is independent of how many runs execute at
+    a time. Pools in any number of processes, on any number of hosts, can share a
+    store and queue; see src/worker.py. Runs do not depend on any client connection;
+    their progress lives in the store.
+    
+    Every node result is checkpointed as it completes, with provider-hosted media
+    copied to ``artifacts`` in the background. A pool renews a lease on the runs it
+    executes; runs whose lease lapses (their process died) are queued again by any
+    pool, and like resumed runs they pick up from their checkpoint rather than
+    paying for finished nodes again. Provider jobs nodes were still waiting on are
+    recorded too, and waited on again instead of being submitted twice.
+    """
+    
+    # Events waiting to be stored per run; bounded, so a stalled database slows
+    # the run down instead of buffering without limit
+    WRITE_QUEUE_SIZE = 1000
+    
+    def __init__(
+        self,
+        graph_processor: GraphProcessor,
+        store: RunStore,
+        workers: int = 4,
+        queue: Optional[Any] = None,
+        artifacts: Optional[ArtifactStore] = None,
+        lease_timeout: float = 60.0
+    ):
+        if workers < 0:
+            raise ValueError("A worker pool cannot have a negative number of workers")
+        self.graph_processor = graph_processor
+        self.store = store
+        self.workers = workers
+        self.queue = queue or DatabaseRunQueue(store)
+        self.artifacts = artifacts
+        self.lease_timeout = lease_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+    
+    async def start(self):
+        """Start the workers, re-queueing runs abandoned by dead workers first."""
+        if self._tasks or not self.workers:
+            return
+        await self._requeue_abandoned()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+    
+    async def stop(self):
+        """Stop the workers, handing the runs they were executing back to the queue."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if not tasks:
+            return
+        try:
+            for run_id in await _in_thread(self.store.release, self.worker_id):
+                logger.info(f"Re-queued run {run_id} on shutdown")
+                await self.queue.push(run_id)
+        except Exception as e:
+            # Their leases lapse soon enough, and then another worker takes over
+            logger.error(f"Failed to re-queue runs on shutdown: {str(e)}")
+    
+    async def submit(self, run_id: str):
+        """Hand a run that has just been stored to the queue."""
+        await self.queue.push(run_id)
+    
+    async def _requeue_abandoned(self):
+        for run_id in await _in_thread(self.store.requeue_interrupted, self.lease_timeout):
+            logger.info(f"Re-queued interrupted run {run_id}")
+            await self.queue.push(run_id)
+    
+    async def _maintain(self):
+        """Renew leases on our runs and rescue runs whose worker has gone."""
+        while True:
+            await asyncio.sleep(self.lease_timeout / 3)
+            try:
+                await _in_thread(self.store.heartbeat, self.worker_id, list(self._running))
+                await self._requeue_abandoned()
+            except Exception as e:
+                logger.error(f"Run lease maintenance failed: {str(e)}")
+    
+    async def _work(self):
+        while True:
+            try:
+                run_id = await self.queue.claim(self.worker_id, self.lease_timeout / 3)
+            except Exception as e:
+                logger.error(f"Failed to claim a queued run: {str(e)}")
+                await asyncio.sleep(1.0)
+                continue
+            if run_id is None:
+                continue
+            try:
+                await self.execute(run_id)
+            except Exception as e:
+                # Left running; the lease lapses and the run is retried elsewhere
+                logger.error(f"Worker failed on queued run {run_id}: {str(e)}")
+    
+    async def execute(self, run_id: str):
+        """Execute one claimed run, recording its progress as it goes."""
+        self._running.add(run_id)
+        try:
+            await self._execute(run_id)
+        finally:
+            self._running.discard(run_id)
+    
+    async def _execute(self, run_id: str):
+        graph, options = await _traced_in_thread(run_id, self.store.load_run, run_id)
+        checkpoint = await _traced_in_thread(run_id, self.store.load_checkpoint, run_id)
+        provider_jobs = await _traced_in_thread(run_id, self.store.load_provider_jobs, run_id)
+        if provider_jobs:
+            logger.info(f"Resuming queued run {run_id} with {len(provider_jobs)} provider jobs to wait on")
+        if checkpoint:
+            logger.info(f"Resuming queued run {run_id} with {len(checkpoint)} nodes already done")
+        else:
+            logger.info(f"Executing queued run {run_id}")
+        success, errors = False, []
+        copies: List[asyncio.Task] = []
+        # Events are stored by a writer task, so reading them (and so starting the
+        # nodes they unblock) never waits for the database
+        writes: asyncio.Queue = asyncio.Queue(self.WRITE_QUEUE_SIZE)
+        writer = asyncio.create_task(self._write_events(run_id, writes, copies))
+        events = self.graph_processor.execute_graph_streaming(
+            graph,
+            options.get("incremental", False),
+            options.get("previous_run_id"),
+            targets=options.get("targets"),
+            run_id=run_id,
+            checkpoint=checkpoint,
+            provider_jobs=provider_jobs,
+            user_id=options.get("user_id"),
+            priority=options.get("priority")
+        )
+        try:
+            async for event in events:
+                if event["type"] in ("complete", "error"):
+                    success = event.get("success", False)
+                    errors = event["errors"]
+                    continue
+                if event["type"] == "node_progress":
+                    # Only of interest while watching; nothing in the stored state changes
+                    continue
+                await writes.put(event)
+        except asyncio.CancelledError:
+            writer.cancel()
+            for copy in copies:
+                copy.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Queued run {run_id} failed: {str(e)}")
+            success, errors = False, [f"Graph execution failed: {str(e)}"]
+        finally:
+            await events.aclose()
+        await writes.put(None)
+        failure = await writer
+        if failure is not None:
+            success, errors = False, [f"Graph execution failed: {str(failure)}"]
+        await asyncio.gather(*copies)
+        await _traced_in_thread(run_id, self.store.finish_run, run_id, success, errors, graph, self.worker_id)
+        logger.info(f"Queued run {run_id} {'succeeded' if success else 'failed'}")
+    
+    async def _write_events(self, run_id: str, writes: asyncio.Queue, copies: List[asyncio.Task]) -> Optional[Exception]:
+        """Store a run's events until ``None`` arrives, returning the first failure, if any.
+        
+        Whatever has queued up meanwhile is written in one transaction. Media results
+        are copied once their node's row is written, since the copy is recorded on it.
+        """
+        failure = None
+        finished = False
+        while not finished:
+            batch = [await writes.get()]
+            while not writes.empty():
+                batch.append(writes.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                finished = True
+            if not batch:
+                continue
+            try:
+                await _traced_in_thread(run_id, self.store.record_events, run_id, batch, self.worker_id)
+            except Exception as e:
+                # Keep draining, so the run is never stuck on a full queue; it fails at the end
+                logger.error(f"Failed to record events of queued run {run_id}: {str(e)}")
+                failure = failure or e
+                continue
+            if self.artifacts is None:
+                continue
+            for event in batch:
+                if (event["type"] == "node_complete" and event["node_type"] != "text"
+                        and self.artifacts.is_remote(event["result"])):
+                    # Copied alongside execution; awaiting it here would hold up downstream nodes
+                    copies.append(asyncio.create_task(self._copy_artifact(run_id, event["node_id"], event["result"])))
+        return failure
+    
+    async def _copy_artifact(self, run_id: str, node_id: str, url: str):
+        """Keep a durable copy of a node's result; the checkpoint keeps the URL if this fails."""
+        try:
+            artifact_url = await self.artifacts.persist(run_id, node_id, url)
+            await _traced_in_thread(run_id, self.store.record_artifact, run_id, node_id, artifact_url)
+        except Exception as e:
+            logger.warning(f"Could not store artifact for node {node_id} of run {run_id}: {str(e)}")
@@ -1,7 +1,8 @@
 """Service layer for external API integrations."""
 
+from .concurrency import ConcurrencyManager
 from .fal_service import FalService
 from .openai_service import OpenAIService
 from .service_manager import ServiceManager
 
-__all__ = ["FalService", "OpenAIService", "ServiceManager"]
\ No newline at end of file
+__all__ = ["ConcurrencyManager", "FalService", "OpenAIService", "ServiceManager"]
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""Per-provider and per-endpoint concurrency limits with fair queuing across users and runs."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .metrics import PROVIDER_SLOT_WAIT_SECONDS
+from .tracing import tracer
+from .run_context import (
+    PRIORITIES, PRIORITY_INTERACTIVE, current_critical_path, current_priority, current_run_id, current_user_id
+)
+
+logger = logging.getLogger(__name__)
+
+# Limits apply to a provider ("openai", "fal") or to one of its endpoints
+# ("fal:<endpoint>"). Keys without an entry are unlimited.
+DEFAULT_CONCURRENCY_LIMITS: Dict[str, int] = {
+    "openai": 16,
+    "fal": 10,
+    "fal:fal-ai/bytedance/seedance/v1/lite/text-to-video": 4,
+    "fal:fal-ai/bytedance/seedance/v1/lite/image-to-video": 4,
+}
+
+# Fair-share bucket for calls made without a signed-in user
+ANONYMOUS_USER = "anonymous"
+
+
+# A waiting call: (-critical path, arrival number, future), so heapq pops the call
+# with the longest path ahead of it first, and the earliest of equals
+_Waiter = Tuple[float, int, asyncio.Future]
+
+
+class _UserQueue:
+    """Calls one user has waiting at one priority, grouped by run."""
+    
+    __slots__ = ("tag", "runs")
+    
+    def __init__(self, tag: float):
+        self.tag = tag  # virtual time at which this user is next due a slot
+        self.runs: "OrderedDict[str, List[_Waiter]]" = OrderedDict()
+
+
+class FairLimiter:
+    """Counting limiter that shares free slots by priority, then user, then run.
+    
+    Interactive calls always get the next free slot before batch calls. Within a
+    priority, users get slots in proportion to their weight (start-time fair
+    queuing: each grant moves the user's tag on by 1/weight and the lowest tag goes
+    next), so one user queueing hundreds of calls only delays others by their share.
+    Within a user, slots go round-robin across their runs (normally graph run ids),
+    so a run with 50 queued calls cannot starve a run with one. Within a run, the
+    call with the longest critical path behind it goes first, since starting it late
+    delays the whole run.
+    """
+    
+    def __init__(self, name: str, limit: int, weights: Optional[Dict[str, float]] = None):
+        if limit < 1:
+            raise ValueError(f"Concurrency limit for '{name}' must be at least 1")
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.weights = weights if weights is not None else {}
+        self._levels: Dict[str, Dict[str, _UserQueue]] = {priority: {} for priority in PRIORITIES}
+        self._vtime: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._queued = 0
+        self._arrivals = itertools.count()
+        
+        # Metrics
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    async def acquire(
+        self,
+        owner: str,
+        user: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        critical_path: float = 0.0
+    ):
+        """Wait for a slot on behalf of run ``owner`` of ``user``."""
+        if self.active < self.limit and not self._queued:
+            self.active += 1
+            self._record_wait(0.0)
+            return
+        
+        if priority not in self._levels:
+            raise ValueError(f"Unknown priority '{priority}'")
+        user = user or ANONYMOUS_USER
+        users = self._levels[priority]
+        if user not in users:
+            # Joining now: no credit for time spent idle, no penalty for past use
+            users[user] = _UserQueue(self._vtime[priority])
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(users[user].runs.setdefault(owner, []), (-critical_path, next(self._arrivals), future))
+        self._queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queued)
+        started = time.monotonic()
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before we were cancelled
+                self.release()
+            else:
+                self._discard(priority, user, owner, future)
+            raise
+        
+        self._record_wait(time.monotonic() - started)
+    
+    def release(self):
+        """Return a slot and wake the next caller in line."""
+        self.active -= 1
+        while self.active < self.limit and self._queued:
+            future = self._next_waiter()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+    
+    def _next_waiter(self) -> asyncio.Future:
+        priority = next(priority for priority in PRIORITIES if self._levels[priority])
+        users = self._levels[priority]
+        user = min(users, key=lambda name: users[name].tag)
+        queue = users[user]
+        self._vtime[priority] = queue.tag
+        queue.tag += 1.0 / self.weights.get(user, 1.0)
+        
+        owner, waiters = queue.runs.popitem(last=False)
+        _, _, future = heapq.heappop(waiters)
+        self._queued -= 1
+        if waiters:
+            # Rotate the run to the back of its user's line
+            queue.runs[owner] = waiters
+        if not queue.runs:
+            del users[user]
+        return future
+    
+    def _discard(self, priority: str, user: str, owner: str, future: asyncio.Future):
+        queue = self._levels[priority].get(user)
+        waiters = queue.runs.get(owner) if queue else None
+        position = next((i for i, waiter in enumerate(waiters or ()) if waiter[2] is future), None)
+        if position is not None:
+            waiters[position] = waiters[-1]
+            waiters.pop()
+            heapq.heapify(waiters)
+            self._queued -= 1
+            if not waiters:
+                del queue.runs[owner]
+            if not queue.runs:
+                del self._levels[priority][user]
+    
+    def _record_wait(self, waited: float):
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Snapshot of current load and historical queueing for this limiter."""
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": self._queued,
+            "max_queue_depth": self.max_queue_depth,
+            "waiting_runs": sum(len(queue.runs) for users in self._levels.values() for queue in users.values()),
+            "waiting_users": {priority: len(users) for priority, users in self._levels.items()},
+            "acquired": self.acquired,
+            "avg_wait_seconds": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+
+class ConcurrencyManager:
+    """Owns the limiters for every configured provider and endpoint.
+    
+    Limits are held in memory, so they only bound the calls of one process. When
+    ``processes`` processes (API and workers) share the provider accounts, each gets
+    an even share of every limit, rounded down but never below 1, so together they
+    stay within it as long as the limit is at least the number of processes.
+    """
+    
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        user_weights: Optional[Dict[str, float]] = None,
+        processes: int = 1
+    ):
+        if processes < 1:
+            raise ValueError("Concurrency limits must be shared by at least one process")
+        merged = dict(DEFAULT_CONCURRENCY_LIMITS)
+        merged.update(limits or {})
+        # Shared by every limiter; users without an entry have weight 1
+        self.user_weights = {str(user): float(weight) for user, weight in (user_weights or {}).items()}
+        self.limiters = {
+            key: FairLimiter(key, max(1, limit // processes), self.user_weights) for key, limit in merged.items()
+        }
+    
+    @asynccontextmanager
+    async def slot(self, provider: str, endpoint: str) -> AsyncIterator[None]:
+        """Hold one endpoint slot and one provider slot for the duration of a call.
+        
+        The endpoint slot is taken first so that waiting on a busy endpoint never
+        ties up capacity the provider's other endpoints could use.
+        """
+        owner = current_run_id.get() or "default"
+        user = current_user_id.get()
+        priority = current_priority.get()
+        critical_path = current_critical_path.get()
+        acquired = []
+        try:
+            started = time.monotonic()
+            with tracer.span("queue_wait", "provider", provider=provider, endpoint=endpoint):
+                for key in (f"{provider}:{endpoint}", provider):
+                    limiter = self.limiters.get(key)
+                    if limiter:
+                        await limiter.acquire(owner, user, priority, critical_path)
+                        acquired.append(limiter)
+            PROVIDER_SLOT_WAIT_SECONDS.observe(time.monotonic() - started, provider=provider)
+            yield
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+    
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Metrics for every limiter, keyed by provider or endpoint."""
+        return {key: limiter.get_metrics() for key, limiter in self.limiters.items()}
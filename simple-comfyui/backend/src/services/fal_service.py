@@ -1,44 +1,228 @@
-"""fal.ai service integration for image and video generation."""
+"""fal.ai service integration for image and video generation.
+
+Jobs go through fal.ai's queue: submitting one returns a request id straight away,
+and its status is then polled from the event loop. No thread is held while a job
+waits or runs, so a process can have hundreds of them in flight. A job is cancelled
+when nobody is left to collect it, and its request id is reported to the node, so a
+run resumed after a restart waits on the job instead of submitting it again.
+"""
 
 import fal_client
+import httpx
 import logging
-from typing import Dict, Any, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
 import asyncio
-import functools
-import requests
+import re
+import time
 import base64
 
+from .retry import RetryPolicy, SubmittedJobError, is_retryable
+from .run_context import emit_node_event, take_provider_job
+from .tracing import tracer
+
 logger = logging.getLogger(__name__)
 
+# Progress bars in model logs, e.g. " 45%|████▌     | 9/20 [00:04<00:05]"
+PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)%")
+
 
-def get_base64(image_url: str) -> str:
+async def get_base64(image_url: str) -> str:
     """Get base64 from image url."""
-    response = requests.get(image_url)
+    async with httpx.AsyncClient(follow_redirects=True) as client:
+        response = await client.get(image_url)
     return base64.b64encode(response.content).decode("utf-8")
 
+
+class FalRequest:
+    """A job in fal.ai's queue that this process is waiting on."""
+    
+    def __init__(self, endpoint: str, handle: fal_client.AsyncRequestHandle):
+        self.endpoint = endpoint
+        self.handle = handle
+        self.submitted_at = time.time()
+        self.status = "submitted"  # then queued, in_progress, completed
+        self.queue_position: Optional[int] = None
+        self.percent: Optional[float] = None
+        self.logs_seen = 0
+    
+    @property
+    def request_id(self) -> str:
+        return self.handle.request_id
+    
+    def update(self, status: fal_client.Status) -> Optional[Dict[str, Any]]:
+        """Take in a status check; returns a progress report if anything changed."""
+        previous = (self.status, self.queue_position)
+        if isinstance(status, fal_client.Queued):
+            self.status = "queued"
+            self.queue_position = status.position
+            if (self.status, self.queue_position) == previous:
+                return None
+            return {
+                "stage": "queued",
+                "queue_position": status.position,
+                "message": f"Waiting in fal.ai's queue at position {status.position + 1}"
+            }
+        
+        self.queue_position = None
+        if isinstance(status, fal_client.Completed):
+            self.status = "completed"
+            return None
+        self.status = "in_progress"
+        # Status checks return every log line so far
+        lines = [entry.get("message", "") for entry in (status.logs or [])[self.logs_seen:]]
+        self.logs_seen += len(lines)
+        for line in reversed(lines):
+            match = PERCENT_PATTERN.search(line)
+            if match and float(match.group(1)) <= 100:
+                self.percent = float(match.group(1))
+                break
+        if previous[0] == "in_progress" and not lines:
+            return None
+        report: Dict[str, Any] = {"stage": "running", "logs": lines, "message": "Generating on fal.ai"}
+        if self.percent is not None:
+            report["percent"] = self.percent
+            report["message"] = f"Generating on fal.ai ({self.percent:.0f}%)"
+        return report
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "submitted_at": self.submitted_at,
+            "status": self.status,
+            "queue_position": self.queue_position,
+            "percent": self.percent
+        }
+
+
 class FalService:
     """Service for interacting with fal.ai APIs."""
     
-    def __init__(self, api_key: str):
+    TEXT_TO_IMAGE_ENDPOINT = "fal-ai/imagen4/preview/fast"
+    TEXT_TO_VIDEO_ENDPOINT = "fal-ai/bytedance/seedance/v1/lite/text-to-video"
+    TEXT_IMAGE_TO_IMAGE_ENDPOINT = "fal-ai/flux-pro/kontext"
+    IMAGE_TO_VIDEO_ENDPOINT = "fal-ai/bytedance/seedance/v1/lite/image-to-video"
+    
+    # Seconds between status checks of a job: short at first for quick images, then
+    # backing off so hundreds of minute-long videos don't poll fal.ai many times a second
+    POLL_INTERVAL = 0.25
+    MAX_POLL_INTERVAL = 2.0
+    
+    # Transient failures checking on or fetching a job are retried on that same job:
+    # retrying the whole call would submit, and pay for, another one
+    POLL_RETRY_POLICY = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=10.0)
+    
+    def __init__(self, api_key: str, client: Optional[fal_client.AsyncClient] = None):
         self.api_key = api_key
-        # Set the API key for fal_client
-        import os
-        os.environ["FAL_KEY"] = api_key
+        self.client = client or fal_client.AsyncClient(key=api_key)
+        # Jobs being waited on, by request id
+        self.requests: Dict[str, FalRequest] = {}
+        self._cancellations: Set[asyncio.Future] = set()
     
-    async def _run_in_executor(self, func, *args, **kwargs):
-        """Run blocking fal_client operations in executor."""
-        loop = asyncio.get_event_loop()
-        partial_func = functools.partial(func, *args, **kwargs)
-        return await loop.run_in_executor(None, partial_func)
+    async def _subscribe(self, endpoint: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Submit a queue request and wait for its result.
+        
+        Unlike fal_client.subscribe this keeps hold of the request handle, so when the
+        caller is cancelled (timeout, deadline, client gone) the queued or running job
+        is cancelled on fal.ai too. The request id is reported to the node as a ``job``
+        event; a node resuming with a job for this endpoint waits on that one instead.
+        """
+        request_id = take_provider_job("fal", endpoint)
+        if request_id is not None:
+            logger.info(f"Resuming fal.ai request {request_id}")
+            return await self.resume(endpoint, request_id)
+        
+        submission = asyncio.ensure_future(self.client.submit(endpoint, arguments))
+        try:
+            with tracer.span("submit", "provider", endpoint=endpoint):
+                handle = await asyncio.shield(submission)
+        except asyncio.CancelledError:
+            # The submission may already have reached fal.ai; cancel the job once it is queued
+            def cancel_when_queued(done):
+                if not done.cancelled() and done.exception() is None:
+                    self._cancel_request(done.result())
+            
+            submission.add_done_callback(cancel_when_queued)
+            raise
+        
+        emit_node_event("job", {"provider": "fal", "endpoint": endpoint, "request_id": handle.request_id})
+        return await self._wait(endpoint, handle)
+    
+    async def _wait(self, endpoint: str, handle: fal_client.AsyncRequestHandle) -> Dict[str, Any]:
+        """Poll a queued job until it completes, then fetch its result.
+        
+        Queue position, log lines and percent done (when the logs show it) are reported
+        to the node as ``progress`` events along the way. Failures are raised as
+        SubmittedJobError, after cancelling the job in case it is still running.
+        """
+        request = self.requests[handle.request_id] = FalRequest(endpoint, handle)
+        try:
+            # Time in fal.ai's queue plus the inference itself
+            with tracer.span("inference", "provider", endpoint=endpoint, request_id=handle.request_id):
+                interval = self.POLL_INTERVAL
+                while True:
+                    status = await self._retry_on_job(handle, lambda: handle.status(with_logs=True))
+                    progress = request.update(status)
+                    if progress is not None:
+                        emit_node_event("progress", progress)
+                    if isinstance(status, fal_client.Completed):
+                        break
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 1.5, self.MAX_POLL_INTERVAL)
+                return await self._retry_on_job(handle, handle.get)
+        except asyncio.CancelledError:
+            self._cancel_request(handle)
+            raise
+        except Exception as e:
+            # Giving up on the job; don't leave it running, and billed, for nobody
+            self._cancel_request(handle)
+            raise SubmittedJobError(f"fal.ai request {handle.request_id} failed: {str(e)}") from e
+        finally:
+            self.requests.pop(handle.request_id, None)
+    
+    async def _retry_on_job(self, handle: fal_client.AsyncRequestHandle, check: Callable[[], Awaitable[Any]]) -> Any:
+        """Await ``check()``, a status check or result fetch, retrying transient failures."""
+        policy = self.POLL_RETRY_POLICY
+        attempt = 1
+        while True:
+            try:
+                return await check()
+            except Exception as e:
+                if attempt >= policy.max_attempts or not is_retryable(e):
+                    raise
+                delay = policy.delay_for(attempt, e)
+                logger.warning(
+                    f"Checking on fal.ai request {handle.request_id} failed, retrying in {delay:.1f}s: {str(e)}"
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+    
+    async def resume(self, endpoint: str, request_id: str) -> Dict[str, Any]:
+        """Wait for the result of a job submitted earlier, e.g. before a restart."""
+        handle = await self.client.get_handle(endpoint, request_id)
+        return await self._wait(endpoint, handle)
+    
+    def _cancel_request(self, handle: fal_client.AsyncRequestHandle):
+        """Cancel a fal.ai queue request in the background, without waiting for it."""
+        async def cancel():
+            try:
+                await handle.cancel()
+                logger.info(f"Cancelled fal.ai request {handle.request_id}")
+            except Exception as e:
+                logger.warning(f"Failed to cancel fal.ai request {handle.request_id}: {str(e)}")
+        
+        # Keep a reference, or the task could be garbage collected before it runs
+        task = asyncio.ensure_future(cancel())
+        self._cancellations.add(task)
+        task.add_done_callback(self._cancellations.discard)
     
     async def text_to_image(self, prompt: str, aspect_ratio: str = "1:1", num_images: int = 1) -> str:
         """Generate image from text using Imagen4 Fast."""
         try:
             logger.info(f"Generating image with prompt: {prompt[:100]}...")
             
-            result = await self._run_in_executor(
-                fal_client.subscribe,
-                "fal-ai/imagen4/preview/fast",
+            result = await self._subscribe(
+                self.TEXT_TO_IMAGE_ENDPOINT,
                 {
                     "prompt": prompt,
                     "aspect_ratio": aspect_ratio,
@@ -55,7 +239,7 @@ class FalService:
                 
         except Exception as e:
             logger.error(f"fal.ai text-to-image failed: {str(e)}")
-            raise Exception(f"Image generation failed: {str(e)}")
+            raise Exception(f"Image generation failed: {str(e)}") from e
     
     async def text_to_video(
         self, 
@@ -68,9 +252,8 @@ class FalService:
         try:
             logger.info(f"Generating video with prompt: {prompt[:100]}...")
             
-            result = await self._run_in_executor(
-                fal_client.subscribe,
-                "fal-ai/bytedance/seedance/v1/lite/text-to-video",
+            result = await self._subscribe(
+                self.TEXT_TO_VIDEO_ENDPOINT,
                 {
                     "prompt": prompt,
                     "aspect_ratio": aspect_ratio,
@@ -88,19 +271,19 @@ class FalService:
                 
         except Exception as e:
             logger.error(f"fal.ai text-to-video failed: {str(e)}")
-            raise Exception(f"Video generation failed: {str(e)}")
+            raise Exception(f"Video generation failed: {str(e)}") from e
     
     async def text_image_to_image(self, prompt: str, image_url: str) -> str:
         """Edit image with text using FLUX Kontext."""
         # import ipdb; ipdb.set_trace()
         if "localhost" in image_url:
-            image_url = get_base64(image_url)
+            with tracer.span("upload", "provider", endpoint=self.TEXT_IMAGE_TO_IMAGE_ENDPOINT):
+                image_url = await get_base64(image_url)
         try:
             logger.info(f"Editing image with prompt: {prompt[:100]}...")
             
-            result = await self._run_in_executor(
-                fal_client.subscribe,
-                "fal-ai/flux-pro/kontext",
+            result = await self._subscribe(
+                self.TEXT_IMAGE_TO_IMAGE_ENDPOINT,
                 {
                     "prompt": prompt,
                     "image_url": image_url
@@ -116,7 +299,7 @@ class FalService:
                 
         except Exception as e:
             logger.error(f"fal.ai text+image-to-image failed: {str(e)}")
-            raise Exception(f"Image editing failed: {str(e)}")
+            raise Exception(f"Image editing failed: {str(e)}") from e
     
     async def image_to_video(
         self, 
@@ -142,9 +325,8 @@ class FalService:
             
             logger.info(f"With prompt: {prompt[:100]}...")
             
-            result = await self._run_in_executor(
-                fal_client.subscribe,
-                "fal-ai/bytedance/seedance/v1/lite/image-to-video",
+            result = await self._subscribe(
+                self.IMAGE_TO_VIDEO_ENDPOINT,
                 request_data
             )
             
@@ -157,21 +339,18 @@ class FalService:
                 
         except Exception as e:
             logger.error(f"fal.ai image-to-video failed: {str(e)}")
-            raise Exception(f"Video generation from image failed: {str(e)}")
+            raise Exception(f"Video generation from image failed: {str(e)}") from e
     
     async def upload_file(self, file_path: str) -> str:
         """Upload file to fal.ai storage."""
         try:
             logger.info(f"Uploading file to fal.ai: {file_path}")
             
-            url = await self._run_in_executor(
-                fal_client.upload_file,
-                file_path
-            )
+            url = await self.client.upload_file(file_path)
             
             logger.info(f"File uploaded successfully: {url}")
             return url
             
         except Exception as e:
             logger.error(f"fal.ai file upload failed: {str(e)}")
-            raise Exception(f"File upload failed: {str(e)}")
\ No newline at end of file
+            raise Exception(f"File upload failed: {str(e)}") from e
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""Process-wide metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are updated where things happen (HTTP requests,
+graph runs, node executions, provider calls) and read by ``GET /metrics``.
+Numbers that components already keep, such as cache hit counts, are not copied
+into metrics as they change; a collector reads them when the registry renders.
+"""
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; HTTP handlers mostly answer quickly, provider calls take seconds to minutes
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROVIDER_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class _Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Reported as zero from the start rather than missing until first used
+            self._values[()] = self._initial()
+    
+    def _initial(self) -> Any:
+        return 0.0
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def _samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape(self.help, quotes=False)}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. requests served."""
+    
+    kind = "counter"
+    
+    def inc(self, amount: float = 1.0, **labels: Any):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def get(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. runs in progress."""
+    
+    kind = "gauge"
+    
+    def set(self, value: float, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1.0, **labels: Any):
+        self.inc(-amount, **labels)
+    
+    def get(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, e.g. request latencies."""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+    
+    def _initial(self) -> Any:
+        # Per-bucket counts (the last one is +Inf), then sum
+        return [[0] * (len(self.buckets) + 1), 0.0]
+    
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._initial()
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+    
+    def get_count(self, **labels: Any) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+    
+    def _samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1])) for key, state in self._values.items()]
+        for key, (counts, total) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """The metrics of a process, and collectors that produce more when rendered."""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+        self._lock = threading.Lock()
+    
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+    
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+    
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+    
+    def add_collector(self, collector: Callable[[], Iterable[_Metric]]):
+        """Call ``collector`` on every render for metrics built from current state."""
+        with self._lock:
+            self._collectors.append(collector)
+    
+    def render(self) -> str:
+        """All metrics in the text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                # One broken collector should not take the whole scrape down
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {str(e)}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """A thread pool that reports how busy it is.
+    
+    Installed as the event loop's default executor, it covers the blocking work
+    the app hands to threads: database access and files.
+    """
+    
+    def __init__(self, max_workers: Optional[int] = None, thread_name_prefix: str = ""):
+        super().__init__(max_workers, thread_name_prefix)
+        self.max_workers = self._max_workers
+        self.queued = 0
+        self.busy = 0
+        self._counts_lock = threading.Lock()
+    
+    def submit(self, fn, *args, **kwargs):
+        submitted = time.perf_counter()
+        
+        def run():
+            with self._counts_lock:
+                self.queued -= 1
+                self.busy += 1
+            EXECUTOR_WAIT_SECONDS.observe(time.perf_counter() - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self.busy -= 1
+        
+        with self._counts_lock:
+            self.queued += 1
+        try:
+            return super().submit(run)
+        except BaseException:
+            with self._counts_lock:
+                self.queued -= 1
+            raise
+    
+    def collect(self) -> List[_Metric]:
+        """Gauges of the pool's size and current load, for ``Registry.add_collector``."""
+        gauges = []
+        for name, help, value in (
+            ("executor_threads_max", "Threads the default executor may start", self.max_workers),
+            ("executor_threads_busy", "Default executor threads running a task", self.busy),
+            ("executor_queue_depth", "Tasks waiting for a default executor thread", self.queued),
+        ):
+            gauge = Gauge(name, help)
+            gauge.set(value)
+            gauges.append(gauge)
+        return gauges
+
+
+def _escape(value: str, quotes: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Shared by the API, the graph processor and the services
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time to answer an HTTP request, by route", ("method", "route", "status")
+)
+GRAPH_RUNS_IN_PROGRESS = registry.gauge("graph_runs_in_progress", "Graph runs executing in this process")
+GRAPH_RUNS = registry.counter("graph_runs_total", "Graph runs finished, by outcome", ("outcome",))
+NODE_EXECUTION_SECONDS = registry.histogram(
+    "node_execution_duration_seconds",
+    "Time to execute a node, by node type, operation and outcome",
+    ("node_type", "operation", "outcome"),
+    PROVIDER_BUCKETS
+)
+PROVIDER_CALL_SECONDS = registry.histogram(
+    "provider_call_duration_seconds",
+    "Time for one provider call attempt, excluding the wait for a slot",
+    ("provider", "endpoint", "outcome"),
+    PROVIDER_BUCKETS
+)
+PROVIDER_CALL_ERRORS = registry.counter(
+    "provider_call_errors_total", "Failed provider call attempts, by kind of failure", ("provider", "endpoint", "error")
+)
+PROVIDER_SLOT_WAIT_SECONDS = registry.histogram(
+    "provider_slot_wait_seconds", "Time a provider call waited for a concurrency slot", ("provider",), WAIT_BUCKETS
+)
+EXECUTOR_WAIT_SECONDS = registry.histogram(
+    "executor_task_wait_seconds", "Time a task waited for a default executor thread", (), WAIT_BUCKETS
+)
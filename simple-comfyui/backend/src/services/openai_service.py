@@ -2,25 +2,114 @@
 
 import openai
 import logging
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import base64
 import httpx
 import asyncio
-import functools
+
+from .run_context import current_event_sink, emit_node_event
 
 logger = logging.getLogger(__name__)
 
 
+def make_http_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 60.0,
+    http2: Optional[bool] = None
+) -> httpx.AsyncClient:
+    """Connection pool for OpenAI requests, shared by every OpenAIService of a process.
+    
+    HTTP/2 (one multiplexed connection instead of one per concurrent request) is
+    used when the ``h2`` package is installed, unless ``http2`` says otherwise.
+    """
+    if http2 is None:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+    elif http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            raise RuntimeError("HTTP/2 for OpenAI needs the 'h2' package (pip install 'httpx[http2]')")
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=OpenAIService.REQUEST_TIMEOUT,
+        follow_redirects=True
+    )
+
+
 class OpenAIService:
     """Service for interacting with OpenAI APIs."""
     
-    def __init__(self, api_key: str):
-        self.client = openai.OpenAI(api_key=api_key)
+    CHAT_MODEL = "gpt-4o"
+    # Callers time out and cancel calls themselves; this only bounds a request left
+    # without one
+    REQUEST_TIMEOUT = 120.0
+    # How much of a streaming completion progress reports carry; resending all of
+    # it with every token would cost quadratic time and bandwidth
+    PROGRESS_TAIL_CHARS = 200
     
-    async def _run_sync_in_executor(self, func, *args, **kwargs):
-        """Run synchronous OpenAI calls in executor."""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+    def __init__(self, api_key: str, http_client: Optional[httpx.AsyncClient] = None):
+        # Retries are left to the service manager's retry policies. Requests are made
+        # on the event loop, so a completion waiting on the model ties up no thread,
+        # and cancelling a call closes its request.
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key, timeout=self.REQUEST_TIMEOUT, max_retries=0, http_client=http_client
+        )
+    
+    async def warm_up(self, connections: int = 4):
+        """Open pooled connections ahead of the first completions.
+        
+        Lists the models with ``connections`` requests at once, which also checks
+        the key. Failures are logged, as the first real call will report them anyway.
+        """
+        results = await asyncio.gather(
+            *(self.client.models.list() for _ in range(max(1, connections))), return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.warning(f"OpenAI connection warm-up failed: {str(errors[0])}")
+        else:
+            logger.info(f"Warmed up {len(results)} OpenAI connections")
+    
+    async def _complete(self, messages: List[Dict[str, Any]], **options) -> str:
+        """Text of a chat completion.
+        
+        When a node is listening, the completion is streamed, and the end of the text
+        so far (``tail``) and the number of tokens are reported to it as ``progress``
+        events as tokens arrive.
+        """
+        if current_event_sink.get() is None:
+            response = await self.client.chat.completions.create(model=self.CHAT_MODEL, messages=messages, **options)
+            return response.choices[0].message.content
+        
+        chunks: List[str] = []
+        tail = ""
+        stream = await self.client.chat.completions.create(
+            model=self.CHAT_MODEL, messages=messages, stream=True, **options
+        )
+        async with stream:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                chunks.append(delta)
+                tail = (tail + delta)[-self.PROGRESS_TAIL_CHARS:]
+                emit_node_event("progress", {
+                    "stage": "generating",
+                    "tail": tail,
+                    "tokens": len(chunks),
+                    "message": f"Writing with {self.CHAT_MODEL} ({len(chunks)} tokens)"
+                })
+        return "".join(chunks)
     
     async def text_to_text(self, inputs: List[str], task: str = "combine") -> str:
         """Process multiple text inputs into a single output."""
@@ -44,21 +133,17 @@ Provide a clear, concise summary that captures the main points."""
             
             logger.info(f"Processing {len(inputs)} text inputs with task: {task}")
             
-            response = await self._run_sync_in_executor(
-                self.client.chat.completions.create,
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
+            result = await self._complete(
+                [{"role": "user", "content": prompt}],
                 max_tokens=1000,
                 temperature=0.7
             )
-            
-            result = response.choices[0].message.content
             logger.info("Text processing completed successfully")
             return result
             
         except Exception as e:
             logger.error(f"OpenAI text-to-text failed: {str(e)}")
-            raise Exception(f"Text processing failed: {str(e)}")
+            raise Exception(f"Text processing failed: {str(e)}") from e
     
     async def image_to_text(self, image_url: str, prompt: Optional[str] = None) -> str:
         """Analyze image and generate text description or answer questions."""
@@ -83,20 +168,16 @@ Provide a clear, concise summary that captures the main points."""
                 "image_url": {"url": image_url}
             })
             
-            response = await self._run_sync_in_executor(
-                self.client.chat.completions.create,
-                model="gpt-4o",
-                messages=[{"role": "user", "content": content}],
+            result = await self._complete(
+                [{"role": "user", "content": content}],
                 max_tokens=500
             )
-            
-            result = response.choices[0].message.content
             logger.info("Image analysis completed successfully")
             return result
             
         except Exception as e:
             logger.error(f"OpenAI image-to-text failed: {str(e)}")
-            raise Exception(f"Image analysis failed: {str(e)}")
+            raise Exception(f"Image analysis failed: {str(e)}") from e
     
     async def text_image_to_text(self, image_url: str, text_prompt: str) -> str:
         """Answer questions about an image using text prompt."""
@@ -108,20 +189,16 @@ Provide a clear, concise summary that captures the main points."""
                 {"type": "image_url", "image_url": {"url": image_url}}
             ]
             
-            response = await self._run_sync_in_executor(
-                self.client.chat.completions.create,
-                model="gpt-4o",
-                messages=[{"role": "user", "content": content}],
+            result = await self._complete(
+                [{"role": "user", "content": content}],
                 max_tokens=500
             )
-            
-            result = response.choices[0].message.content
             logger.info("Image QA completed successfully")
             return result
             
         except Exception as e:
             logger.error(f"OpenAI text+image-to-text failed: {str(e)}")
-            raise Exception(f"Image QA failed: {str(e)}")
+            raise Exception(f"Image QA failed: {str(e)}") from e
     
     async def _image_url_to_base64(self, image_url: str) -> str:
         """Convert image URL to base64 data URI."""
@@ -0,0 +1,137 @@
+"""Retry policies for provider calls: backoff with jitter, Retry-After and error classification."""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+import httpx
+import openai
+import requests
+
+from .timeouts import ProviderTimeoutError, RunDeadlineExceeded
+
+# HTTP statuses worth another attempt: timeouts, conflicts, rate limits, server errors
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Network-level failures that say nothing about the request itself
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    httpx.TransportError,
+    requests.ConnectionError,
+    requests.Timeout,
+    ConnectionError,
+    TimeoutError,
+    ProviderTimeoutError,
+)
+
+
+class SubmittedJobError(Exception):
+    """A job the provider had already accepted failed, or its result could not be fetched.
+    
+    Calling again would submit, and pay for, a second job, so this is never retried
+    as a whole; services retry transient failures on the job itself instead.
+    """
+
+
+class RetryPolicy:
+    """How many attempts a provider call gets and how long to wait between them."""
+    
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        max_retry_after: float = 120.0
+    ):
+        if max_attempts < 1:
+            raise ValueError("A retry policy needs at least one attempt")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Longest Retry-After a provider may ask for before we wait max_retry_after instead
+        self.max_retry_after = max_retry_after
+    
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff after failed attempt number ``attempt``."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+    
+    def delay_for(self, attempt: int, error: BaseException) -> float:
+        """Seconds to wait before retrying, preferring the provider's Retry-After."""
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return self.backoff(attempt)
+
+
+# Keys follow the concurrency limits and timeouts. Video jobs are slow and expensive,
+# so they get fewer, more widely spaced attempts.
+DEFAULT_RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    "openai": RetryPolicy(max_attempts=4, base_delay=1.0),
+    "fal": RetryPolicy(max_attempts=3, base_delay=2.0),
+    "fal:fal-ai/bytedance/seedance/v1/lite/text-to-video": RetryPolicy(max_attempts=2, base_delay=10.0),
+    "fal:fal-ai/bytedance/seedance/v1/lite/image-to-video": RetryPolicy(max_attempts=2, base_delay=10.0),
+}
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+def _error_chain(error: Optional[BaseException]) -> Iterator[BaseException]:
+    """The error followed by the errors it was raised from or while handling."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status_and_headers(error: BaseException) -> Tuple[Optional[int], Dict[str, str]]:
+    """HTTP status and response headers carried by an OpenAI, fal.ai or httpx error."""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None)
+    if status is None and isinstance(response, (httpx.Response, requests.Response)):
+        status = response.status_code
+    headers = getattr(error, "response_headers", None)
+    if headers is None and response is not None:
+        headers = getattr(response, "headers", None)
+    return status, {key.lower(): value for key, value in (headers or {}).items()}
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from Retry-After(-Ms) headers anywhere in the chain."""
+    for cause in _error_chain(error):
+        _, headers = _status_and_headers(cause)
+        if "retry-after-ms" in headers:
+            try:
+                return max(0.0, float(headers["retry-after-ms"]) / 1000)
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed provider call might succeed if simply tried again.
+    
+    Services wrap provider errors in generic exceptions, so the whole cause chain is
+    inspected. Anything not recognised as transient is treated as permanent.
+    """
+    for cause in _error_chain(error):
+        if isinstance(cause, (RunDeadlineExceeded, SubmittedJobError)):
+            return False
+        status, _ = _status_and_headers(cause)
+        if status is not None:
+            return status in RETRYABLE_STATUS_CODES
+        if isinstance(cause, RETRYABLE_ERRORS):
+            return True
+    return False
@@ -0,0 +1,125 @@
+"""Per-run context shared between the graph processor and the service layer."""
+
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+# Identifies the graph run a provider call belongs to. Each node task sets this
+# when it starts, so calls made on its behalf can be queued fairly per run.
+current_run_id: ContextVar[Optional[str]] = ContextVar("current_run_id", default=None)
+
+# Who the current run is for, and how urgently. Provider slots go to interactive
+# work before batch work, and are shared between users in proportion to their weight.
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)  # most urgent first
+current_user_id: ContextVar[Optional[str]] = ContextVar("current_user_id", default=None)
+current_priority: ContextVar[str] = ContextVar("current_priority", default=PRIORITY_INTERACTIVE)
+
+# Estimated seconds of work from the start of the current node to the end of its
+# run along the longest path. Among one run's waiting calls, provider slots go to
+# the node with the most still hanging off it first.
+current_critical_path: ContextVar[float] = ContextVar("current_critical_path", default=0.0)
+
+# time.monotonic() value by which the current run must finish, if it has a deadline.
+# Set alongside current_run_id; provider calls never wait past it.
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+# Receives (event, payload) for things that happen inside a node's provider calls,
+# such as retries. Each node task installs one that forwards to the run's event stream.
+current_event_sink: ContextVar[Optional[Callable[[str, Dict[str, Any]], None]]] = ContextVar(
+    "current_event_sink", default=None
+)
+
+# Receives the seconds each successful provider call spent with the provider, leaving
+# out waits for a slot and retry backoff. Each node task installs one to learn how
+# long its operation takes.
+current_call_timer: ContextVar[Optional[Callable[[float], None]]] = ContextVar(
+    "current_call_timer", default=None
+)
+
+# A provider job that an interrupted attempt at the current node submitted, as
+# {"provider", "endpoint", "request_id"}. A service about to submit a job to that
+# endpoint waits on this one instead (see take_provider_job), so a resumed run
+# doesn't pay for it twice.
+current_provider_job: ContextVar[Optional[Dict[str, str]]] = ContextVar("current_provider_job", default=None)
+
+
+def emit_node_event(event: str, payload: Dict[str, Any]):
+    """Report an event to the node currently executing, if anyone is listening."""
+    sink = current_event_sink.get()
+    if sink is not None:
+        sink(event, payload)
+
+
+def record_call_time(seconds: float):
+    """Report a provider call's duration to the node that made it, if it is listening."""
+    timer = current_call_timer.get()
+    if timer is not None:
+        timer(seconds)
+
+
+def take_provider_job(provider: str, endpoint: str) -> Optional[str]:
+    """Request id of the current node's interrupted job at ``endpoint``, if it has one.
+    
+    It is handed out once: should waiting on it fail, the node's retries submit afresh.
+    """
+    job = current_provider_job.get()
+    if job is None or job.get("provider") != provider or job.get("endpoint") != endpoint:
+        return None
+    return job.pop("request_id", None)
+
+
+class ProgressThrottle:
+    """Forwards a node's ``progress`` reports at most once every ``interval`` seconds.
+    
+    The first report goes out at once. Reports arriving within the interval are merged,
+    and the result is sent when the interval is up. Later values win key by key, so a
+    field only some reports carry (the queue position, say) isn't lost, and ``logs``
+    lines accumulate (the last MAX_LOG_LINES are kept). A provider streaming tokens or
+    log lines can't flood the run's event stream this way.
+    
+    Reports carry whichever of these apply: ``stage`` (queued, running, generating),
+    ``queue_position``, ``percent`` (0-100), ``logs`` (new lines), ``text`` (output so
+    far), ``tokens`` and ``message``.
+    """
+    
+    MAX_LOG_LINES = 20
+    
+    def __init__(self, forward: Callable[[Dict[str, Any]], None], interval: float):
+        self.forward = forward
+        self.interval = interval
+        self._pending: Optional[Dict[str, Any]] = None
+        self._last_sent = float("-inf")
+        self._timer: Optional[asyncio.TimerHandle] = None
+    
+    def report(self, details: Dict[str, Any]):
+        pending = self._pending or {}
+        logs: List[str] = [*pending.get("logs", ()), *details.get("logs", ())]
+        self._pending = {**pending, **details}
+        if logs:
+            self._pending["logs"] = logs[-self.MAX_LOG_LINES:]
+        if self._timer is not None:
+            return
+        delay = self._last_sent + self.interval - time.monotonic()
+        if delay <= 0:
+            self.flush()
+        else:
+            self._timer = asyncio.get_event_loop().call_later(delay, self.flush)
+    
+    def flush(self):
+        """Send the merged reports now, if there are any."""
+        self._timer = None
+        if self._pending is None:
+            return
+        details, self._pending = self._pending, None
+        self._last_sent = time.monotonic()
+        self.forward(details)
+    
+    def close(self):
+        """Drop reports not sent yet; the node's outcome supersedes them."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = None
@@ -1,9 +1,18 @@
 """Service manager to coordinate all external service integrations."""
 
+import asyncio
 import logging
-from typing import List, Optional
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .concurrency import ConcurrencyManager
+from .metrics import PROVIDER_CALL_ERRORS, PROVIDER_CALL_SECONDS
 from .fal_service import FalService
-from .openai_service import OpenAIService
+from .openai_service import OpenAIService, make_http_client
+from .retry import DEFAULT_RETRY_POLICIES, NO_RETRY, RetryPolicy, is_retryable
+from .run_context import current_priority, current_user_id, emit_node_event, record_call_time
+from .singleflight import SingleFlight, make_call_key
+from .tracing import tracer
+from .timeouts import DEFAULT_PROVIDER_TIMEOUTS, ProviderTimeoutError, RunDeadlineExceeded, remaining_run_time
 
 logger = logging.getLogger(__name__)
 
@@ -11,30 +20,157 @@ logger = logging.getLogger(__name__)
 class ServiceManager:
     """Manages all external service integrations."""
     
-    def __init__(self, openai_api_key: Optional[str] = None, fal_api_key: Optional[str] = None):
-        self.openai_service = OpenAIService(openai_api_key) if openai_api_key else None
+    def __init__(
+        self, 
+        openai_api_key: Optional[str] = None, 
+        fal_api_key: Optional[str] = None,
+        concurrency_limits: Optional[Dict[str, int]] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        retry_policies: Optional[Dict[str, Dict[str, Any]]] = None,
+        user_weights: Optional[Dict[str, float]] = None,
+        openai_pool: Optional[Dict[str, Any]] = None,
+        concurrency_processes: int = 1
+    ):
+        # Options for make_http_client; the pool outlives key changes, so connections stay warm
+        self.openai_pool = dict(openai_pool or {})
+        self.openai_http = None
+        self.openai_service = self._make_openai_service(openai_api_key) if openai_api_key else None
         self.fal_service = FalService(fal_api_key) if fal_api_key else None
+        self.concurrency = ConcurrencyManager(concurrency_limits, user_weights, concurrency_processes)
+        self.timeouts = dict(DEFAULT_PROVIDER_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.retry_policies = dict(DEFAULT_RETRY_POLICIES)
+        for key, options in (retry_policies or {}).items():
+            self.retry_policies[key] = RetryPolicy(**options)
+        # Identical calls running at the same time (e.g. many users starting the same
+        # example workflow) share one provider request
+        self.in_flight = SingleFlight()
     
     def update_keys(self, openai_api_key: Optional[str] = None, fal_api_key: Optional[str] = None):
         """Update API keys for services."""
         if openai_api_key:
-            self.openai_service = OpenAIService(openai_api_key)
+            self.openai_service = self._make_openai_service(openai_api_key)
         if fal_api_key:
             self.fal_service = FalService(fal_api_key)
     
+    def _make_openai_service(self, api_key: str) -> OpenAIService:
+        if self.openai_http is None:
+            self.openai_http = make_http_client(**self.openai_pool)
+        return OpenAIService(api_key, self.openai_http)
+    
+    async def warm_up(self, openai_connections: int = 4):
+        """Open provider connections ahead of the first calls."""
+        if self.openai_service is not None and openai_connections > 0:
+            await self.openai_service.warm_up(openai_connections)
+    
+    async def aclose(self):
+        """Close pooled provider connections."""
+        if self.openai_http is not None:
+            await self.openai_http.aclose()
+            self.openai_http = None
+    
+    def get_timeout(self, provider: str, endpoint: str) -> Optional[float]:
+        """Timeout for one call to ``endpoint``, falling back to the provider's."""
+        return self.timeouts.get(f"{provider}:{endpoint}", self.timeouts.get(provider))
+    
+    def get_retry_policy(self, provider: str, endpoint: str) -> RetryPolicy:
+        """Retry policy for calls to ``endpoint``, falling back to the provider's."""
+        return self.retry_policies.get(f"{provider}:{endpoint}", self.retry_policies.get(provider, NO_RETRY))
+    
+    async def _call(self, provider: str, endpoint: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Run a provider call in its concurrency slot, within its timeout and the run's deadline.
+        
+        Waiting for the slot counts against the run deadline but not the call timeout.
+        Either running out cancels the call, which lets the service abort the request.
+        Transient failures are retried according to the endpoint's retry policy, and a
+        call identical to one already in flight waits for that one instead.
+        """
+        remaining = remaining_run_time()
+        if remaining is not None and remaining <= 0:
+            raise RunDeadlineExceeded("Run deadline exceeded before the call could start")
+        # Only callers of the same user at the same priority share a call, so nobody
+        # waits for a provider slot on another user's share or a batch row's priority
+        key = make_call_key(provider, endpoint, func.__name__, args, current_user_id.get(), current_priority.get())
+        shared = self.in_flight.do(key, lambda: self._call_with_retries(provider, endpoint, func, *args))
+        try:
+            # Each caller keeps its own deadline even when the call itself is shared
+            return await asyncio.wait_for(shared, remaining)
+        except asyncio.TimeoutError:
+            raise RunDeadlineExceeded(f"Run deadline exceeded while waiting for {endpoint}")
+    
+    async def _call_with_retries(self, provider: str, endpoint: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        policy = self.get_retry_policy(provider, endpoint)
+        attempt = 1
+        while True:
+            try:
+                return await self._call_in_slot(provider, endpoint, func, *args)
+            except Exception as e:
+                if attempt >= policy.max_attempts or not is_retryable(e):
+                    raise
+                delay = policy.delay_for(attempt, e)
+                remaining = remaining_run_time()
+                if remaining is not None and delay >= remaining:
+                    # No point waiting for a retry the deadline would cut off
+                    raise
+                
+                logger.warning(
+                    f"{endpoint} attempt {attempt}/{policy.max_attempts} failed, retrying in {delay:.1f}s: {str(e)}"
+                )
+                emit_node_event("retry", {
+                    "attempt": attempt,
+                    "max_attempts": policy.max_attempts,
+                    "delay": delay,
+                    "error": str(e)
+                })
+                # The slot is released while waiting, so the backoff never blocks other runs
+                with tracer.span("backoff", "provider", endpoint=endpoint, attempt=attempt, delay=delay):
+                    await asyncio.sleep(delay)
+                attempt += 1
+    
+    async def _call_in_slot(self, provider: str, endpoint: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        async with self.concurrency.slot(provider, endpoint):
+            timeout = self.get_timeout(provider, endpoint)
+            started = time.monotonic()
+            outcome = "success"
+            try:
+                with tracer.span(endpoint, "provider", provider=provider, operation=func.__name__):
+                    result = await asyncio.wait_for(func(*args), timeout)
+                record_call_time(time.monotonic() - started)
+                return result
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                PROVIDER_CALL_ERRORS.inc(provider=provider, endpoint=endpoint, error=outcome)
+                # Not a TimeoutError subclass, so _call does not mistake it for the deadline
+                raise ProviderTimeoutError(f"{endpoint} did not respond within {timeout:g}s")
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            except Exception as e:
+                outcome = "error"
+                PROVIDER_CALL_ERRORS.inc(
+                    provider=provider, endpoint=endpoint, error="transient" if is_retryable(e) else "permanent"
+                )
+                raise
+            finally:
+                PROVIDER_CALL_SECONDS.observe(
+                    time.monotonic() - started, provider=provider, endpoint=endpoint, outcome=outcome
+                )
+    
     async def process_text_to_text(self, inputs: List[str], task: str = "combine") -> str:
         """Process text-to-text operations."""
         if not self.openai_service:
             raise Exception("OpenAI API key not configured")
         
-        return await self.openai_service.text_to_text(inputs, task)
+        return await self._call("openai", OpenAIService.CHAT_MODEL, self.openai_service.text_to_text, inputs, task)
     
     async def process_text_to_image(self, prompt: str, aspect_ratio: str = "1:1") -> str:
         """Process text-to-image operations."""
         if not self.fal_service:
             raise Exception("fal.ai API key not configured")
         
-        return await self.fal_service.text_to_image(prompt, aspect_ratio)
+        return await self._call(
+            "fal", FalService.TEXT_TO_IMAGE_ENDPOINT, self.fal_service.text_to_image, prompt, aspect_ratio
+        )
     
     async def process_text_to_video(
         self, 
@@ -47,14 +183,19 @@ class ServiceManager:
         if not self.fal_service:
             raise Exception("fal.ai API key not configured")
         
-        return await self.fal_service.text_to_video(prompt, aspect_ratio, resolution, duration)
+        return await self._call(
+            "fal", FalService.TEXT_TO_VIDEO_ENDPOINT, self.fal_service.text_to_video,
+            prompt, aspect_ratio, resolution, duration
+        )
     
     async def process_text_image_to_image(self, prompt: str, image_url: str) -> str:
         """Process text+image-to-image operations."""
         if not self.fal_service:
             raise Exception("fal.ai API key not configured")
         
-        return await self.fal_service.text_image_to_image(prompt, image_url)
+        return await self._call(
+            "fal", FalService.TEXT_IMAGE_TO_IMAGE_ENDPOINT, self.fal_service.text_image_to_image, prompt, image_url
+        )
     
     async def process_image_to_video(
         self, 
@@ -67,7 +208,10 @@ class ServiceManager:
         if not self.fal_service:
             raise Exception("fal.ai API key not configured")
         
-        return await self.fal_service.image_to_video(image_url, prompt, resolution, duration)
+        return await self._call(
+            "fal", FalService.IMAGE_TO_VIDEO_ENDPOINT, self.fal_service.image_to_video,
+            image_url, prompt, resolution, duration
+        )
     
     async def process_image_to_text(self, image_url: str, prompt: Optional[str] = None) -> str:
         """Process image-to-text operations."""
@@ -75,16 +219,33 @@ class ServiceManager:
             raise Exception("OpenAI API key not configured")
         
         if prompt:
-            return await self.openai_service.text_image_to_text(image_url, prompt)
+            return await self._call(
+                "openai", OpenAIService.CHAT_MODEL, self.openai_service.text_image_to_text, image_url, prompt
+            )
         else:
-            return await self.openai_service.image_to_text(image_url)
+            return await self._call("openai", OpenAIService.CHAT_MODEL, self.openai_service.image_to_text, image_url)
     
     async def upload_file_to_fal(self, file_path: str) -> str:
         """Upload file to fal.ai storage."""
         if not self.fal_service:
             raise Exception("fal.ai API key not configured")
         
-        return await self.fal_service.upload_file(file_path)
+        with tracer.span("upload", "provider", provider="fal"):
+            return await self.fal_service.upload_file(file_path)
+    
+    def get_concurrency_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Get active/queued counts and wait times for each provider limit."""
+        return self.concurrency.get_metrics()
+    
+    def get_in_flight_metrics(self) -> Dict[str, int]:
+        """Get counts of provider calls started and of callers that shared one."""
+        return self.in_flight.get_metrics()
+    
+    def get_fal_requests(self) -> List[Dict[str, Any]]:
+        """Get the fal.ai jobs this process is waiting on, with their queue status."""
+        if not self.fal_service:
+            return []
+        return [request.to_dict() for request in list(self.fal_service.requests.values())]
     
     def is_openai_configured(self) -> bool:
         """Check if OpenAI service is configured."""
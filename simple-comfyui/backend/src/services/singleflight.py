@@ -0,0 +1,146 @@
+"""In-flight deduplication of identical provider calls."""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .run_context import current_call_timer, current_event_sink
+
+logger = logging.getLogger(__name__)
+
+
+def make_call_key(
+    provider: str, endpoint: str, operation: str, args: tuple, user_id: Optional[str], priority: str
+) -> str:
+    """Hash everything that identifies a provider call, and who it runs for at what priority."""
+    payload = json.dumps([provider, endpoint, operation, list(args), user_id, priority], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Listeners:
+    """Event sinks and call timers of the nodes waiting on one call.
+    
+    Installed in the call's own context, so whatever the call reports reaches every
+    node waiting on it. The last ``job`` event is kept and replayed to nodes that
+    join after the job was submitted, so each of them records it.
+    """
+    
+    __slots__ = ("sinks", "timers", "job")
+    
+    def __init__(self):
+        self.sinks: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.timers: List[Callable[[float], None]] = []
+        self.job: Optional[Dict[str, Any]] = None
+    
+    def join(self, sink: Optional[Callable[[str, Dict[str, Any]], None]], timer: Optional[Callable[[float], None]]):
+        if sink is not None:
+            self.sinks.append(sink)
+            if self.job is not None:
+                sink("job", self.job)
+        if timer is not None:
+            self.timers.append(timer)
+    
+    def leave(self, sink: Optional[Callable[[str, Dict[str, Any]], None]], timer: Optional[Callable[[float], None]]):
+        if sink is not None:
+            self.sinks.remove(sink)
+        if timer is not None:
+            self.timers.remove(timer)
+    
+    def emit(self, event: str, payload: Dict[str, Any]):
+        if event == "job":
+            self.job = payload
+        for sink in list(self.sinks):
+            sink(event, payload)
+    
+    def record(self, seconds: float):
+        for timer in list(self.timers):
+            timer(seconds)
+
+
+class _Flight:
+    """One running call, the number of callers waiting on it and their listeners."""
+    
+    __slots__ = ("task", "waiters", "listeners")
+    
+    def __init__(self, task: asyncio.Task, listeners: _Listeners):
+        self.task = task
+        self.waiters = 0
+        self.listeners = listeners
+
+
+class SingleFlight:
+    """Lets concurrent callers of the same operation share a single call.
+    
+    The first caller for a key starts the call; anyone arriving with the same key
+    before it finishes waits for that call instead of starting another, and gets the
+    same result or exception. Finished calls are forgotten straight away: this only
+    merges calls that overlap in time, caching results is left to the ResultCache.
+    
+    The call runs as its own task in the first caller's context, so its run id, its
+    user, its priority and its deadline are the ones the call is attributed to.
+    Callers that must not borrow each other's fair share or priority need different
+    keys, which is why make_call_key includes both. The events the call reports
+    (retries, progress, the job it submitted) and its duration go to the node of
+    every caller still waiting on it. A caller giving up does not disturb the others;
+    the call is only cancelled once every caller waiting on it has gone.
+    """
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        
+        # Metrics
+        self.started = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        self.max_waiters = 0
+    
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Await ``func()``, or the call already running under ``key``."""
+        flight = self._flights.get(key)
+        if flight is None:
+            listeners = _Listeners()
+            
+            async def call():
+                # The task's own context copy; the first caller's node hears it via ``listeners``
+                current_event_sink.set(listeners.emit)
+                current_call_timer.set(listeners.record)
+                return await func()
+            
+            flight = _Flight(asyncio.ensure_future(call()), listeners)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._forget(key, flight))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        self.max_waiters = max(self.max_waiters, flight.waiters)
+        sink, timer = current_event_sink.get(), current_call_timer.get()
+        flight.listeners.join(sink, timer)
+        
+        try:
+            # Shielded so that one caller being cancelled leaves the call to the rest
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.listeners.leave(sink, timer)
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Nobody is left to receive the result
+                logger.info("Cancelling provider call abandoned by all of its callers")
+                flight.task.cancel()
+                self.abandoned += 1
+    
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+    
+    def get_metrics(self) -> Dict[str, int]:
+        """Counts of calls started, callers that joined a running call, and so on."""
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "max_waiters": self.max_waiters,
+        }
@@ -0,0 +1,31 @@
+"""Per-provider call timeouts and run deadlines."""
+
+import time
+from typing import Dict, Optional
+
+from .run_context import current_deadline
+
+# Seconds a single provider call may take once it holds its concurrency slot. Keys
+# follow the concurrency limits: a provider ("openai", "fal") or "fal:<endpoint>".
+DEFAULT_PROVIDER_TIMEOUTS: Dict[str, float] = {
+    "openai": 120,
+    "fal": 300,
+    "fal:fal-ai/bytedance/seedance/v1/lite/text-to-video": 900,
+    "fal:fal-ai/bytedance/seedance/v1/lite/image-to-video": 900,
+}
+
+
+class ProviderTimeoutError(Exception):
+    """A provider call ran past its configured timeout."""
+
+
+class RunDeadlineExceeded(Exception):
+    """The run a call belongs to ran out of time."""
+
+
+def remaining_run_time() -> Optional[float]:
+    """Seconds left before the current run's deadline, or None if it has none."""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
@@ -0,0 +1,323 @@
+"""In-process spans for graph runs, exportable as Chrome trace events or OTLP JSON.
+
+Spans are attributed to the run in ``current_run_id`` (or one given explicitly) and
+nest under the span open in the current context, so a provider call made by a node
+lands under that node, under its run. Nothing is recorded outside of a run, and an
+open span is only a few attributes until it ends, so tracing is cheap enough to
+leave on.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .run_context import current_run_id
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "simple-comfyui"
+
+# Wall-clock nanoseconds at perf_counter_ns() == 0, so spans get precise durations
+# and still line up with timestamps from other systems
+_EPOCH_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def _now_ns() -> int:
+    return _EPOCH_NS + time.perf_counter_ns()
+
+
+class Span:
+    """One timed operation within a run."""
+    
+    __slots__ = (
+        "run_id", "span_id", "parent_id", "name", "category", "lane", "start_ns", "end_ns", "attributes", "error"
+    )
+    
+    def __init__(
+        self,
+        run_id: str,
+        span_id: str,
+        parent_id: Optional[str],
+        name: str,
+        category: str,
+        lane: str,
+        attributes: Dict[str, Any]
+    ):
+        self.run_id = run_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category  # run, node, provider, db, ...
+        self.lane = lane  # the node a span belongs to, or "run"
+        self.start_ns = _now_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+    
+    @property
+    def duration_ns(self) -> int:
+        return (self.end_ns or _now_ns()) - self.start_ns
+
+
+# The span open in the current context; new spans in the same run nest under it
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _Trace:
+    __slots__ = ("root", "spans", "dropped")
+    
+    def __init__(self):
+        self.root: Optional[Span] = None
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+
+class Tracer:
+    """Keeps the finished spans of the most recent runs in memory.
+    
+    With ``export_dir`` set, every run's trace is also written there as
+    ``<run_id>.chrome.json`` and ``<run_id>.otlp.json`` when the run ends.
+    """
+    
+    def __init__(self, max_runs: int = 256, max_spans_per_run: int = 10000, export_dir: Optional[str] = None):
+        self.max_runs = max_runs
+        self.max_spans_per_run = max_spans_per_run
+        self.export_dir = Path(export_dir) if export_dir else None
+        self._traces: "OrderedDict[str, _Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+    
+    def start(
+        self,
+        name: str,
+        category: str,
+        run_id: Optional[str] = None,
+        lane: Optional[str] = None,
+        **attributes: Any
+    ) -> Optional[Span]:
+        """Open a span; None (and nothing recorded) outside of a run."""
+        run_id = run_id or current_run_id.get()
+        if run_id is None:
+            return None
+        parent = current_span.get()
+        if parent is not None and parent.run_id != run_id:
+            parent = None
+        with self._lock:
+            trace = self._trace(run_id)
+            if parent is None:
+                parent = trace.root
+        return Span(
+            run_id,
+            f"{os.getpid():08x}{next(self._ids):08x}",
+            parent.span_id if parent else None,
+            name,
+            category,
+            lane or (parent.lane if parent else "run"),
+            attributes
+        )
+    
+    def end(self, span: Optional[Span], error: Optional[BaseException] = None):
+        """Close a span and keep it with its run."""
+        if span is None:
+            return
+        span.end_ns = _now_ns()
+        if error is not None:
+            span.error = str(error) or type(error).__name__
+        with self._lock:
+            trace = self._trace(span.run_id)
+            if len(trace.spans) < self.max_spans_per_run:
+                trace.spans.append(span)
+            else:
+                trace.dropped += 1
+    
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        category: str,
+        run_id: Optional[str] = None,
+        lane: Optional[str] = None,
+        **attributes: Any
+    ) -> Iterator[Optional[Span]]:
+        """Time the body as a span, with spans opened inside it nested under it."""
+        span = self.start(name, category, run_id, lane, **attributes)
+        if span is None:
+            yield None
+            return
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(span, e)
+            raise
+        else:
+            self.end(span)
+        finally:
+            current_span.reset(token)
+    
+    def start_run(self, run_id: str, **attributes: Any) -> Span:
+        """Open the span covering a whole run; spans of the run without a parent go under it."""
+        span = self.start("run", "run", run_id, "run", **attributes)
+        with self._lock:
+            self._trace(run_id).root = span
+        return span
+    
+    def end_run(self, span: Span, error: Optional[BaseException] = None):
+        """Close a run's span and export the run's trace if configured to."""
+        self.end(span, error)
+        if self.export_dir is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._export_quietly(span.run_id)
+        else:
+            # Serialising a big trace takes a while; keep it off the event loop
+            loop.run_in_executor(None, self._export_quietly, span.run_id)
+    
+    def _export_quietly(self, run_id: str):
+        try:
+            self.export(run_id, self.export_dir)
+        except Exception as e:
+            logger.warning(f"Failed to export trace of run {run_id}: {str(e)}")
+    
+    def _trace(self, run_id: str) -> _Trace:
+        # Caller holds the lock
+        trace = self._traces.get(run_id)
+        if trace is None:
+            trace = self._traces[run_id] = _Trace()
+            while len(self._traces) > self.max_runs:
+                self._traces.popitem(last=False)
+        else:
+            self._traces.move_to_end(run_id)
+        return trace
+    
+    def get_spans(self, run_id: str) -> Optional[List[Span]]:
+        """Finished spans of a run in the order they ended, or None if it is not known."""
+        with self._lock:
+            trace = self._traces.get(run_id)
+            return list(trace.spans) if trace is not None else None
+    
+    def get_owner(self, run_id: str) -> Optional[str]:
+        """The ``user_id`` a run was traced for ("" if anonymous), or None if it has no trace."""
+        with self._lock:
+            trace = self._traces.get(run_id)
+            if trace is not None and trace.root is not None:
+                return trace.root.attributes.get("user_id", "")
+        exported = self.load_export(run_id, "chrome")
+        if exported is None:
+            return None
+        for event in exported["traceEvents"]:
+            if event.get("cat") == "run":
+                return event["args"].get("user_id", "")
+        return None
+    
+    def export(self, run_id: str, directory: Path):
+        """Write a run's trace to ``directory`` in both formats."""
+        spans = self.get_spans(run_id)
+        if not spans:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        for suffix, document in (("chrome", to_chrome_trace(spans)), ("otlp", to_otlp(spans))):
+            path = directory / f"{_safe(run_id)}.{suffix}.json"
+            partial = path.with_name(path.name + ".part")
+            partial.write_text(json.dumps(document))
+            partial.replace(path)
+    
+    def load_export(self, run_id: str, suffix: str) -> Optional[Dict[str, Any]]:
+        """A trace exported earlier, possibly by another process; None if there is none."""
+        if self.export_dir is None:
+            return None
+        path = self.export_dir / f"{_safe(run_id)}.{suffix}.json"
+        if not path.is_file():
+            return None
+        return json.loads(path.read_text())
+
+
+def to_chrome_trace(spans: List[Span]) -> Dict[str, Any]:
+    """Trace-event JSON for chrome://tracing or Perfetto, one thread per node."""
+    lanes: Dict[str, int] = {"run": 0}
+    events: List[Dict[str, Any]] = []
+    for span in sorted(spans, key=lambda span: span.start_ns):
+        tid = lanes.setdefault(span.lane, len(lanes))
+        args = dict(span.attributes)
+        if span.error is not None:
+            args["error"] = span.error
+        events.append({
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": span.start_ns / 1000,
+            "dur": span.duration_ns / 1000,
+            "pid": 1,
+            "tid": tid,
+            "args": args
+        })
+    for lane, tid in lanes.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": lane}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    """OTLP/JSON (ExportTraceServiceRequest) that collectors and most trace viewers accept."""
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            "traceId": _trace_id(span.run_id),
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or _now_ns()),
+            "attributes": [
+                _otlp_attribute(key, value)
+                for key, value in [("category", span.category), ("lane", span.lane), *span.attributes.items()]
+            ],
+            "status": {"code": 2, "message": span.error} if span.error is not None else {"code": 1}
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}]
+        }]
+    }
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def _trace_id(run_id: str) -> str:
+    """Run ids are already 32 hex digits; anything else is hashed into that shape."""
+    if len(run_id) == 32 and all(c in "0123456789abcdef" for c in run_id):
+        return run_id
+    return hashlib.sha256(run_id.encode("utf-8")).hexdigest()[:32]
+
+
+def _safe(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+
+
+# Shared by the graph processor, the services and the run workers
+tracer = Tracer()
@@ -5,9 +5,14 @@ from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, MagicMock, patch
 import json
 import io
+import asyncio
+from datetime import timedelta
 
-from ..main import app
-from ..models import GraphDefinition, Node, Edge, NodeType, NodeData
+from ..auth import create_access_token, get_optional_user
+from ..main import app, until_disconnected
+from ..services.tracing import tracer
+from ..models import GraphDefinition, Node, Edge, NodeType, NodeData, ExecutionResult
+from ..user_models import User
 
 
 @pytest.fixture
@@ -184,10 +189,7 @@ class TestGraphExecution:
         mock_service_manager.is_fal_configured.return_value = True
         
         # Mock successful execution
-        mock_execution_result = MagicMock()
-        mock_execution_result.success = True
-        mock_execution_result.nodes = []
-        mock_execution_result.errors = []
+        mock_execution_result = ExecutionResult(success=True, nodes=[], errors=[])
         mock_graph_processor.execute_graph = AsyncMock(return_value=mock_execution_result)
         
         response = client.post("/run-graph", json=sample_graph)
@@ -204,10 +206,7 @@ class TestGraphExecution:
         mock_service_manager.is_fal_configured.return_value = True
         
         # Mock failed execution
-        mock_execution_result = MagicMock()
-        mock_execution_result.success = False
-        mock_execution_result.nodes = []
-        mock_execution_result.errors = ["Service error"]
+        mock_execution_result = ExecutionResult(success=False, nodes=[], errors=["Service error"])
         mock_graph_processor.execute_graph = AsyncMock(return_value=mock_execution_result)
         
         response = client.post("/run-graph", json=sample_graph)
@@ -215,6 +214,238 @@ class TestGraphExecution:
         data = response.json()
         assert data["success"] is False
         assert len(data["errors"]) > 0
+    
+    @patch('src.main.graph_processor')
+    @patch('src.main.service_manager')
+    def test_run_graph_with_invalid_token_is_anonymous(
+        self, mock_service_manager, mock_graph_processor, client, sample_graph
+    ):
+        """Test that a bad or expired token is treated like no token rather than rejected."""
+        mock_service_manager.is_openai_configured.return_value = True
+        mock_service_manager.is_fal_configured.return_value = True
+        mock_graph_processor.execute_graph = AsyncMock(return_value=ExecutionResult(success=True, nodes=[]))
+        expired = create_access_token({"sub": "maker"}, timedelta(minutes=-1))
+        
+        for token in ("not-a-token", expired):
+            response = client.post("/run-graph", json=sample_graph, headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200
+            assert response.json()["success"] is True
+    
+    @patch('src.main.graph_processor')
+    @patch('src.main.service_manager')
+    def test_run_graph_with_targets(self, mock_service_manager, mock_graph_processor, client, sample_graph):
+        """Test that repeated ``targets`` query parameters reach the processor."""
+        mock_service_manager.is_openai_configured.return_value = True
+        mock_service_manager.is_fal_configured.return_value = True
+        mock_graph_processor.execute_graph = AsyncMock(return_value=ExecutionResult(success=True, nodes=[]))
+        
+        response = client.post("/run-graph?targets=image1&targets=text1", json=sample_graph)
+        assert response.status_code == 200
+        assert mock_graph_processor.execute_graph.call_args.args[3] == ["image1", "text1"]
+    
+    @patch('src.main.graph_processor')
+    @patch('src.main.service_manager')
+    def test_run_batch_streams_ndjson(self, mock_service_manager, mock_graph_processor, client, sample_graph):
+        """Test that batch records come back one JSON object per line."""
+        mock_service_manager.is_openai_configured.return_value = True
+        mock_service_manager.is_fal_configured.return_value = True
+        
+        async def fake_batch(graph, rows, max_concurrency, user_id, priority):
+            assert (user_id, priority) == (None, "batch")
+            yield {"type": "batch_start", "total_rows": len(rows)}
+            for index, overrides in enumerate(rows):
+                yield {"type": "row", "row": index, "prompt": overrides["text1"].text}
+            yield {"type": "batch_complete", "total_rows": len(rows)}
+        
+        mock_graph_processor.execute_batch = fake_batch
+        
+        response = client.post("/run-batch", json={
+            "graph": sample_graph,
+            "rows": [{"text1": {"text": "A cat"}}, {"text1": {"text": "A dog"}}]
+        })
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        records = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["type"] for r in records] == ["batch_start", "row", "row", "batch_complete"]
+        assert records[2]["prompt"] == "A dog"
+    
+    def test_run_batch_rejects_unknown_override_field(self, client, sample_graph):
+        """Test that only node input fields can be overridden."""
+        response = client.post("/run-batch", json={
+            "graph": sample_graph,
+            "rows": [{"text1": {"result": "forged"}}]
+        })
+        assert response.status_code == 422
+
+
+class TestQueuedRuns:
+    """Test submitting runs and polling for their state."""
+    
+    @patch('src.main.run_workers')
+    @patch('src.main.run_store')
+    @patch('src.main.service_manager')
+    def test_submit_returns_run_id(self, mock_service_manager, mock_run_store, mock_run_workers, client, sample_graph):
+        """Test that submitting only queues the run and wakes the workers."""
+        mock_service_manager.is_openai_configured.return_value = True
+        mock_run_store.create_run.return_value = "run123"
+        mock_run_workers.submit = AsyncMock()
+        
+        response = client.post("/runs", json={"graph": sample_graph, "targets": ["image1"]})
+        assert response.status_code == 202
+        assert response.json() == {"run_id": "run123", "status": "queued"}
+        assert mock_run_store.create_run.call_args.args[0].targets == ["image1"]
+        mock_run_workers.submit.assert_awaited_once_with("run123")
+    
+    @patch('src.main.run_workers')
+    @patch('src.main.run_store')
+    @patch('src.main.service_manager')
+    def test_submit_is_scheduled_for_signed_in_user(
+        self, mock_service_manager, mock_run_store, mock_run_workers, client, sample_graph
+    ):
+        """Test that runs are queued under the signed-in user with the requested priority."""
+        mock_service_manager.is_openai_configured.return_value = True
+        mock_run_store.create_run.return_value = "run123"
+        mock_run_workers.submit = AsyncMock()
+        app.dependency_overrides[get_optional_user] = lambda: User(id=7, username="maker")
+        try:
+            response = client.post("/runs", json={"graph": sample_graph, "priority": "batch"})
+        finally:
+            app.dependency_overrides.clear()
+        
+        assert response.status_code == 202
+        run, user_id = mock_run_store.create_run.call_args.args
+        assert (run.priority, user_id) == ("batch", "7")
+        assert client.post("/runs", json={"graph": sample_graph, "priority": "urgent"}).status_code == 422
+    
+    @patch('src.main.run_store')
+    def test_poll_unknown_and_unfinished_runs(self, mock_run_store, client):
+        """Test 404 for unknown runs and 409 for results that are not ready."""
+        mock_run_store.get_owner.side_effect = [None, None, ""]
+        mock_run_store.get_result.return_value = ("running", None)
+        
+        assert client.get("/runs/nope").status_code == 404
+        assert client.get("/runs/nope/result").status_code == 404
+        response = client.get("/runs/run123/result")
+        assert response.status_code == 409
+        assert "running" in response.json()["detail"]
+    
+    @patch('src.main.run_store')
+    def test_store_is_not_called_on_the_event_loop(self, mock_run_store, client):
+        """Test that the synchronous run store is only used from worker threads."""
+        on_loop = []
+        
+        def recorder(value):
+            def record(run_id):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(True)
+                except RuntimeError:
+                    on_loop.append(False)
+                return value
+            return record
+        
+        mock_run_store.get_owner.side_effect = recorder("")
+        mock_run_store.get_status.side_effect = recorder(None)
+        mock_run_store.get_result.side_effect = recorder(None)
+        
+        assert client.get("/runs/run123").status_code == 404
+        assert client.get("/runs/run123/result").status_code == 404
+        assert on_loop == [False] * 4
+    
+    @patch('src.main.run_workers')
+    @patch('src.main.run_store')
+    def test_runs_are_private_to_their_user(self, mock_run_store, mock_run_workers, client):
+        """Test that someone else's run, or its trace, looks like an unknown run."""
+        mock_run_store.get_owner.return_value = "7"
+        mock_run_store.resume_run.return_value = "failed"
+        mock_run_workers.submit = AsyncMock()
+        run = tracer.start_run("privaterun", user_id="7")
+        tracer.end_run(run)
+        
+        for path in ("/runs/run123", "/runs/run123/result", "/runs/privaterun/trace"):
+            assert client.get(path).status_code == 404
+        assert client.post("/runs/run123/resume").status_code == 404
+        app.dependency_overrides[get_optional_user] = lambda: User(id=8, username="other")
+        try:
+            assert client.get("/runs/privaterun/trace").status_code == 404
+            app.dependency_overrides[get_optional_user] = lambda: User(id=7, username="maker")
+            assert client.get("/runs/privaterun/trace").status_code == 200
+            assert client.post("/runs/run123/resume").status_code == 202
+        finally:
+            app.dependency_overrides.clear()
+    
+    def test_run_trace(self, client):
+        """Test the trace of a run in both formats, and 404 for runs without one."""
+        run = tracer.start_run("tracedrun")
+        tracer.end(tracer.start("image1", "node", "tracedrun", lane="image1"))
+        tracer.end_run(run)
+        
+        chrome = client.get("/runs/tracedrun/trace")
+        assert chrome.status_code == 200
+        assert {event["name"] for event in chrome.json()["traceEvents"]} >= {"run", "image1"}
+        otlp = client.get("/runs/tracedrun/trace?format=otlp").json()
+        assert len(otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]) == 2
+        assert client.get("/runs/tracedrun/trace?format=svg").status_code == 422
+        assert client.get("/runs/nope/trace").status_code == 404
+    
+    def test_metrics(self, client):
+        """Test that requests are measured by route template and exposed in the Prometheus format."""
+        client.get("/runs/first/trace")
+        client.get("/runs/second/trace")
+        
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        lines = response.text.splitlines()
+        count = next(
+            line for line in lines
+            if line.startswith('http_request_duration_seconds_count{method="GET",route="/runs/{run_id}/trace"')
+        )
+        assert int(count.rsplit(" ", 1)[1]) >= 2
+        assert not any("/runs/first" in line for line in lines)
+        assert any(line.startswith('cache_hit_ratio{cache="plan"}') for line in lines)
+        assert any(line.startswith("executor_threads_max ") for line in lines)
+    
+    @patch('src.main.run_workers')
+    @patch('src.main.run_store')
+    def test_resume_only_failed_runs(self, mock_run_store, mock_run_workers, client):
+        """Test that only failed runs can be resumed."""
+        mock_run_store.get_owner.side_effect = [None, "", ""]
+        mock_run_store.resume_run.side_effect = ["succeeded", "failed"]
+        mock_run_workers.submit = AsyncMock()
+        
+        assert client.post("/runs/nope/resume").status_code == 404
+        assert client.post("/runs/run123/resume").status_code == 409
+        response = client.post("/runs/run123/resume")
+        assert response.status_code == 202
+        assert response.json() == {"run_id": "run123", "status": "queued"}
+        mock_run_workers.submit.assert_awaited_once_with("run123")
+
+
+class TestDisconnect:
+    """Test that streaming endpoints stop work for clients that went away."""
+    
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_producer(self, monkeypatch):
+        """Test that a silent producer is cancelled once the client disconnects."""
+        monkeypatch.setattr("src.main.DISCONNECT_POLL_SECONDS", 0.01)
+        request = MagicMock()
+        request.is_disconnected = AsyncMock(side_effect=[False, True])
+        cancelled = asyncio.Event()
+        
+        async def events():
+            yield {"type": "start"}
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            yield {"type": "complete"}
+        
+        received = [event async for event in until_disconnected(request, events())]
+        
+        assert received == [{"type": "start"}]
+        await asyncio.wait_for(cancelled.wait(), 1)
 
 
 class TestFileUpload:
@@ -235,6 +466,16 @@ class TestFileUpload:
         assert data["filename"] == "test.jpg"
         assert data["file_url"].startswith("/uploads/")
     
+    def test_upload_url_follows_content(self, client):
+        """Test that a changed file under the same name gets a new URL, and the same file keeps its URL."""
+        def upload(content):
+            files = {"file": ("photo.png", io.BytesIO(content), "image/png")}
+            return client.post("/upload-file", files=files).json()["file_url"]
+        
+        first = upload(b"first version")
+        assert upload(b"second version") != first
+        assert upload(b"first version") == first
+    
     def test_upload_video_file(self, client):
         """Test uploading a video file."""
         video_content = b"fake video content"
@@ -1,12 +1,20 @@
 """Tests for graph processor functionality."""
 
 import pytest
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 import asyncio
+import threading
+import sys
+import time
 
-from ..models import GraphDefinition, Node, Edge, NodeType, NodeData
-from ..graph_processor import GraphProcessor
+from ..models import GraphDefinition, Node, Edge, NodeType, NodeData, ConnectionType, NodeOverride
+from ..execution_plan import graph_structure
+from ..graph_processor import CYCLE_REPORT_LIMIT, GraphProcessor
+from ..result_cache import ResultCache
 from ..services import ServiceManager
+from ..services.run_context import current_deadline, emit_node_event, record_call_time
+from ..services.metrics import GRAPH_RUNS, NODE_EXECUTION_SECONDS
+from ..services.tracing import tracer
 
 
 @pytest.fixture
@@ -80,6 +88,48 @@ class TestGraphValidation:
         assert result.valid is False
         assert any("cycle" in error.message.lower() for error in result.errors)
     
+    def test_cycle_error_names_only_cycle_members(self, graph_processor):
+        """Test that nodes merely downstream of a cycle are not reported as part of it."""
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="root", type=NodeType.TEXT, data=NodeData(text="Hello")),
+                Node(id="loop1", type=NodeType.TEXT, data=NodeData()),
+                Node(id="loop2", type=NodeType.TEXT, data=NodeData()),
+                Node(id="after", type=NodeType.TEXT, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="root", target="loop1"),
+                Edge(id="e2", source="loop1", target="loop2"),
+                Edge(id="e3", source="loop2", target="loop1"),
+                Edge(id="e4", source="loop2", target="after")
+            ]
+        )
+        
+        result = graph_processor.validate_graph(graph)
+        assert result.valid is False
+        assert [error.message for error in result.errors] == [
+            "Graph contains cycles which would prevent execution (nodes: loop1, loop2)"
+        ]
+    
+    def test_long_chain_does_not_recurse(self, graph_processor):
+        """Test that validation depth is not bounded by the recursion limit."""
+        length = sys.getrecursionlimit() * 5
+        nodes = [Node(id="n0", type=NodeType.TEXT, data=NodeData(text="Hello"))]
+        edges = []
+        for i in range(1, length):
+            nodes.append(Node(id=f"n{i}", type=NodeType.TEXT, data=NodeData()))
+            edges.append(Edge(id=f"e{i}", source=f"n{i - 1}", target=f"n{i}"))
+        graph = GraphDefinition(nodes=nodes, edges=edges)
+        
+        assert graph_processor.validate_graph(graph).valid is True
+        assert graph_processor._topological_sort(graph) == [f"n{i}" for i in range(length)]
+        
+        # Close the chain into one big loop
+        graph.edges.append(Edge(id="back", source=f"n{length - 1}", target="n0"))
+        result = graph_processor.validate_graph(graph)
+        assert result.valid is False
+        assert result.errors[0].message.endswith(f"and {length - CYCLE_REPORT_LIMIT} more)")
+    
     def test_invalid_node_without_data(self, graph_processor):
         """Test validation of node without required input data."""
         graph = GraphDefinition(
@@ -231,6 +281,500 @@ class TestGraphExecution:
         # Check that the error is recorded in the node
         image_node = next(n for n in result.nodes if n.id == "image1")
         assert image_node.data.error is not None
+    
+    @pytest.mark.asyncio
+    async def test_failure_skips_descendants_only(self, graph_processor, mock_service_manager):
+        """Test that nodes downstream of a failure are skipped while other branches finish."""
+        mock_service_manager.process_text_to_image.side_effect = Exception("Service error")
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A lighthouse")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="video1", type=NodeType.VIDEO, data=NodeData(result="http://example.com/stale.mp4")),
+                Node(id="text2", type=NodeType.TEXT, data=NodeData()),
+                Node(id="video2", type=NodeType.VIDEO, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="text1", target="image1"),
+                Edge(id="e2", source="image1", target="video1"),
+                Edge(id="e3", source="image1", target="text2"),
+                Edge(id="e4", source="text1", target="video2")
+            ]
+        )
+        
+        events = [e async for e in graph_processor.execute_graph_streaming(graph)]
+        
+        skipped = [e for e in events if e["type"] == "node_skipped"]
+        assert {e["node_id"] for e in skipped} == {"video1", "text2"}
+        assert all(e["failed_node_id"] == "image1" for e in skipped)
+        assert events[-1]["skipped_nodes"] == [e["node_id"] for e in skipped]
+        assert events[-1]["completed_nodes"] == 5
+        assert len(events[-1]["errors"]) == 1
+        assert graph.nodes[2].data.result is None
+        mock_service_manager.process_image_to_video.assert_not_called()
+        mock_service_manager.process_image_to_text.assert_not_called()
+        mock_service_manager.process_text_to_video.assert_called_once_with("A lighthouse")
+    
+    @pytest.mark.asyncio
+    async def test_independent_branches_run_concurrently(self, graph_processor, mock_service_manager):
+        """Test that independent branches overlap instead of running back to back."""
+        in_flight = 0
+        max_in_flight = 0
+        
+        async def slow_image(prompt):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return f"http://example.com/{prompt}.jpg"
+        
+        mock_service_manager.process_text_to_image.side_effect = slow_image
+        
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="cat")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="image2", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="image3", type=NodeType.IMAGE, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="text1", target="image1"),
+                Edge(id="e2", source="text1", target="image2"),
+                Edge(id="e3", source="text1", target="image3")
+            ]
+        )
+        
+        result = await graph_processor.execute_graph(graph)
+        
+        assert result.success is True
+        assert max_in_flight == 3
+        assert all(n.data.result == "http://example.com/cat.jpg" for n in result.nodes if n.type == NodeType.IMAGE)
+    
+    @pytest.mark.asyncio
+    async def test_streaming_yields_in_completion_order(self, graph_processor, mock_service_manager):
+        """Test that a fast node is reported before a slow one started earlier."""
+        async def slow_video(prompt, *args):
+            await asyncio.sleep(0.05)
+            return "http://example.com/video.mp4"
+        
+        mock_service_manager.process_text_to_video.side_effect = slow_video
+        
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A river")),
+                Node(id="video1", type=NodeType.VIDEO, data=NodeData()),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="text1", target="video1"),
+                Edge(id="e2", source="text1", target="image1")
+            ]
+        )
+        
+        events = [event async for event in graph_processor.execute_graph_streaming(graph)]
+        completed = [e["node_id"] for e in events if e["type"] == "node_complete"]
+        
+        assert completed == ["text1", "image1", "video1"]
+        assert [e["progress"] for e in events if e["type"] == "node_complete"] == [1 / 3, 2 / 3, 1.0]
+        assert events[-1]["type"] == "complete"
+        assert events[-1]["success"] is True
+    
+    @pytest.mark.asyncio
+    async def test_run_deadline_reaches_service_calls(self, mock_service_manager):
+        """Test that provider calls see the deadline of the run they belong to."""
+        seen = []
+        
+        async def image(prompt):
+            seen.append(current_deadline.get())
+            return "http://example.com/image.jpg"
+        
+        mock_service_manager.process_text_to_image.side_effect = image
+        processor = GraphProcessor(mock_service_manager, run_timeout=60)
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A cat")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData())
+            ],
+            edges=[Edge(id="e1", source="text1", target="image1")]
+        )
+        
+        started = time.monotonic()
+        result = await processor.execute_graph(graph)
+        
+        assert result.success is True
+        assert started + 59 < seen[0] <= time.monotonic() + 60
+        assert current_deadline.get() is None
+    
+    @pytest.mark.asyncio
+    async def test_closing_stream_cancels_running_nodes(self, graph_processor, mock_service_manager):
+        """Test that a consumer going away stops in-flight provider calls."""
+        cancelled = asyncio.Event()
+        
+        async def hung_video(prompt, *args):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        mock_service_manager.process_text_to_video.side_effect = hung_video
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A river")),
+                Node(id="video1", type=NodeType.VIDEO, data=NodeData())
+            ],
+            edges=[Edge(id="e1", source="text1", target="video1")]
+        )
+        
+        events = graph_processor.execute_graph_streaming(graph)
+        async for event in events:
+            if event["type"] == "node_start" and event["node_id"] == "video1":
+                break
+        await asyncio.sleep(0)
+        await events.aclose()
+        
+        await asyncio.wait_for(cancelled.wait(), 1)
+    
+    @pytest.mark.asyncio
+    async def test_retries_are_reported_per_node(self, graph_processor, mock_service_manager):
+        """Test that retries made by the service layer surface as node events."""
+        async def flaky_image(prompt, *args):
+            emit_node_event("retry", {"attempt": 1, "max_attempts": 3, "delay": 0.5, "error": "Rate limited"})
+            return "http://example.com/image.jpg"
+        
+        mock_service_manager.process_text_to_image.side_effect = flaky_image
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A lighthouse")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData())
+            ],
+            edges=[Edge(id="e1", source="text1", target="image1")]
+        )
+        
+        events = [event async for event in graph_processor.execute_graph_streaming(graph)]
+        
+        retry = next(e for e in events if e["type"] == "node_retry")
+        assert retry["node_id"] == "image1"
+        assert (retry["attempt"], retry["max_attempts"], retry["delay"]) == (1, 3, 0.5)
+        complete = next(e for e in events if e["type"] == "node_complete" and e["node_id"] == "image1")
+        assert complete["attempts"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_progress_is_throttled_and_merged(self, mock_service_manager):
+        """Test that a burst of provider progress reaches the stream as few merged events."""
+        async def chatty_image(prompt, *args):
+            for step in range(100):
+                emit_node_event("progress", {"stage": "running", "percent": step, "logs": [f"step {step}"]})
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.06)
+            return "http://example.com/image.jpg"
+        
+        mock_service_manager.process_text_to_image.side_effect = chatty_image
+        graph_processor = GraphProcessor(mock_service_manager, progress_interval=0.05)
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A lighthouse")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData())
+            ],
+            edges=[Edge(id="e1", source="text1", target="image1")]
+        )
+        
+        events = [event async for event in graph_processor.execute_graph_streaming(graph)]
+        
+        progress = [e for e in events if e["type"] == "node_progress"]
+        assert 2 <= len(progress) < 20
+        assert progress[0]["percent"] == 0 and progress[-1]["percent"] == 99
+        assert progress[-1]["node_id"] == "image1" and progress[-1]["logs"][-1] == "step 99"
+        complete = next(e for e in events if e["type"] == "node_complete" and e["node_id"] == "image1")
+        assert events.index(complete) > events.index(progress[-1])
+
+
+class TestIncrementalExecution:
+    """Test re-running only the nodes affected by an edit."""
+    
+    @staticmethod
+    def make_graph():
+        return GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A lighthouse")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="text2", type=NodeType.TEXT, data=NodeData(text="Waves crash")),
+                Node(id="video1", type=NodeType.VIDEO, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="text1", target="image1"),
+                Edge(id="e2", source="image1", target="video1"),
+                Edge(id="e3", source="text2", target="video1")
+            ]
+        )
+    
+    @pytest.mark.asyncio
+    async def test_only_changed_branch_is_recomputed(self, graph_processor, mock_service_manager):
+        """Test that editing the last prompt reuses the upstream image."""
+        graph = self.make_graph()
+        await graph_processor.execute_graph(graph)
+        
+        # The client sends back the graph with results and one edited prompt
+        graph.nodes[2].data.text = "Waves crash at night"
+        result = await graph_processor.execute_graph(graph, incremental=True)
+        
+        assert result.success is True
+        assert mock_service_manager.process_text_to_image.call_count == 1
+        assert mock_service_manager.process_image_to_video.call_count == 2
+        mock_service_manager.process_image_to_video.assert_called_with(
+            "http://example.com/image.jpg", "Waves crash at night"
+        )
+    
+    @pytest.mark.asyncio
+    async def test_previous_run_id_supplies_results(self, graph_processor, mock_service_manager):
+        """Test that an unchanged graph is fully reused from a stored run."""
+        first = await graph_processor.execute_graph(self.make_graph())
+        
+        events = [
+            e async for e in graph_processor.execute_graph_streaming(
+                self.make_graph(), incremental=True, previous_run_id=first.run_id
+            )
+        ]
+        
+        assert events[0]["reused_nodes"] == 4
+        assert all(e["reused"] for e in events if e["type"] == "node_complete")
+        assert mock_service_manager.process_text_to_image.call_count == 1
+        assert mock_service_manager.process_image_to_video.call_count == 1
+    
+    def test_replaced_upload_changes_fingerprints(self, graph_processor):
+        """Test that a new upload in a source node invalidates everything downstream of it."""
+        graph = GraphDefinition(
+            nodes=[
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData(file_url="/uploads/image_1f0c_photo.png")),
+                Node(id="text1", type=NodeType.TEXT, data=NodeData())
+            ],
+            edges=[Edge(id="e1", source="image1", target="text1")]
+        )
+        before = graph_processor.compute_fingerprints(graph)
+        
+        graph.nodes[0].data.file_url = "/uploads/image_9e2d_photo.png"
+        after = graph_processor.compute_fingerprints(graph)
+        
+        assert all(before[node_id] != after[node_id] for node_id in ("image1", "text1"))
+
+
+class TestPartialExecution:
+    """Test running only the nodes a set of targets depends on."""
+    
+    @staticmethod
+    def make_graph():
+        graph = TestIncrementalExecution.make_graph()
+        # A side branch nobody is looking at
+        graph.nodes.append(Node(id="text3", type=NodeType.TEXT, data=NodeData(text="A storm")))
+        graph.nodes.append(Node(id="video2", type=NodeType.VIDEO, data=NodeData()))
+        graph.edges.append(Edge(id="e4", source="text3", target="video2"))
+        return graph
+    
+    @pytest.mark.asyncio
+    async def test_only_ancestors_of_targets_run(self, graph_processor, mock_service_manager):
+        """Test that side branches are not executed."""
+        result = await graph_processor.execute_graph(self.make_graph(), targets=["image1"])
+        
+        assert result.success is True
+        results = {node.id: node.data.result for node in result.nodes}
+        assert results["image1"] == "http://example.com/image.jpg"
+        assert results["video1"] is None and results["video2"] is None
+        mock_service_manager.process_text_to_video.assert_not_called()
+        mock_service_manager.process_image_to_video.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_supplied_results_stop_the_pull(self, graph_processor, mock_service_manager):
+        """Test that an up-to-date upstream result is used without visiting its ancestors."""
+        graph = self.make_graph()
+        await graph_processor.execute_graph(graph, targets=["image1"])
+        
+        events = [e async for e in graph_processor.execute_graph_streaming(graph, targets=["video1"])]
+        
+        started = {e["node_id"] for e in events if e["type"] == "node_start"}
+        assert started == {"image1", "text2", "video1"}
+        assert events[0]["total_nodes"] == 3 and events[0]["reused_nodes"] == 1
+        assert mock_service_manager.process_text_to_image.call_count == 1
+        mock_service_manager.process_image_to_video.assert_called_once_with(
+            "http://example.com/image.jpg", "Waves crash"
+        )
+    
+    @pytest.mark.asyncio
+    async def test_unrelated_invalid_branch_does_not_block(self, graph_processor, mock_service_manager):
+        """Test that only validation errors among the needed nodes stop a targeted run."""
+        graph = self.make_graph()
+        graph.nodes[4].data.text = None
+        
+        partial = await graph_processor.execute_graph(graph, targets=["image1"])
+        full = await graph_processor.execute_graph(graph)
+        unknown = await graph_processor.execute_graph(graph, targets=["nope"])
+        
+        assert partial.success is True
+        assert full.success is False
+        assert unknown.errors == ["Unknown target node 'nope'"]
+
+
+class TestExecutionPlan:
+    """Test compiled plan caching."""
+    
+    @staticmethod
+    def make_graph(prompt="A"):
+        return GraphDefinition(
+            nodes=[
+                Node(id="a", type=NodeType.TEXT, data=NodeData(text=prompt)),
+                Node(id="b", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="c", type=NodeType.TEXT, data=NodeData(text="Describe")),
+                Node(id="d", type=NodeType.TEXT, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="a", target="b"),
+                Edge(id="e2", source="b", target="d"),
+                Edge(id="e3", source="c", target="d")
+            ]
+        )
+    
+    def test_plan_is_reused_for_same_structure(self, graph_processor):
+        """Test that a prompt edit hits the plan cache while a new edge does not."""
+        plan = graph_processor.get_plan(self.make_graph())
+        
+        assert graph_processor.get_plan(self.make_graph("B")) is plan
+        assert graph_processor.validate_graph(self.make_graph("C")).valid is True
+        
+        rewired = self.make_graph()
+        rewired.edges.append(Edge(id="e4", source="a", target="d"))
+        assert graph_processor.get_plan(rewired) is not plan
+        assert graph_processor.plan_cache.get_stats() == {"hits": 2, "misses": 2, "entries": 2}
+    
+    def test_structure_key_skips_reading_the_graph(self, graph_processor):
+        """Test that a known structure key finds its plan unless the graph's size changed."""
+        keyed = self.make_graph()
+        keyed.structure_key = "workflow-1:3"
+        plan = graph_processor.get_plan(keyed)
+        
+        with patch("src.graph_processor.graph_structure") as read_structure:
+            assert graph_processor.get_plan(keyed) is plan
+        read_structure.assert_not_called()
+        
+        keyed.edges.append(Edge(id="e4", source="a", target="d"))
+        rewired = graph_processor.get_plan(keyed)
+        assert rewired is not plan and len(rewired.structure.edge_field("id")) == 4
+        assert graph_processor.get_plan(keyed) is rewired
+    
+    def test_structure_covers_wiring_but_not_content(self):
+        """Test that the plan cache key changes with handles and data presence only."""
+        structure = graph_structure(self.make_graph())
+        
+        assert graph_structure(self.make_graph("Another prompt")) == structure
+        assert structure.node_ids() == ("a", "b", "c", "d")
+        assert structure.edge_field("target") == ("b", "d", "d")
+        handled = self.make_graph()
+        handled.edges[0].targetHandle = "prompt"
+        assert graph_structure(handled) != structure
+        emptied = self.make_graph("")
+        assert graph_structure(emptied) != structure
+    
+    def test_plan_contents(self, graph_processor):
+        """Test levels and expected operations of a compiled plan."""
+        plan = graph_processor.get_plan(self.make_graph())
+        
+        assert [sorted(level) for level in plan.levels] == [["a", "c"], ["b"], ["d"]]
+        assert plan.in_degree == {"a": 0, "b": 1, "c": 0, "d": 2}
+        assert plan.operations["b"] == ConnectionType.TEXT_TO_IMAGE
+        assert plan.operations["d"] == ConnectionType.TEXT_IMAGE_TO_TEXT
+        assert plan.operations["a"] is None
+
+
+class TestCriticalPath:
+    """Test starting the nodes with the most work behind them first."""
+    
+    @staticmethod
+    def make_graph():
+        # A quick image branch listed ahead of a slow video branch
+        return GraphDefinition(
+            nodes=[
+                Node(id="text1", type=NodeType.TEXT, data=NodeData(text="A cat")),
+                Node(id="image1", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="text2", type=NodeType.TEXT, data=NodeData(text="A storm")),
+                Node(id="video1", type=NodeType.VIDEO, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="text1", target="image1"),
+                Edge(id="e2", source="text2", target="video1")
+            ]
+        )
+    
+    def test_remaining_path(self, graph_processor):
+        """Test that each node is weighted by the longest chain of work from it."""
+        plan = graph_processor.get_plan(TestExecutionPlan.make_graph())
+        
+        assert plan.remaining_path({"a": 1, "b": 8, "c": 1, "d": 3}) == {"a": 12, "b": 11, "c": 4, "d": 3}
+        assert plan.remaining_path({"b": 8, "d": 3}, nodes={"b", "d"}) == {"b": 11, "d": 3}
+    
+    @pytest.mark.asyncio
+    async def test_slow_branch_starts_first(self, graph_processor):
+        """Test that the root feeding the video node is launched ahead of the one feeding the image."""
+        events = [event async for event in graph_processor.execute_graph_streaming(self.make_graph())]
+        
+        started = [event["node_id"] for event in events if event["type"] == "node_start"]
+        assert started[:2] == ["text2", "text1"]
+    
+    @pytest.mark.asyncio
+    async def test_latencies_are_learned(self, graph_processor, mock_service_manager):
+        """Test that provider call times replace the defaults and can reorder the run."""
+        # Like the ServiceManager, report the time spent with the provider, not the wait for a slot
+        async def slow_image(*args):
+            await asyncio.sleep(0.05)
+            record_call_time(0.04)
+            return "http://example.com/image.jpg"
+        
+        async def quick_video(*args):
+            record_call_time(0.001)
+            return "http://example.com/video.mp4"
+        
+        mock_service_manager.process_text_to_image.side_effect = slow_image
+        mock_service_manager.process_text_to_video.side_effect = quick_video
+        await graph_processor.execute_graph(self.make_graph())
+        
+        stats = graph_processor.latency.get_stats()
+        assert stats["text_to_image"] == {"estimate_seconds": 0.04, "samples": 1}
+        assert stats["text_to_video"] == {"estimate_seconds": 0.001, "samples": 1}
+        
+        events = [event async for event in graph_processor.execute_graph_streaming(self.make_graph())]
+        started = [event["node_id"] for event in events if event["type"] == "node_start"]
+        assert started[:2] == ["text1", "text2"]
+
+
+class TestRunObservability:
+    """Test the spans and metrics recorded for a run."""
+    
+    @pytest.mark.asyncio
+    async def test_run_is_traced(self, graph_processor, mock_service_manager):
+        """Test that a run records a span per node, with provider calls nested under their node."""
+        async def traced_image(*args):
+            with tracer.span("fal-ai/flux", "provider", provider="fal"):
+                return "http://example.com/image.jpg"
+        
+        mock_service_manager.process_text_to_image.side_effect = traced_image
+        result = await graph_processor.execute_graph(TestCriticalPath.make_graph())
+        
+        spans = {span.name: span for span in tracer.get_spans(result.run_id)}
+        run, node, call = spans["run"], spans["image1"], spans["fal-ai/flux"]
+        assert set(spans) == {"run", "text1", "image1", "text2", "video1", "fal-ai/flux"}
+        assert (node.parent_id, call.parent_id) == (run.span_id, node.span_id)
+        assert (call.lane, node.attributes["node_type"]) == ("image1", "image")
+        assert run.attributes["completed_nodes"] == 4
+    
+    @pytest.mark.asyncio
+    async def test_run_is_measured(self, graph_processor):
+        """Test that node executions and finished runs are counted in the metrics."""
+        image_labels = {"node_type": "image", "operation": "text_to_image", "outcome": "success"}
+        images = NODE_EXECUTION_SECONDS.get_count(**image_labels)
+        runs = GRAPH_RUNS.get(outcome="succeeded")
+        
+        await graph_processor.execute_graph(TestCriticalPath.make_graph())
+        
+        assert NODE_EXECUTION_SECONDS.get_count(**image_labels) == images + 1
+        assert GRAPH_RUNS.get(outcome="succeeded") == runs + 1
 
 
 class TestTopologicalSort:
@@ -277,4 +821,132 @@ class TestTopologicalSort:
         # a and b should come before c, c should come before d
         assert order.index("a") < order.index("c")
         assert order.index("b") < order.index("c")
-        assert order.index("c") < order.index("d")
\ No newline at end of file
+        assert order.index("c") < order.index("d")
+
+
+class TestResultCache:
+    """Test content-addressed caching of node results."""
+    
+    @pytest.mark.asyncio
+    async def test_identical_rerun_is_served_from_cache(self, mock_service_manager):
+        """Test that re-running an unchanged graph does not call the provider again."""
+        processor = GraphProcessor(mock_service_manager, result_cache=ResultCache())
+        
+        def make_graph(prompt):
+            return GraphDefinition(
+                nodes=[
+                    Node(id="text1", type=NodeType.TEXT, data=NodeData(text=prompt)),
+                    Node(id="image1", type=NodeType.IMAGE, data=NodeData())
+                ],
+                edges=[
+                    Edge(id="e1", source="text1", target="image1")
+                ]
+            )
+        
+        first = [e async for e in processor.execute_graph_streaming(make_graph("A cat"))]
+        second = [e async for e in processor.execute_graph_streaming(make_graph("A cat"))]
+        await processor.execute_graph(make_graph("A dog"))
+        
+        def image_event(events):
+            return next(e for e in events if e["type"] == "node_complete" and e["node_id"] == "image1")
+        
+        assert image_event(first)["cache"] == "miss"
+        assert image_event(second)["cache"] == "hit"
+        assert image_event(second)["result"] == "http://example.com/image.jpg"
+        assert mock_service_manager.process_text_to_image.call_count == 2
+    
+    def test_persistent_tier_survives_restart(self, tmp_path):
+        """Test that results written to SQLite are visible to a new cache instance."""
+        db_path = str(tmp_path / "cache.db")
+        ResultCache(db_path=db_path).set("key", "http://example.com/image.jpg")
+        
+        assert ResultCache(db_path=db_path).get("key") == "http://example.com/image.jpg"
+        assert ResultCache(db_path=db_path, ttl_seconds=0).get("missing") is None
+    
+    @pytest.mark.asyncio
+    async def test_persistent_tier_is_used_off_the_event_loop(self, tmp_path):
+        """Test that the async API reads and writes SQLite in a thread and memory inline."""
+        loop_thread = threading.get_ident()
+        cache = ResultCache(db_path=str(tmp_path / "cache.db"))
+        query_threads = []
+        cache._db.set_trace_callback(lambda statement: query_threads.append(threading.get_ident()))
+        
+        await cache.aset("key", "http://example.com/image.jpg")
+        cache._memory.clear()
+        assert await cache.aget("key") == "http://example.com/image.jpg"
+        assert await cache.aget("key") == "http://example.com/image.jpg"
+        
+        assert query_threads and loop_thread not in query_threads
+        assert cache.get_stats()["hits"] == 2
+    
+    def test_expired_and_evicted_entries_miss(self):
+        """Test TTL expiry and LRU eviction in the memory tier."""
+        expired = ResultCache(ttl_seconds=0)
+        expired.set("key", "value")
+        assert expired.get("key") is None
+        
+        cache = ResultCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get_stats()["memory_entries"] == 2
+
+
+class TestBatchExecution:
+    """Test running one graph over many rows of overrides."""
+    
+    @staticmethod
+    def make_graph():
+        return GraphDefinition(
+            nodes=[
+                Node(id="style", type=NodeType.TEXT, data=NodeData(text="Watercolor swatch")),
+                Node(id="swatch", type=NodeType.IMAGE, data=NodeData()),
+                Node(id="subject", type=NodeType.TEXT, data=NodeData(text="placeholder")),
+                Node(id="picture", type=NodeType.IMAGE, data=NodeData())
+            ],
+            edges=[
+                Edge(id="e1", source="style", target="swatch"),
+                Edge(id="e2", source="subject", target="picture")
+            ]
+        )
+    
+    @pytest.mark.asyncio
+    async def test_identical_nodes_run_once_across_rows(self, graph_processor, mock_service_manager):
+        """Test that rows running side by side share in-flight provider calls."""
+        async def slow_image(prompt):
+            await asyncio.sleep(0.02)
+            return f"http://example.com/{prompt}.jpg"
+        
+        mock_service_manager.process_text_to_image.side_effect = slow_image
+        rows = [
+            {"subject": NodeOverride(text="cat")},
+            {"subject": NodeOverride(text="dog")},
+            {"subject": NodeOverride(text="cat")}
+        ]
+        
+        records = [record async for record in graph_processor.execute_batch(self.make_graph(), rows, 3)]
+        row_records = sorted((r for r in records if r["type"] == "row"), key=lambda r: r["row"])
+        
+        assert [r["results"]["picture"] for r in row_records] == [
+            "http://example.com/cat.jpg", "http://example.com/dog.jpg", "http://example.com/cat.jpg"
+        ]
+        assert all(r["results"]["swatch"] == "http://example.com/Watercolor swatch.jpg" for r in row_records)
+        # One call for the swatch, one per distinct subject
+        assert mock_service_manager.process_text_to_image.call_count == 3
+        assert records[-1]["type"] == "batch_complete"
+        assert records[-1]["succeeded_rows"] == 3
+        assert records[-1]["shared_nodes"] == sum(r["shared_nodes"] for r in row_records) > 0
+    
+    @pytest.mark.asyncio
+    async def test_bad_row_does_not_stop_batch(self, graph_processor, mock_service_manager):
+        """Test that a row overriding an unknown node fails on its own."""
+        rows = [{"nobody": NodeOverride(text="cat")}, {"subject": NodeOverride(text="dog")}]
+        
+        records = [record async for record in graph_processor.execute_batch(self.make_graph(), rows, 1)]
+        
+        assert [r["success"] for r in records if r["type"] == "row"] == [False, True]
+        assert records[1]["errors"] == ["Override for unknown node 'nobody'"]
+        assert records[-1]["failed_rows"] == 1
@@ -0,0 +1,407 @@
+"""Tests for queued background runs."""
+
+import pytest
+import asyncio
+import threading
+import httpx
+from unittest.mock import AsyncMock, MagicMock, patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ..artifacts import ArtifactStore
+from ..database import Base
+from ..graph_processor import GraphProcessor
+from ..models import GraphDefinition, Node, Edge, NodeType, NodeData
+from ..run_models import RunSubmitRequest
+from ..run_queue import DatabaseRunQueue, RedisRunQueue, RunStore, RunWorkerPool
+from ..services import FalService, ServiceManager
+from ..services.run_context import current_provider_job
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Create a run store backed by a throwaway SQLite file."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'runs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return RunStore(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+
+@pytest.fixture
+def mock_service_manager():
+    """Create a mock service manager."""
+    manager = MagicMock(spec=ServiceManager)
+    manager.process_text_to_image = AsyncMock(return_value="http://example.com/image.jpg")
+    manager.process_image_to_video = AsyncMock(return_value="http://example.com/video.mp4")
+    return manager
+
+
+def make_request(prompt="A lighthouse", priority="interactive"):
+    return RunSubmitRequest(priority=priority, graph=GraphDefinition(
+        nodes=[
+            Node(id="text1", type=NodeType.TEXT, data=NodeData(text=prompt)),
+            Node(id="image1", type=NodeType.IMAGE, data=NodeData()),
+            Node(id="video1", type=NodeType.VIDEO, data=NodeData())
+        ],
+        edges=[
+            Edge(id="e1", source="text1", target="image1"),
+            Edge(id="e2", source="image1", target="video1")
+        ]
+    ))
+
+
+def make_pool(store, service_manager, workers=1, **kwargs):
+    return RunWorkerPool(
+        GraphProcessor(service_manager), store, workers, DatabaseRunQueue(store, poll_interval=0.01),
+        lease_timeout=0.1, **kwargs
+    )
+
+
+async def wait_until_finished(store, run_id, timeout=5):
+    async def poll():
+        while store.get_status(run_id).status in ("queued", "running"):
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+class TestRunStore:
+    """Test persisted run state."""
+    
+    def test_runs_are_claimed_once_in_submission_order(self, store):
+        """Test that workers take the oldest queued run and never the same one twice."""
+        first = store.create_run(make_request("first"))
+        second = store.create_run(make_request("second"))
+        
+        claimed = [store.claim_next("w1"), store.claim_next("w2"), store.claim_next("w1")]
+        
+        assert claimed == [first, second, None]
+        assert store.load_run(first)[0].nodes[0].data.text == "first"
+        assert store.get_status(first).status == "running"
+        assert store.claim(first, "w2") is False
+    
+    def test_interrupted_runs_are_requeued(self, store):
+        """Test that runs left running by a stopped process go back in the queue."""
+        run_id = store.create_run(make_request())
+        store.claim_next("w1")
+        store.record_event(run_id, {"type": "node_start", "node_id": "text1"})
+        
+        # The worker is still within its lease
+        assert store.requeue_interrupted(lease_timeout=60) == []
+        assert store.requeue_interrupted() == [run_id]
+        status = store.get_status(run_id)
+        assert status.status == "queued"
+        assert status.nodes == []
+        assert store.get_result(run_id) == ("queued", None)
+    
+    def test_claims_follow_priority_then_fair_share(self, store):
+        """Test that interactive runs go first and a user's backlog does not hold up other users."""
+        store.user_weights = {"2": 2}
+        batch = [store.create_run(make_request(f"b{i}", "batch"), "1") for i in range(3)]
+        heavy = [store.create_run(make_request(f"h{i}"), "1") for i in range(3)]
+        light = [store.create_run(make_request(f"l{i}"), "2") for i in range(3)]
+        
+        assert [store.get_status(run_id).queue_position for run_id in heavy + light] == [1, 4, 6, 2, 3, 5]
+        assert store.get_status(batch[0]).queue_position == 7
+        
+        claimed = [store.claim_next("w") for _ in range(9)]
+        assert claimed == [heavy[0], light[0], light[1], heavy[1], light[2], heavy[2]] + batch
+        status = store.get_status(batch[0])
+        assert status.queue_position is None
+        assert status.priority == "batch"
+        assert store.load_run(batch[0])[1]["user_id"] == "1"
+        anonymous = store.create_run(make_request())
+        assert [store.get_owner(run_id) for run_id in (batch[0], anonymous, "nope")] == ["1", "", None]
+    
+    def test_stale_worker_cannot_overwrite_run(self, store):
+        """Test that a worker whose lease lapsed no longer writes to the run."""
+        run_id = store.create_run(make_request())
+        store.claim_next("w1")
+        store.requeue_interrupted()
+        store.claim_next("w2")
+        
+        store.record_event(run_id, {"type": "node_start", "node_id": "text1"}, worker_id="w1")
+        store.finish_run(run_id, False, ["lost"], worker_id="w1")
+        
+        status = store.get_status(run_id)
+        assert status.status == "running"
+        assert status.nodes == []
+        assert store.release("w1") == []
+        assert store.release("w2") == [run_id]
+        assert store.get_status(run_id).status == "queued"
+
+
+class FakeRedis:
+    """Just enough of the asyncio Redis client for the run queue."""
+    
+    def __init__(self):
+        self.lists = {}
+    
+    async def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value.encode())
+    
+    async def brpop(self, key, timeout=0):
+        if self.lists.get(key):
+            return key.encode(), self.lists[key].pop()
+        await asyncio.sleep(0.01)
+        return None
+
+
+class TestRunWorkerPool:
+    """Test background execution of queued runs."""
+    
+    @pytest.mark.asyncio
+    async def test_queued_run_executes_and_records_state(self, store, mock_service_manager):
+        """Test that a submitted run is executed and its node states are persisted."""
+        pool = make_pool(store, mock_service_manager, workers=2)
+        await pool.start()
+        try:
+            run_id = store.create_run(make_request())
+            await pool.submit(run_id)
+            await wait_until_finished(store, run_id)
+        finally:
+            await pool.stop()
+        
+        status = store.get_status(run_id)
+        assert status.status == "succeeded"
+        assert status.completed_nodes == status.total_nodes == 3
+        assert {node.node_id: node.status for node in status.nodes} == {
+            "text1": "succeeded", "image1": "succeeded", "video1": "succeeded"
+        }
+        run_status, result = store.get_result(run_id)
+        assert result.success is True
+        assert result.run_id == run_id
+        assert result.nodes[2].data.result == "http://example.com/video.mp4"
+    
+    @pytest.mark.asyncio
+    async def test_failed_node_is_recorded(self, store, mock_service_manager):
+        """Test that errors and skipped nodes end up in the stored run."""
+        mock_service_manager.process_text_to_image.side_effect = Exception("Service error")
+        pool = make_pool(store, mock_service_manager)
+        await pool.start()
+        try:
+            run_id = store.create_run(make_request())
+            await wait_until_finished(store, run_id)
+        finally:
+            await pool.stop()
+        
+        status = store.get_status(run_id)
+        nodes = {node.node_id: node for node in status.nodes}
+        assert status.status == "failed"
+        assert nodes["image1"].status == "failed" and "Service error" in nodes["image1"].error
+        assert nodes["video1"].status == "skipped"
+        assert store.get_result(run_id)[1].skipped_nodes == ["video1"]
+    
+    @pytest.mark.asyncio
+    async def test_nodes_run_while_events_are_written(self, store, mock_service_manager):
+        """Test that a slow database holds up neither the nodes nor the events behind a write."""
+        video_started = threading.Event()
+        batches = []
+        write = store.record_events
+        
+        def slow_write(run_id, events, worker_id=None):
+            batches.append([event["type"] for event in events])
+            # The first write only lands once the last node was started
+            video_started.wait(5)
+            write(run_id, events, worker_id)
+        
+        async def video(*args):
+            video_started.set()
+            return "http://example.com/video.mp4"
+        
+        store.record_events = slow_write
+        mock_service_manager.process_image_to_video.side_effect = video
+        pool = make_pool(store, mock_service_manager)
+        await pool.start()
+        try:
+            run_id = store.create_run(make_request())
+            await wait_until_finished(store, run_id)
+        finally:
+            await pool.stop()
+        
+        assert store.get_status(run_id).status == "succeeded"
+        assert store.get_status(run_id).completed_nodes == 3
+        assert batches[0][0] == "start"
+        assert sum(len(batch) for batch in batches) == 7 and len(batches) < 7
+    
+    @pytest.mark.asyncio
+    async def test_redis_queue(self, store, mock_service_manager):
+        """Test that workers take runs from a Redis list and skip ids claimed elsewhere."""
+        queue = RedisRunQueue(store, FakeRedis())
+        pool = RunWorkerPool(GraphProcessor(mock_service_manager), store, 1, queue)
+        await pool.start()
+        try:
+            taken = store.create_run(make_request())
+            store.claim(taken, "elsewhere")
+            await pool.submit(taken)
+            run_id = store.create_run(make_request())
+            await pool.submit(run_id)
+            await wait_until_finished(store, run_id)
+        finally:
+            await pool.stop()
+        
+        assert store.get_status(run_id).status == "succeeded"
+        assert store.get_status(taken).status == "running"
+        assert queue.client.lists[queue.key] == []
+    
+    @pytest.mark.asyncio
+    async def test_redis_queue_finds_runs_whose_token_was_lost(self, store):
+        """Test that a queued run nobody pushed a token for is still claimed by a sweep."""
+        queue = RedisRunQueue(store, FakeRedis(), sweep_interval=60)
+        run_id = store.create_run(make_request())
+        
+        assert await queue.claim("w1", 1) is None
+        queue._next_sweep = 0
+        assert await queue.claim("w1", 1) == run_id
+        assert await queue.claim("w1", 1) is None
+    
+    @pytest.mark.asyncio
+    async def test_leases_are_renewed_and_released_on_stop(self, store, mock_service_manager):
+        """Test that a long run keeps its lease, and goes back in the queue when its worker stops."""
+        started = asyncio.Event()
+        
+        async def slow_image(*args):
+            started.set()
+            await asyncio.sleep(10)
+        
+        mock_service_manager.process_text_to_image.side_effect = slow_image
+        pool = make_pool(store, mock_service_manager)
+        run_id = store.create_run(make_request())
+        await pool.start()
+        try:
+            await asyncio.wait_for(started.wait(), 5)
+            await asyncio.sleep(0.3)
+            # Other pools leave a run alone while its heartbeats keep coming
+            assert store.requeue_interrupted(lease_timeout=0.1) == []
+            assert store.get_status(run_id).status == "running"
+        finally:
+            await pool.stop()
+        
+        status = store.get_status(run_id)
+        assert status.status == "queued"
+        assert [node.node_id for node in status.nodes] == ["text1"]
+
+
+class TestCheckpoints:
+    """Test resuming runs from the results they already produced."""
+    
+    @staticmethod
+    async def run_queued(store, mock_service_manager, run_id, artifacts=None):
+        pool = make_pool(store, mock_service_manager, artifacts=artifacts)
+        await pool.start()
+        try:
+            await wait_until_finished(store, run_id)
+        finally:
+            await pool.stop()
+    
+    @pytest.mark.asyncio
+    async def test_resume_failed_run_skips_finished_nodes(self, store, mock_service_manager):
+        """Test that resuming a failed run only executes what did not succeed."""
+        mock_service_manager.process_image_to_video.side_effect = [
+            Exception("Service error"), "http://example.com/video.mp4"
+        ]
+        run_id = store.create_run(make_request())
+        await self.run_queued(store, mock_service_manager, run_id)
+        assert store.get_status(run_id).status == "failed"
+        
+        assert store.resume_run(run_id) == "failed"
+        assert store.resume_run(run_id) == "queued"
+        await self.run_queued(store, mock_service_manager, run_id)
+        
+        status = store.get_status(run_id)
+        assert status.status == "succeeded"
+        assert status.errors == []
+        assert status.completed_nodes == 3
+        assert mock_service_manager.process_text_to_image.call_count == 1
+        assert mock_service_manager.process_image_to_video.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_interrupted_run_resumes_from_checkpoint(self, store, mock_service_manager):
+        """Test that a run cut off by a restart does not pay for finished nodes again."""
+        run_id = store.create_run(make_request())
+        store.claim_next("w1")
+        for node_id, result in [("text1", "A lighthouse"), ("image1", "http://example.com/old.jpg")]:
+            store.record_event(run_id, {"type": "node_start", "node_id": node_id})
+            store.record_event(run_id, {"type": "node_complete", "node_id": node_id, "result": result})
+        store.record_event(run_id, {"type": "node_start", "node_id": "video1"})
+        
+        # The worker dies; once its lease lapses another one takes over
+        await asyncio.sleep(0.1)
+        await self.run_queued(store, mock_service_manager, run_id)
+        
+        assert store.get_status(run_id).status == "succeeded"
+        mock_service_manager.process_text_to_image.assert_not_called()
+        assert mock_service_manager.process_image_to_video.call_args.args[0] == "http://example.com/old.jpg"
+    
+    @pytest.mark.asyncio
+    async def test_resumed_run_feeds_provider_urls_downstream(self, store, mock_service_manager):
+        """Test that a checkpointed image goes to image_to_video as the provider URL, not the local copy."""
+        run_id = store.create_run(make_request())
+        store.claim_next("w1")
+        for node_id, result in [("text1", "A lighthouse"), ("image1", "https://fal.media/files/cat.jpg")]:
+            store.record_event(run_id, {"type": "node_start", "node_id": node_id})
+            store.record_event(run_id, {"type": "node_complete", "node_id": node_id, "result": result})
+        store.record_artifact(run_id, "image1", f"/uploads/artifacts/{run_id}/image1.jpg")
+        store.record_event(run_id, {"type": "node_start", "node_id": "video1"})
+        assert store.requeue_interrupted() == [run_id]
+        
+        await self.run_queued(store, mock_service_manager, run_id)
+        
+        assert store.get_status(run_id).status == "succeeded"
+        mock_service_manager.process_text_to_image.assert_not_called()
+        assert mock_service_manager.process_image_to_video.call_args.args[0] == "https://fal.media/files/cat.jpg"
+        # Results still point at the durable copy
+        assert store.get_result(run_id)[1].nodes[1].data.result == f"/uploads/artifacts/{run_id}/image1.jpg"
+    
+    @pytest.mark.asyncio
+    async def test_interrupted_provider_job_is_waited_on(self, store, mock_service_manager):
+        """Test that the job a node was waiting on is handed back to it, not submitted again."""
+        run_id = store.create_run(make_request())
+        store.claim_next("w1")
+        for node_id, result in [("text1", "A lighthouse"), ("image1", "http://example.com/old.jpg")]:
+            store.record_event(run_id, {"type": "node_start", "node_id": node_id})
+            store.record_event(run_id, {"type": "node_complete", "node_id": node_id, "result": result})
+        job = {"provider": "fal", "endpoint": FalService.IMAGE_TO_VIDEO_ENDPOINT, "request_id": "req-1"}
+        store.record_event(run_id, {"type": "node_start", "node_id": "video1"})
+        store.record_event(run_id, {"type": "node_job", "node_id": "video1", **job})
+        
+        assert store.requeue_interrupted() == [run_id]
+        assert [(node.node_id, node.status) for node in store.get_status(run_id).nodes] == [
+            ("text1", "succeeded"), ("image1", "succeeded"), ("video1", "pending")
+        ]
+        assert store.load_provider_jobs(run_id) == {"video1": job}
+        resumed = []
+        
+        async def image_to_video(image_url, prompt=None):
+            resumed.append(current_provider_job.get())
+            return "http://example.com/video.mp4"
+        
+        mock_service_manager.process_image_to_video.side_effect = image_to_video
+        await self.run_queued(store, mock_service_manager, run_id)
+        
+        assert store.get_status(run_id).status == "succeeded"
+        assert resumed == [job]
+        assert store.load_provider_jobs(run_id) == {}
+    
+    @pytest.mark.asyncio
+    async def test_media_results_are_copied(self, store, mock_service_manager, tmp_path):
+        """Test that checkpoints and results point at durable copies of generated media."""
+        transport = httpx.MockTransport(lambda request: httpx.Response(
+            200, content=b"media:" + request.url.path.encode(), headers={"content-type": "image/jpeg"}
+        ))
+        real_client = httpx.AsyncClient
+        artifacts = ArtifactStore(tmp_path / "artifacts", "/uploads/artifacts")
+        run_id = store.create_run(make_request())
+        
+        with patch("src.artifacts.httpx.AsyncClient", lambda **kwargs: real_client(transport=transport, **kwargs)):
+            await self.run_queued(store, mock_service_manager, run_id, artifacts)
+        
+        image_url = f"/uploads/artifacts/{run_id}/image1.jpg"
+        assert (tmp_path / "artifacts" / run_id / "image1.jpg").read_bytes() == b"media:/image.jpg"
+        assert (tmp_path / "artifacts" / run_id / "video1.mp4").exists()
+        nodes = {node.node_id: node for node in store.get_status(run_id).nodes}
+        assert nodes["image1"].artifact_url == image_url
+        assert nodes["text1"].artifact_url is None
+        # Providers can't fetch the copy; it only stands in once their URL has expired
+        assert store.load_checkpoint(run_id)["image1"] == "http://example.com/image.jpg"
+        store.provider_url_lifetime = 0
+        assert store.load_checkpoint(run_id)["image1"] == image_url
+        assert store.get_result(run_id)[1].nodes[1].data.result == image_url
@@ -0,0 +1,866 @@
+"""Tests for the service layer helpers."""
+
+import pytest
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import fal_client
+import httpx
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+from ..services import FalService, OpenAIService, ServiceManager
+from ..services.concurrency import ConcurrencyManager, FairLimiter
+from ..services.metrics import PROVIDER_CALL_ERRORS, PROVIDER_CALL_SECONDS, InstrumentedThreadPoolExecutor, Registry
+from ..services.retry import RetryPolicy, get_retry_after, is_retryable
+from ..services.run_context import (
+    PRIORITY_BATCH, ProgressThrottle, current_call_timer, current_deadline, current_event_sink,
+    current_priority, current_provider_job, current_run_id, current_user_id, emit_node_event
+)
+from ..services.timeouts import ProviderTimeoutError, RunDeadlineExceeded
+from ..services.tracing import Tracer, to_chrome_trace, to_otlp
+
+
+class TestFairLimiter:
+    """Test per-provider concurrency limits."""
+    
+    @pytest.mark.asyncio
+    async def test_slots_are_shared_round_robin_across_runs(self):
+        """Test that a run with many queued calls cannot starve another run."""
+        limiter = FairLimiter("fal", 1)
+        await limiter.acquire("holder")
+        order = []
+        
+        async def call(owner, label):
+            await limiter.acquire(owner)
+            order.append(label)
+            limiter.release()
+        
+        tasks = [asyncio.create_task(call("a", f"a{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("b", "b0")))
+        await asyncio.sleep(0)
+        
+        assert limiter.get_metrics()["queue_depth"] == 4
+        limiter.release()
+        await asyncio.gather(*tasks)
+        
+        assert order == ["a0", "b0", "a1", "a2"]
+        assert limiter.get_metrics()["max_queue_depth"] == 4
+        assert limiter.active == 0
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        """Test that cancelling a queued call does not leak a slot."""
+        limiter = FairLimiter("openai", 1)
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        
+        limiter.release()
+        assert limiter.active == 0
+        assert limiter.get_metrics()["queue_depth"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_interactive_calls_go_before_batch(self):
+        """Test that a queued interactive call overtakes every queued batch call."""
+        limiter = FairLimiter("fal", 1)
+        await limiter.acquire("holder")
+        order = []
+        
+        async def call(owner, user, priority):
+            await limiter.acquire(owner, user, priority)
+            order.append(owner)
+            limiter.release()
+        
+        tasks = [asyncio.create_task(call(f"batch{i}", "heavy", "batch")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("interactive", "light", "interactive")))
+        await asyncio.sleep(0)
+        assert limiter.get_metrics()["waiting_users"] == {"interactive": 1, "batch": 1}
+        
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["interactive", "batch0", "batch1", "batch2"]
+    
+    @pytest.mark.asyncio
+    async def test_users_share_slots_by_weight(self):
+        """Test that users get slots in proportion to their weight, however many calls they queue."""
+        limiter = FairLimiter("fal", 1, weights={"paid": 2})
+        await limiter.acquire("holder")
+        order = []
+        
+        async def call(user, run):
+            await limiter.acquire(run, user)
+            order.append(user)
+            limiter.release()
+        
+        tasks = [asyncio.create_task(call("free", f"free{i}")) for i in range(6)]
+        tasks += [asyncio.create_task(call("paid", f"paid{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order[:9].count("paid") == 6
+        assert order[:3].count("paid") == 2
+    
+    @pytest.mark.asyncio
+    async def test_longest_critical_path_goes_first_within_a_run(self):
+        """Test that a run's waiting calls are served by how much work hangs off them."""
+        limiter = FairLimiter("fal", 1)
+        await limiter.acquire("holder")
+        order = []
+        
+        async def call(label, critical_path):
+            await limiter.acquire("run", None, "interactive", critical_path)
+            order.append(label)
+            limiter.release()
+        
+        tasks = [
+            asyncio.create_task(call(label, critical_path))
+            for label, critical_path in (("image", 8), ("video", 90), ("text", 3), ("image2", 8))
+        ]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["video", "image", "image2", "text"]
+
+
+class TestConcurrencyManager:
+    """Test provider and endpoint limits together."""
+    
+    @pytest.mark.asyncio
+    async def test_endpoint_limit_caps_parallel_calls(self):
+        """Test that an endpoint limit holds even when the provider has room."""
+        manager = ConcurrencyManager({"fal": 10, "fal:video": 2})
+        in_flight = 0
+        max_in_flight = 0
+        
+        async def call(run_id):
+            nonlocal in_flight, max_in_flight
+            current_run_id.set(run_id)
+            async with manager.slot("fal", "video"):
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+        
+        await asyncio.gather(*(call(f"run{i % 3}") for i in range(8)))
+        
+        metrics = manager.get_metrics()
+        assert max_in_flight == 2
+        assert metrics["fal:video"]["acquired"] == 8
+        assert metrics["fal:video"]["max_queue_depth"] == 6
+        assert metrics["fal"]["active"] == 0
+    
+    def test_limits_are_split_across_processes(self):
+        """Test that each of several processes gets its share of every limit, at least 1."""
+        manager = ConcurrencyManager({"fal": 10, "fal:video": 2, "openai": 16}, processes=4)
+        
+        limits = {key: limiter.limit for key, limiter in manager.limiters.items()}
+        assert (limits["fal"], limits["fal:video"], limits["openai"]) == (2, 1, 4)
+        with pytest.raises(ValueError):
+            ConcurrencyManager(processes=0)
+    
+    @pytest.mark.asyncio
+    async def test_call_time_leaves_out_slot_wait(self):
+        """Test that the time reported to the node covers the provider call, not the queue before it."""
+        manager = ServiceManager(concurrency_limits={"fal": 1}, retry_policies={"fal": {"max_attempts": 1}})
+        manager.fal_service = MagicMock()
+        
+        async def image(prompt, aspect_ratio):
+            await asyncio.sleep(0.1)
+            return f"http://example.com/{prompt}.jpg"
+        
+        manager.fal_service.text_to_image = image
+        
+        async def call(prompt):
+            call_seconds = []
+            current_call_timer.set(call_seconds.append)
+            started = time.monotonic()
+            await manager.process_text_to_image(prompt)
+            return time.monotonic() - started, call_seconds
+        
+        (_, first), (waited, second) = await asyncio.gather(call("cat"), call("dog"))
+        
+        assert waited >= 0.2
+        assert len(first) == len(second) == 1
+        assert 0.1 <= second[0] < 0.2
+
+
+class TestTimeouts:
+    """Test per-call timeouts and run deadlines."""
+    
+    @staticmethod
+    def make_manager(timeouts=None):
+        manager = ServiceManager(timeouts=timeouts, retry_policies={"fal": {"max_attempts": 1}})
+        manager.fal_service = MagicMock()
+        
+        async def slow_image(prompt, aspect_ratio):
+            await asyncio.sleep(1)
+            return "http://example.com/image.jpg"
+        
+        manager.fal_service.text_to_image = slow_image
+        return manager
+    
+    @pytest.mark.asyncio
+    async def test_call_timeout(self):
+        """Test that a slow call fails with its provider's timeout and frees its slot."""
+        manager = self.make_manager({"fal": 0.01})
+        
+        with pytest.raises(ProviderTimeoutError, match="within 0.01s"):
+            await manager.process_text_to_image("A cat")
+        assert manager.get_concurrency_metrics()["fal"]["active"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_run_deadline(self):
+        """Test that the run deadline cuts a call short and stops new calls from starting."""
+        manager = self.make_manager()
+        current_deadline.set(time.monotonic() + 0.01)
+        
+        with pytest.raises(RunDeadlineExceeded):
+            await manager.process_text_to_image("A cat")
+        with pytest.raises(RunDeadlineExceeded, match="before the call could start"):
+            await manager.process_text_to_image("A dog")
+
+
+class FakeFalQueue:
+    """Stands in for fal_client.AsyncClient: jobs complete after ``latency`` seconds."""
+    
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.jobs = {}
+        self.status_checks = 0
+        self.cancelled = []
+    
+    async def submit(self, endpoint, arguments):
+        request_id = f"req-{len(self.jobs) + 1}"
+        self.jobs[request_id] = time.monotonic() + self.latency
+        return await self.get_handle(endpoint, request_id)
+    
+    async def get_handle(self, endpoint, request_id):
+        queue = self
+        
+        class Handle:
+            async def status(self, with_logs=False):
+                queue.status_checks += 1
+                if time.monotonic() < queue.jobs[request_id]:
+                    return fal_client.Queued(position=0)
+                return fal_client.Completed(logs=None, metrics={})
+            
+            async def get(self):
+                return {"images": [{"url": f"http://example.com/{request_id}.jpg"}]}
+            
+            async def cancel(self):
+                queue.cancelled.append(request_id)
+        
+        handle = Handle()
+        handle.request_id = request_id
+        return handle
+
+
+class TestFalService:
+    """Test waiting on fal.ai queue requests from the event loop."""
+    
+    @pytest.mark.asyncio
+    async def test_cancel_reaches_fal_queue(self):
+        """Test that the request handle is cancelled when the caller is."""
+        queue = FakeFalQueue(latency=60)
+        service = FalService("test-key", queue)
+        task = asyncio.create_task(service.text_to_image("A cat"))
+        while not service.requests:
+            await asyncio.sleep(0.01)
+        assert service.requests["req-1"].status == "queued"
+        
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        
+        assert queue.cancelled == ["req-1"]
+        assert service.requests == {}
+    
+    @pytest.mark.asyncio
+    async def test_hundreds_of_jobs_do_not_hold_threads(self):
+        """Test that jobs in flight at once are polled on the event loop, with backoff."""
+        queue = FakeFalQueue(latency=1.0)
+        service = FalService("test-key", queue)
+        # Waiting on jobs in executor threads, 300 of them would take minutes on one thread
+        executor = ThreadPoolExecutor(1)
+        asyncio.get_running_loop().set_default_executor(executor)
+        
+        start = time.monotonic()
+        results = await asyncio.gather(*(service.text_to_image(f"A cat {i}") for i in range(300)))
+        
+        assert len(set(results)) == 300
+        assert time.monotonic() - start < 3.0
+        # Polled every 0.25s or less often, not continuously
+        assert queue.status_checks <= 300 * 6
+        assert service.requests == {}
+    
+    @pytest.mark.asyncio
+    async def test_resumed_node_waits_on_its_job(self):
+        """Test that a node's interrupted job is waited on once, and new jobs are reported."""
+        queue = FakeFalQueue()
+        service = FalService("test-key", queue)
+        queue.jobs["req-7"] = time.monotonic()
+        events = []
+        current_event_sink.set(lambda event, details: events.append((event, details)))
+        current_provider_job.set(
+            {"provider": "fal", "endpoint": FalService.TEXT_TO_IMAGE_ENDPOINT, "request_id": "req-7"}
+        )
+        
+        assert await service.text_to_image("A cat") == "http://example.com/req-7.jpg"
+        assert events == []
+        assert await service.text_to_image("A cat") == "http://example.com/req-2.jpg"
+        assert events == [
+            ("job", {"provider": "fal", "endpoint": FalService.TEXT_TO_IMAGE_ENDPOINT, "request_id": "req-2"})
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_status_errors_are_retried_on_the_same_job(self):
+        """Test that a transient error checking on a job does not submit another one."""
+        queue = FakeFalQueue()
+        handle = await queue.get_handle(FalService.TEXT_TO_IMAGE_ENDPOINT, "req-1")
+        handle.status = AsyncMock(side_effect=[
+            httpx.ConnectError("connection reset"), fal_client.Completed(logs=None, metrics={})
+        ])
+        queue.submit = AsyncMock(return_value=handle)
+        service = FalService("test-key", queue)
+        service.POLL_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=0)
+        
+        assert await service.text_to_image("A cat") == "http://example.com/req-1.jpg"
+        assert queue.submit.call_count == 1
+        assert handle.status.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_failed_job_is_cancelled_not_resubmitted(self):
+        """Test that giving up on a job cancels it, and the call is not retried as a whole."""
+        queue = FakeFalQueue(latency=60)
+        manager = ServiceManager(retry_policies={"fal": {"max_attempts": 3, "base_delay": 0}})
+        manager.fal_service = FalService("test-key", queue)
+        manager.fal_service.POLL_RETRY_POLICY = RetryPolicy(max_attempts=2, base_delay=0)
+        handle = await queue.get_handle(FalService.TEXT_TO_IMAGE_ENDPOINT, "req-1")
+        handle.status = AsyncMock(side_effect=TestRetries.fal_error(503))
+        queue.submit = AsyncMock(return_value=handle)
+        
+        with pytest.raises(Exception, match="Image generation failed"):
+            await manager.process_text_to_image("A cat")
+        await asyncio.sleep(0)
+        
+        assert queue.submit.call_count == 1
+        assert handle.status.call_count == 2
+        assert queue.cancelled == ["req-1"]
+    
+    @pytest.mark.asyncio
+    async def test_queue_status_is_reported_as_progress(self):
+        """Test that queue position, new log lines and percent done reach the node."""
+        statuses = [
+            fal_client.Queued(position=2),
+            fal_client.Queued(position=2),
+            fal_client.Queued(position=0),
+            fal_client.InProgress(logs=[{"message": "Loading model"}]),
+            fal_client.InProgress(logs=[{"message": "Loading model"}, {"message": " 40%|████      | 8/20"}]),
+            fal_client.Completed(logs=None, metrics={})
+        ]
+        queue = FakeFalQueue()
+        handle = await queue.get_handle(FalService.TEXT_TO_VIDEO_ENDPOINT, "req-1")
+        handle.status = AsyncMock(side_effect=statuses)
+        handle.get = AsyncMock(return_value={"video": {"url": "http://example.com/cat.mp4"}})
+        queue.submit = AsyncMock(return_value=handle)
+        service = FalService("test-key", queue)
+        service.POLL_INTERVAL = service.MAX_POLL_INTERVAL = 0
+        events = []
+        current_event_sink.set(lambda event, details: events.append((event, details)))
+        
+        assert await service.text_to_video("A cat") == "http://example.com/cat.mp4"
+        
+        assert events[0] == (
+            "job", {"provider": "fal", "endpoint": FalService.TEXT_TO_VIDEO_ENDPOINT, "request_id": "req-1"}
+        )
+        reports = [details for event, details in events[1:]]
+        assert [(r["stage"], r.get("queue_position")) for r in reports] == [
+            ("queued", 2), ("queued", 0), ("running", None), ("running", None)
+        ]
+        assert reports[2]["logs"] == ["Loading model"] and "percent" not in reports[2]
+        assert reports[3]["logs"] == [" 40%|████      | 8/20"] and reports[3]["percent"] == 40
+
+
+class TestProgressThrottle:
+    """Test coalescing progress reports from providers."""
+    
+    @pytest.mark.asyncio
+    async def test_reports_within_interval_are_merged(self):
+        """Test that the first report goes out at once and the rest are merged into one."""
+        sent = []
+        throttle = ProgressThrottle(sent.append, 0.05)
+        throttle.report({"stage": "running", "percent": 10, "logs": ["a"]})
+        throttle.report({"stage": "running", "percent": 20, "logs": ["b"]})
+        throttle.report({"stage": "running", "percent": 30, "logs": ["c"]})
+        assert sent == [{"stage": "running", "percent": 10, "logs": ["a"]}]
+        
+        await asyncio.sleep(0.1)
+        
+        assert sent[1] == {"stage": "running", "percent": 30, "logs": ["b", "c"]}
+        throttle.report({"stage": "running", "percent": 40})
+        throttle.report({"stage": "running", "percent": 50})
+        throttle.close()
+        await asyncio.sleep(0.1)
+        assert len(sent) == 3
+    
+    @pytest.mark.asyncio
+    async def test_fields_from_earlier_reports_are_kept(self):
+        """Test that merging keeps fields a later report leaves out."""
+        sent = []
+        throttle = ProgressThrottle(sent.append, 0.05)
+        throttle.report({"stage": "queued", "queue_position": 3})
+        throttle.report({"stage": "queued", "queue_position": 1, "logs": ["waiting"]})
+        throttle.report({"stage": "running", "percent": 40})
+        throttle.report({"tokens": 12})
+        
+        await asyncio.sleep(0.1)
+        
+        assert sent[1] == {
+            "stage": "running", "queue_position": 1, "logs": ["waiting"], "percent": 40, "tokens": 12
+        }
+
+
+class TestRetries:
+    """Test retrying transient provider failures."""
+    
+    @staticmethod
+    def fal_error(status, headers=None):
+        response = httpx.Response(status, headers=headers or {})
+        return fal_client.client.FalClientHTTPError("fal.ai error", status, dict(response.headers), response=response)
+    
+    @staticmethod
+    def wrapped(error):
+        """Wrap an error the way the services do."""
+        try:
+            raise error
+        except Exception as e:
+            try:
+                raise Exception(f"Image generation failed: {str(e)}") from e
+            except Exception as wrapped:
+                return wrapped
+    
+    def test_classification(self):
+        """Test retryable and permanent errors, looking through the service's wrapper."""
+        assert is_retryable(self.wrapped(self.fal_error(503))) is True
+        assert is_retryable(self.wrapped(self.fal_error(429))) is True
+        assert is_retryable(self.wrapped(httpx.ConnectError("connection refused"))) is True
+        assert is_retryable(self.wrapped(self.fal_error(422))) is False
+        assert is_retryable(self.wrapped(Exception("No images returned from fal.ai"))) is False
+        assert is_retryable(RunDeadlineExceeded("out of time")) is False
+    
+    def test_retry_after_is_honoured(self):
+        """Test that Retry-After wins over backoff, up to the policy's cap."""
+        policy = RetryPolicy(base_delay=100, max_delay=100, max_retry_after=5)
+        
+        assert policy.delay_for(1, self.wrapped(self.fal_error(429, {"Retry-After": "2"}))) == 2
+        assert policy.delay_for(1, self.wrapped(self.fal_error(429, {"Retry-After": "60"}))) == 5
+        assert get_retry_after(self.fal_error(429, {"retry-after-ms": "250"})) == 0.25
+        assert 0 <= RetryPolicy(base_delay=1, max_delay=3).delay_for(5, self.fal_error(503)) <= 3
+    
+    @pytest.mark.asyncio
+    async def test_transient_failure_is_retried(self):
+        """Test that a call recovers after a transient error and reports the retry."""
+        manager = ServiceManager(retry_policies={"fal": {"max_attempts": 3, "base_delay": 0}})
+        manager.fal_service = MagicMock()
+        calls = []
+        
+        async def flaky_image(prompt, aspect_ratio):
+            calls.append(prompt)
+            if len(calls) == 1:
+                raise self.wrapped(self.fal_error(502))
+            return "http://example.com/image.jpg"
+        
+        manager.fal_service.text_to_image = flaky_image
+        events = []
+        current_event_sink.set(lambda event, details: events.append((event, details)))
+        
+        assert await manager.process_text_to_image("A cat") == "http://example.com/image.jpg"
+        assert len(calls) == 2
+        assert [(event, details["attempt"], details["max_attempts"]) for event, details in events] == [("retry", 1, 3)]
+    
+    @pytest.mark.asyncio
+    async def test_permanent_failure_is_not_retried(self):
+        """Test that a rejected request fails on the first attempt."""
+        manager = ServiceManager(retry_policies={"fal": {"max_attempts": 3, "base_delay": 0}})
+        manager.fal_service = MagicMock()
+        manager.fal_service.text_to_image = AsyncMock(side_effect=self.wrapped(self.fal_error(422)))
+        
+        with pytest.raises(Exception, match="Image generation failed"):
+            await manager.process_text_to_image("A cat")
+        assert manager.fal_service.text_to_image.call_count == 1
+
+
+class TestInFlightDeduplication:
+    """Test that concurrent identical provider calls share one request."""
+    
+    @staticmethod
+    def make_manager():
+        manager = ServiceManager()
+        manager.fal_service = MagicMock()
+        calls = []
+        release = asyncio.Event()
+        
+        async def slow_image(prompt, aspect_ratio):
+            calls.append(prompt)
+            await release.wait()
+            return f"http://example.com/{prompt}.jpg"
+        
+        manager.fal_service.text_to_image = slow_image
+        return manager, calls, release
+    
+    @pytest.mark.asyncio
+    async def test_identical_calls_are_coalesced(self):
+        """Test that only distinct calls reach the provider."""
+        manager, calls, release = self.make_manager()
+        
+        tasks = [
+            asyncio.ensure_future(manager.process_text_to_image(prompt))
+            for prompt in ["cat", "cat", "cat", "dog"]
+        ]
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        
+        assert sorted(calls) == ["cat", "dog"]
+        assert results == ["http://example.com/cat.jpg"] * 3 + ["http://example.com/dog.jpg"]
+        metrics = manager.get_in_flight_metrics()
+        assert (metrics["started"], metrics["coalesced"], metrics["in_flight"]) == (2, 2, 0)
+    
+    @pytest.mark.asyncio
+    async def test_priorities_are_not_coalesced(self):
+        """Test that an interactive caller does not join a call made at batch priority."""
+        manager, calls, release = self.make_manager()
+        
+        async def batch_call():
+            current_priority.set(PRIORITY_BATCH)
+            return await manager.process_text_to_image("cat")
+        
+        tasks = [asyncio.ensure_future(batch_call()), asyncio.ensure_future(manager.process_text_to_image("cat"))]
+        await asyncio.sleep(0.01)
+        release.set()
+        
+        assert await asyncio.gather(*tasks) == ["http://example.com/cat.jpg"] * 2
+        assert calls == ["cat", "cat"]
+    
+    @pytest.mark.asyncio
+    async def test_users_are_not_coalesced(self):
+        """Test that one user's caller does not join a call made on another user's share."""
+        manager, calls, release = self.make_manager()
+        
+        async def call(user_id):
+            current_user_id.set(user_id)
+            return await manager.process_text_to_image("cat")
+        
+        tasks = [asyncio.ensure_future(call("1")), asyncio.ensure_future(call("2"))]
+        await asyncio.sleep(0.01)
+        release.set()
+        
+        assert await asyncio.gather(*tasks) == ["http://example.com/cat.jpg"] * 2
+        assert calls == ["cat", "cat"]
+    
+    @pytest.mark.asyncio
+    async def test_every_caller_hears_the_shared_call(self):
+        """Test that events and call times reach every waiting node, and late joiners get the job."""
+        manager, calls, release = self.make_manager()
+        job = {"provider": "fal", "endpoint": "fal-ai/imagen4/preview/fast", "request_id": "req-1"}
+        
+        async def slow_image(prompt, aspect_ratio):
+            calls.append(prompt)
+            emit_node_event("job", job)
+            await release.wait()
+            emit_node_event("progress", {"percent": 50})
+            return "http://example.com/cat.jpg"
+        
+        manager.fal_service.text_to_image = slow_image
+        heard = {}
+        
+        async def call(node_id):
+            events, times = heard.setdefault(node_id, ([], []))
+            current_event_sink.set(lambda event, details: events.append((event, details)))
+            current_call_timer.set(times.append)
+            return await manager.process_text_to_image("cat")
+        
+        first = asyncio.ensure_future(call("a"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(call("b"))
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(first, second)
+        
+        assert calls == ["cat"]
+        for events, times in heard.values():
+            assert events == [("job", job), ("progress", {"percent": 50})]
+            assert len(times) == 1
+    
+    @pytest.mark.asyncio
+    async def test_call_survives_until_last_caller_leaves(self):
+        """Test that a cancelled caller does not cancel the call for the others."""
+        manager, calls, release = self.make_manager()
+        first = asyncio.ensure_future(manager.process_text_to_image("cat"))
+        second = asyncio.ensure_future(manager.process_text_to_image("cat"))
+        await asyncio.sleep(0.01)
+        
+        first.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        
+        assert await second == "http://example.com/cat.jpg"
+        assert first.cancelled()
+        assert calls == ["cat"]
+        assert manager.get_in_flight_metrics()["abandoned"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_abandoned_call_is_cancelled(self):
+        """Test that the provider call stops once every caller has gone."""
+        manager, calls, release = self.make_manager()
+        callers = [asyncio.ensure_future(manager.process_text_to_image("cat")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.01)
+        
+        metrics = manager.get_in_flight_metrics()
+        assert (metrics["abandoned"], metrics["in_flight"]) == (1, 0)
+
+
+class TestTracing:
+    """Test per-run spans and their export formats."""
+    
+    def test_spans_nest_within_their_run(self):
+        """Test parent links, lanes and that nothing is recorded outside of a run."""
+        tracer = Tracer()
+        run = tracer.start_run("run1")
+        with tracer.span("node", "node", "run1", lane="image1") as node:
+            with tracer.span("fal-ai/flux", "provider", "run1", provider="fal") as call:
+                pass
+        with tracer.span("elsewhere", "provider") as outside:
+            pass
+        tracer.end_run(run)
+        
+        assert outside is None
+        assert call.parent_id == node.span_id and node.parent_id == run.span_id
+        assert (call.lane, call.attributes) == ("image1", {"provider": "fal"})
+        assert [span.name for span in tracer.get_spans("run1")] == ["fal-ai/flux", "node", "run"]
+        assert tracer.get_spans("unknown") is None
+    
+    def test_errors_and_limits(self):
+        """Test that failed spans keep their error and runs are bounded."""
+        tracer = Tracer(max_runs=2, max_spans_per_run=2)
+        for run_id in ("a", "b", "c"):
+            with pytest.raises(ValueError):
+                with tracer.span("call", "provider", run_id):
+                    raise ValueError("bad prompt")
+            tracer.end(tracer.start("extra", "provider", run_id))
+            tracer.end(tracer.start("dropped", "provider", run_id))
+        
+        assert tracer.get_spans("a") is None
+        assert [(span.name, span.error) for span in tracer.get_spans("c")] == [("call", "bad prompt"), ("extra", None)]
+    
+    def test_export_formats(self, tmp_path):
+        """Test the Chrome trace-event and OTLP documents and the exported files."""
+        tracer = Tracer(export_dir=str(tmp_path))
+        run_id = "0123456789abcdef0123456789abcdef"
+        run = tracer.start_run(run_id)
+        with pytest.raises(RuntimeError):
+            with tracer.span("node", "node", run_id, lane="text1", retries=2):
+                raise RuntimeError("failed")
+        tracer.end_run(run)
+        spans = tracer.get_spans(run_id)
+        
+        chrome = to_chrome_trace(spans)
+        node_event = next(event for event in chrome["traceEvents"] if event["name"] == "node")
+        assert node_event["ph"] == "X" and node_event["dur"] >= 0
+        assert node_event["args"] == {"retries": 2, "error": "failed"}
+        lanes = {event["args"]["name"]: event["tid"] for event in chrome["traceEvents"] if event["ph"] == "M"}
+        assert lanes == {"run": 0, "text1": node_event["tid"]}
+        
+        otlp_spans = to_otlp(spans)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        node_span = next(span for span in otlp_spans if span["name"] == "node")
+        assert node_span["traceId"] == run_id
+        assert node_span["parentSpanId"] == run.span_id
+        assert node_span["status"] == {"code": 2, "message": "failed"}
+        assert {"key": "retries", "value": {"intValue": "2"}} in node_span["attributes"]
+        
+        # end_run exports right away when there is no event loop to hand it to
+        assert json.loads((tmp_path / f"{run_id}.otlp.json").read_text())["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert tracer.load_export(run_id, "chrome") == json.loads(json.dumps(chrome))
+        assert tracer.load_export("missing", "chrome") is None
+
+
+class TestMetrics:
+    """Test the metrics registry and its text format."""
+    
+    def test_text_format(self):
+        """Test counters, gauges and cumulative histogram buckets as Prometheus reads them."""
+        registry = Registry()
+        requests = registry.counter("requests_total", "Requests served", ("route",))
+        running = registry.gauge("runs_in_progress", "Runs executing")
+        latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        requests.inc(route='/say "hi"')
+        requests.inc(2, route='/say "hi"')
+        for value in (0.05, 0.5, 5.0):
+            latency.observe(value, route="/runs")
+        
+        lines = registry.render().splitlines()
+        assert "# TYPE requests_total counter" in lines
+        assert 'requests_total{route="/say \\"hi\\""} 3' in lines
+        assert "runs_in_progress 0" in lines
+        assert [line for line in lines if line.startswith("latency_seconds")] == [
+            'latency_seconds_bucket{route="/runs",le="0.1"} 1',
+            'latency_seconds_bucket{route="/runs",le="1"} 2',
+            'latency_seconds_bucket{route="/runs",le="+Inf"} 3',
+            'latency_seconds_sum{route="/runs"} 5.55',
+            'latency_seconds_count{route="/runs"} 3',
+        ]
+        with pytest.raises(ValueError):
+            requests.inc(route="/", method="GET")
+        with pytest.raises(ValueError):
+            registry.counter("requests_total", "Registered twice")
+    
+    def test_collectors(self):
+        """Test that collectors are read on render and a failing one is skipped."""
+        registry = Registry()
+        
+        def broken():
+            raise RuntimeError("gone")
+        
+        executor = InstrumentedThreadPoolExecutor(2)
+        registry.add_collector(broken)
+        registry.add_collector(executor.collect)
+        release = threading.Event()
+        futures = [executor.submit(release.wait) for _ in range(3)]
+        time.sleep(0.05)
+        
+        lines = registry.render().splitlines()
+        release.set()
+        for future in futures:
+            future.result()
+        executor.shutdown()
+        assert "executor_threads_max 2" in lines
+        assert "executor_threads_busy 2" in lines
+        assert "executor_queue_depth 1" in lines
+        assert (executor.busy, executor.queued) == (0, 0)
+    
+    @pytest.mark.asyncio
+    async def test_provider_calls_are_measured(self):
+        """Test that provider call attempts are timed and their failures counted by kind."""
+        manager = ServiceManager(timeouts={"fal": 0.01}, retry_policies={"fal": {"max_attempts": 1}})
+        manager.fal_service = MagicMock()
+        endpoint = FalService.TEXT_TO_IMAGE_ENDPOINT
+        before = PROVIDER_CALL_ERRORS.get(provider="fal", endpoint=endpoint, error="timeout")
+        
+        async def hang(prompt, aspect_ratio):
+            await asyncio.sleep(1)
+        
+        manager.fal_service.text_to_image = hang
+        with pytest.raises(ProviderTimeoutError):
+            await manager.process_text_to_image("A slow cat")
+        manager.fal_service.text_to_image = AsyncMock(return_value="http://example.com/cat.jpg")
+        await manager.process_text_to_image("A cat")
+        
+        assert PROVIDER_CALL_ERRORS.get(provider="fal", endpoint=endpoint, error="timeout") == before + 1
+        assert PROVIDER_CALL_SECONDS.get_count(provider="fal", endpoint=endpoint, outcome="success") >= 1
+
+
+class TestOpenAIService:
+    """Test completions on the async client and its shared connection pool."""
+    
+    @staticmethod
+    def stub_transport(requests, delay=0.0):
+        async def handle(request):
+            requests.append(request.url.path)
+            await asyncio.sleep(delay)
+            if request.url.path.endswith("/models"):
+                return httpx.Response(200, json={"object": "list", "data": []})
+            return httpx.Response(200, json={
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": OpenAIService.CHAT_MODEL,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "A cat"}, "finish_reason": "stop"}]
+            })
+        
+        return httpx.MockTransport(handle)
+    
+    @pytest.mark.asyncio
+    async def test_completions_do_not_hold_threads(self):
+        """Test that many concurrent completions run on the event loop, not in executor threads."""
+        requests = []
+        http_client = httpx.AsyncClient(transport=self.stub_transport(requests, delay=0.1))
+        service = OpenAIService("test-key", http_client)
+        # With completions in executor threads, 50 of them would take 5s on one thread
+        executor = ThreadPoolExecutor(1)
+        asyncio.get_running_loop().set_default_executor(executor)
+        
+        start = time.monotonic()
+        results = await asyncio.gather(*(service.text_to_text([f"a {i}", "b"]) for i in range(50)))
+        
+        assert results == ["A cat"] * 50
+        assert time.monotonic() - start < 1.0
+        assert requests == ["/v1/chat/completions"] * 50
+        await http_client.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_pool_is_shared_and_warmed_up(self):
+        """Test that key changes keep the pool, warm-up opens connections and close releases it."""
+        manager = ServiceManager(openai_api_key="first-key", openai_pool={"max_connections": 8, "http2": False})
+        http_client = manager.openai_http
+        requests = []
+        http_client._transport = self.stub_transport(requests)
+        
+        manager.update_keys(openai_api_key="second-key")
+        await manager.warm_up(3)
+        
+        assert manager.openai_service.client._client is http_client
+        assert requests == ["/v1/models"] * 3
+        await manager.aclose()
+        assert http_client.is_closed and manager.openai_http is None
+    
+    @pytest.mark.asyncio
+    async def test_tokens_are_streamed_to_a_listening_node(self):
+        """Test that completions stream as progress when a node listens, and not otherwise."""
+        streamed = []
+        
+        async def handle(request):
+            body = json.loads(request.content)
+            streamed.append(body.get("stream", False))
+            if not body.get("stream"):
+                return httpx.Response(200, json={
+                    "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": OpenAIService.CHAT_MODEL,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "A cat"}, "finish_reason": "stop"}]
+                })
+            chunks = [
+                {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": OpenAIService.CHAT_MODEL,
+                 "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                for token in ("A", " cat", " sat")
+            ]
+            sse = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=sse.encode(), headers={"content-type": "text/event-stream"})
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        service = OpenAIService("test-key", http_client)
+        service.PROGRESS_TAIL_CHARS = 6
+        
+        assert await service.text_to_text(["a", "b"]) == "A cat"
+        reports = []
+        current_event_sink.set(lambda event, details: reports.append((event, details)))
+        assert await service.text_to_text(["a", "b"]) == "A cat sat"
+        
+        assert streamed == [False, True]
+        assert [details["tail"] for _, details in reports] == ["A", "A cat", "at sat"]
+        assert reports[-1] == ("progress", {
+            "stage": "generating", "tail": "at sat", "tokens": 3,
+            "message": f"Writing with {OpenAIService.CHAT_MODEL} (3 tokens)"
+        })
+        await http_client.aclose()
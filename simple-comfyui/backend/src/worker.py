@@ -0,0 +1,64 @@
+"""Standalone worker process for queued graph runs.
+
+Runs the same worker pool the API process can host, without serving HTTP, so
+execution scales out separately from the API tier. Start any number of these on
+one host (sharing the SQLite database) or on several (sharing a database server,
+with RUN_QUEUE_BACKEND=redis), and set RUN_WORKERS=0 for the API process.
+Configuration comes from the same environment variables as the API. Provider
+concurrency limits are enforced per process, so set PROVIDER_CONCURRENCY_PROCESSES
+to the number of processes (API included) for each to take its share of them.
+
+Usage: python -m src.worker [--workers 4]
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+from .main import (
+    OPENAI_WARM_CONNECTIONS, RUN_LEASE_SECONDS, artifact_store, default_executor, graph_processor, run_queue,
+    run_store, service_manager
+)
+from .run_queue import RunWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+async def serve(workers: int):
+    """Execute queued runs until SIGINT or SIGTERM."""
+    pool = RunWorkerPool(graph_processor, run_store, workers, run_queue, artifact_store, RUN_LEASE_SECONDS)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(default_executor)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            # Windows; Ctrl+C still ends the process, just without a clean stop
+            pass
+    
+    warm_up = asyncio.ensure_future(service_manager.warm_up(OPENAI_WARM_CONNECTIONS))
+    await pool.start()
+    logger.info(f"Worker {pool.worker_id} executing queued runs with {workers} workers")
+    try:
+        await stopping.wait()
+    finally:
+        # Unfinished runs go back to the queue and resume from their checkpoints
+        logger.info(f"Worker {pool.worker_id} stopping")
+        await pool.stop()
+        warm_up.cancel()
+        await service_manager.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execute queued graph runs")
+    parser.add_argument("--workers", type=int, default=4, help="runs to execute at once")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    asyncio.run(serve(args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -90,6 +90,18 @@ export const apiService = {
                     case 'node_error':
                       if (callbacks.onNodeError) callbacks.onNodeError(data);
                       break;
+                    case 'node_retry':
+                      if (callbacks.onNodeRetry) callbacks.onNodeRetry(data);
+                      break;
+                    case 'node_progress':
+                      if (callbacks.onNodeProgress) callbacks.onNodeProgress(data);
+                      break;
+                    case 'node_job':
+                      if (callbacks.onNodeJob) callbacks.onNodeJob(data);
+                      break;
+                    case 'node_skipped':
+                      if (callbacks.onNodeSkipped) callbacks.onNodeSkipped(data);
+                      break;
                     case 'complete':
                       if (callbacks.onComplete) callbacks.onComplete(data);
                       resolve(data);